@@ -3,8 +3,11 @@ from tornado.web import URLSpec as url
 
 from arteria.web.app import AppService
 
-from archive_upload.handlers.dsmc_handlers import VersionHandler, UploadHandler, StatusHandler, ReuploadHandler, CreateDirHandler, GenChecksumsHandler, CompressArchiveHandler  # , StopHandler
+from archive_upload.handlers.dsmc_handlers import VersionHandler, MetricsHandler, UploadHandler, StatusHandler, ReuploadHandler, BulkReuploadHandler, CreateDirHandler, GenChecksumsHandler, CompressArchiveHandler, ArchivePipelineHandler  # , StopHandler
 from archive_upload.lib.jobrunner import LocalQAdapter
+from archive_upload.lib.jobstore import JobStore
+from archive_upload.lib.resources import ResourcePool
+from archive_upload.lib import threads
 
 
 def routes(**kwargs):
@@ -17,14 +20,18 @@ def routes(**kwargs):
 
     return [
         url(r"/api/1.0/version", VersionHandler, name="version", kwargs=kwargs),
+        url(r"/api/1.0/metrics", MetricsHandler, name="metrics", kwargs=kwargs),
         url(r"/api/1.0/upload/([\w_-]+)", UploadHandler, name="start", kwargs=kwargs),
         url(r"/api/1.0/status/(\d*)", StatusHandler, name="status", kwargs=kwargs),
         url(r"/api/1.0/reupload/([\w_-]+)", ReuploadHandler, name="reupload", kwargs=kwargs),
+        url(r"/api/1.0/bulk_reupload", BulkReuploadHandler, name="bulkreupload", kwargs=kwargs),
         url(r"/api/1.0/create_dir/([\w_-]+)", CreateDirHandler, name="createdir", kwargs=kwargs),
         url(r"/api/1.0/gen_checksums/([\w_-]+)",
             GenChecksumsHandler, name="genchecksums", kwargs=kwargs),
         url(r"/api/1.0/compress_archive/([\w_-]+)",
-            CompressArchiveHandler, name="compressarchive", kwargs=kwargs)
+            CompressArchiveHandler, name="compressarchive", kwargs=kwargs),
+        url(r"/api/1.0/archive_pipeline/([\w_-]+)",
+            ArchivePipelineHandler, name="archivepipeline", kwargs=kwargs)
         # TODO: Implement stopping of at least LocalQ jobs.
         # url(r"/api/1.0/stop/([\d|all]*)", StopHandler, name="stop", kwargs=kwargs),
     ]
@@ -37,9 +44,16 @@ def start():
 
     app_svc = AppService.create(__package__)
 
+    app_config = app_svc.config_svc.get_app_config()
     number_of_cores_to_use = app_svc.config_svc["number_of_cores"]
     whitelist = app_svc.config_svc["whitelisted_warnings"]
+    threads.configure(app_config)
+    scheduling = app_config.get("scheduling") or {}
     runner_service = LocalQAdapter(nbr_of_cores=number_of_cores_to_use,
-                                   whitelisted_warnings=whitelist, interval=2, priority_method="fifo")
+                                   whitelisted_warnings=whitelist, interval=2,
+                                   priority_method=scheduling.get("method", "fifo"),
+                                   job_store=JobStore.from_config(app_config),
+                                   resource_pool=ResourcePool.from_config(app_config),
+                                   aging_interval=scheduling.get("aging_interval", 600))
 
     app_svc.start(routes(config=app_svc.config_svc, runner_service=runner_service))
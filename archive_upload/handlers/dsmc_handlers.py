@@ -1,13 +1,15 @@
+import collections
 import datetime
 import errno
 import json
 import logging
 import os
-import re
+import pipes
 import socket
 import stat
 import subprocess
 import shutil
+import sys
 import tarfile
 import uuid
 
@@ -15,10 +17,23 @@ from arteria.web.state import State
 from arteria.web.handlers import BaseRestHandler
 
 from archive_upload import __version__ as version
+from archive_upload.lib.checksums import CHECKSUM_FILENAME, ChecksumUtils
+from archive_upload.lib.compression import CompressionEngine
+from archive_upload.lib.dsmc import DsmcQueryParser
+from archive_upload.lib.exclusion import ExclusionMatcher
+from archive_upload.lib.inventory import ArchiveInventory
+from archive_upload.lib.manifest import ArchiveManifest
+from archive_upload.lib.notifications import JobWatcher
 from archive_upload.lib.jobrunner import LocalQAdapter
+from archive_upload.lib.metrics import LOCALQ_SLOTS, REGISTRY, REQUEST_DURATION
+from archive_upload.lib.resources import ResourcePool
+from archive_upload.lib.runfolders import RunfolderCache
+from archive_upload.lib.threads import run_in_thread
 from archive_upload.lib.utils import FileUtils
 
-from tornado import web
+from tornado import gen, web
+from tornado.ioloop import IOLoop
+from tornado.process import Subprocess
 from mock import Mock
 
 log = logging.getLogger(__name__)
@@ -49,22 +64,58 @@ set -e
         """
         self.config = config.get_app_config()
         self.runner_service = runner_service
+        notifications_config = self.config.get("notifications") or {}
+        self.job_watcher = JobWatcher.for_runner_service(
+            runner_service, poll_interval=notifications_config.get("poll_interval", 1))
 
     @staticmethod
-    def _validate_runfolder_exists(runfolder, monitored_dir):
+    def _dsmc_resources(path):
+        """
+        :param path: a path on the volume that is uploaded from
+        :return: the resources (see `ResourcePool`) of a dsmc session uploading from the volume of `path`
+        """
+        return {ResourcePool.TSM_SESSION: 1, ResourcePool.disk(path): 1}
+
+    def _request_priority(self):
+        """
+        :return: the `priority` field of the JSON body of the request, 0 if it has none
+        """
+        try:
+            request_data = json.loads(self.request.body) if self.request.body else {}
+        except ValueError:
+            request_data = {}
+        priority = request_data.get("priority", 0) if isinstance(request_data, dict) else 0
+        try:
+            return int(priority)
+        except (TypeError, ValueError):
+            raise ArchiveException(reason="`priority` must be an integer.", status_code=400)
+
+    def on_finish(self):
+        REQUEST_DURATION.observe(
+            self.request.request_time(), handler=type(self).__name__, method=self.request.method,
+            code=self.get_status())
+
+    def _register_callback(self, job_id):
+        """
+        If the request has a `callback_url` argument, register it to be POSTed to with the status of the
+        job whenever its state changes.
+
+        :param job_id: the job started by the request
+        """
+        callback_url = self.get_argument("callback_url", None)
+        if callback_url and job_id is not None:
+            self.job_watcher.add_callback(job_id, callback_url)
+
+    @staticmethod
+    def _validate_runfolder_exists(runfolder, monitored_dir, config=None):
         """
         Validate that the runfolder exists under monitored directories
         :param runfolder: The runfolder to check for
         :param monitored_dir: The root in which the runfolder should exist
+        :param config: the app config, with the settings of the `RunfolderCache` of the monitored directory
         :return: True if this is a valid runfolder
         """
-
-        if os.path.isdir(monitored_dir):
-            sub_folders = [name for name in os.listdir(monitored_dir)
-                           if os.path.isdir(os.path.join(monitored_dir, name))]
-            return runfolder in sub_folders
-        else:
-            return False
+        return RunfolderCache.from_config(config or {}, monitored_dir).exists(runfolder)
 
     @staticmethod
     def _is_valid_log_dir(log_dir):
@@ -99,14 +150,15 @@ set -e
             os.rmdir(path)
 
     @staticmethod
-    def _rename_log_file(log_dir):
+    def _rename_log_file(log_dir, log_name="dsmc_output"):
         """
         Add timestamp to existing log-files when the same archive is uploaded or reuploaded several times
 
         :param log_dir:/path/to/log-directory/dsmc_<archive name>
+        :param log_name: name of the log file in the log dir
         :return output_file-name
         """
-        output_file = os.path.join(log_dir, "dsmc_output")
+        output_file = os.path.join(log_dir, log_name)
 
         if os.path.isfile(output_file):
             #add a timestamp if the file dsmc_ouput already exist for the given archive.
@@ -125,6 +177,81 @@ set -e
                 "msg": self._reason}
         self.finish(response_data)
 
+    @staticmethod
+    def _python_module_cmd(module, *args):
+        """
+        Build a command line that runs a module of this package with the same interpreter as the service
+
+        :param module: the module to run, e.g. `archive_upload.lib.tarstream`
+        :param args: arguments to pass to the module, will be quoted for the shell
+        :return: the command as a string
+        """
+        return " ".join(
+            [pipes.quote(sys.executable), "-m", module] + [pipes.quote(str(a)) for a in args])
+
+    @staticmethod
+    def _new_event_log(config, archive, step):
+        """
+        :param config: the app config
+        :param archive: the name of the archive the job works on
+        :param step: the kind of job, e.g. "compress"
+        :return: the file in the log directory that the steps of the job write their events to (see
+                 `JobEventLog`), or None if events are not enabled in the `events` section of the config. The
+                 events of an earlier job are kept, with a timestamp added to the name of their file.
+        """
+        if not (config.get("events") or {}).get("enabled", False):
+            return None
+        return BaseDsmcHandler._rename_log_file(
+            os.path.abspath(config["log_directory"]), "{}.{}.events.jsonl".format(archive, step))
+
+    @staticmethod
+    def _step_cmd(event_log, step, cmd, size_of=None, count_lines=None):
+        """
+        Run a shell command as a step of a job, which writes its start and end to the event log of the job
+
+        :param event_log: the event log of the job, see `_new_event_log`
+        :param step: the name of the step, e.g. "tar_create"
+        :param cmd: the command to run
+        :param size_of: a file whose size is reported as the bytes the step has processed, e.g. a tarball
+        :param count_lines: a file whose number of lines is reported as the files the step has processed
+        :return: the command to run the step with, `cmd` itself if there is no event log
+        """
+        if not event_log:
+            return cmd
+        args = [event_log, step, cmd]
+        if size_of:
+            args.extend(["--size-of", size_of])
+        if count_lines:
+            args.extend(["--count-lines", count_lines])
+        return BaseDsmcHandler._python_module_cmd("archive_upload.lib.events", *args)
+
+    @staticmethod
+    def _event_log_args(event_log):
+        # the arguments that make a module of this package write its steps to the event log of the job
+        return ["--event-log", event_log] if event_log else []
+
+    @staticmethod
+    def _new_progress_file(config, archive, step):
+        """
+        :param config: the app config
+        :param archive: the name of the archive the job works on
+        :param step: the kind of job, e.g. "checksum"
+        :return: the file in the log directory that the job writes its progress to. A file left by an earlier
+                 job is removed.
+        """
+        progress_file = os.path.join(
+            os.path.abspath(config["log_directory"]), "{}.{}.progress.json".format(archive, step))
+        if os.path.exists(progress_file):
+            os.remove(progress_file)
+        return progress_file
+
+    @staticmethod
+    def _refresh_manifest_cmd(path_to_archive, manifest_file):
+        return BaseDsmcHandler._python_module_cmd(
+            "archive_upload.lib.manifest",
+            path_to_archive,
+            "--manifest-file", manifest_file)
+
     @staticmethod
     def write_command_to_wrapper(cmd, wrapper):
 
@@ -154,93 +281,123 @@ class VersionHandler(BaseDsmcHandler):
         self.write_object({"version": version})
 
 
+class MetricsHandler(BaseDsmcHandler):
+
+    """
+    Get the metrics of the service
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def get(self):
+        """
+        Returns the metrics of the service in the Prometheus text format: the latency of requests per handler,
+        how long jobs waited in the queue and ran per job type, the bytes hashed, compressed and uploaded, the
+        LocalQ cores in use and the dsmc warnings by code. The metrics start from zero when the service is
+        restarted.
+        """
+        slots = self.runner_service.slots()
+        for state in ["total", "used"]:
+            LOCALQ_SLOTS.set(slots[state], state=state)
+        self.set_header("Content-Type", MetricsHandler.CONTENT_TYPE)
+        self.write(REGISTRY.render())
+
+
 class ReuploadHelper(object):
 
     """
     Helper class for the ReuploadHandler. Methods put here mainly to faciliate easier testing.
     """
 
+    PLANNING_PHASE = "planning"
+    UPLOADING_PHASE = "uploading"
+
+    # How local files are compared with the uploaded ones, see `get_files_to_reupload`
+    COMPARE_SIZE = "size"
+    COMPARE_CHECKSUM = "checksum"
+    COMPARE_METHODS = [COMPARE_SIZE, COMPARE_CHECKSUM]
+
+    # Seconds between checks of whether an upload job has finished, to record it in the inventory
+    JOB_POLL_INTERVAL = 10
+
+    @gen.coroutine
+    def _run_dsmc_query(self, cmd, parser, on_entry):
+        """
+        Runs a dsmc query as a subprocess without blocking the IOLoop, so that other requests
+        can be served while PDC is answering. The output is parsed incrementally as it arrives,
+        so memory use does not depend on the size of the output.
+
+        :param cmd: The dsmc command to run
+        :param parser: The `DsmcQueryParser` to parse the output with
+        :param on_entry: Called with each `DsmcArchiveEntry` parsed from the output
+        :return: A Future resolving to the return code of the command
+        """
+        p = Subprocess(cmd, shell=True, stdout=Subprocess.STREAM, stderr=subprocess.STDOUT)
+
+        def _on_chunk(chunk):
+            for entry in parser.feed(chunk):
+                on_entry(entry)
+
+        yield p.stdout.read_until_close(streaming_callback=_on_chunk)
+        for entry in parser.close():
+            on_entry(entry)
+        returncode = yield p.wait_for_exit(raise_error=False)
+
+        raise gen.Return(returncode)
+
+    @gen.coroutine
     def get_pdc_descr(self, path_to_archive, dsmc_log_dir, dsmc_extra_args):
         """
         Fetches the archive `description` label from PDC.
 
         :param path_to_archive: The path to the archive uploaded that we want to get the description for
-        :return: A dsmc description if successful, raises ArchiveException otherwise
+        :return: A Future resolving to a dsmc description if successful, raises ArchiveException otherwise
         """
 
         args = self.dsmc_args(dsmc_extra_args)
 
         log.info("Fetching description for latest upload of {} to PDC...".format(path_to_archive))
         cmd = "export DSM_LOG={} && dsmc q ar {} {}".format(dsmc_log_dir, path_to_archive, args)
-        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
-        dsmc_out, _ = p.communicate()
-        dsmc_out = dsmc_out.splitlines()
+        # Uploads are chronologically sorted, with the latest upload last, so we only need to keep
+        # the last entry for the archive. We need the description of this upload: the last field. E.g.:
+        # 4,096  B  01/10/2017 16:47:24
+        # /data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive Never
+        # a33623ba-55ad-4034-9222-dae8801aa65e
+        parser = DsmcQueryParser(path_to_archive)
+        uploaded_versions = []
 
-        if p.returncode != 0:
-            msg = "Error when getting description from PDC. dsmc returned != 0. Output:".format(dsmc_out)
-            raise ArchiveException(reason=msg, status_code=500)
+        def _on_entry(entry):
+            if entry.path == parser.path_to_archive:
+                log.debug("Found uploaded version of this archive: {}".format(entry))
+                uploaded_versions[:] = [entry]
 
-        log.debug("Raw output from dsmc: {}".format(dsmc_out))
+        returncode = yield self._run_dsmc_query(cmd, parser, _on_entry)
 
-        uploaded_versions = [line.strip() for line in dsmc_out if path_to_archive in line]
+        if returncode != 0:
+            msg = "Error when getting description from PDC. dsmc returned {}. Output: {}".format(
+                returncode, list(parser.unparsed_lines))
+            raise ArchiveException(reason=msg, status_code=500)
 
         if not uploaded_versions:
             msg = "Error when getting description from PDC. No descriptions available for {}".format(path_to_archive)
             raise ArchiveException(reason=msg, status_code=400)
 
-        log.debug(
-            "Found the following uploaded versions of this archive: {}".format(uploaded_versions))
-
-        # Uploads are chronologically sorted, with the latest upload last.
         latest_upload = uploaded_versions[-1]
-
-        # We need the description of this upload: the last field. E.g.:
-        # 4,096  B  01/10/2017 16:47:24
-        # /data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive Never
-        # a33623ba-55ad-4034-9222-dae8801aa65e
-        latest_descr = latest_upload.split()[-1]
+        latest_descr = latest_upload.description.split()[-1]
         log.debug(
             "Latest uploaded version is {} with description {}".format(latest_upload, latest_descr))
 
-        return latest_descr
-
-    def _parse_name_size(self, line, search_string):
-        """
-        Searches through the string `line` and tries to parse out the filename and the byte size of the file.
-        A (TSM) line can look like:
-        4,096  B  2017-07-27 17.48.34    /data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive/Config Never e374bd6b-ab36-4f41-94d3-f4eaea9f30d4
-        but varies, depending on the environment's locale. Size can e.g. be "4 096".
-
-        :param line: TSM output string to parse, usually come
-        :param search_string: A magic search string that we know will exist in `line`, to make it easier to split `line` into parts
-        :return A tuple with the filename and the file's byte size
-        """
-        elements = line.split(" B ")
-        size = elements[0].strip()
-
-        if "," in size:
-            byte_size = size.replace(",", "")
-        elif " " in size:
-            byte_size = size.replace(" ", "")
-        else:
-            byte_size = size
-
-        # We can't be completely sure what format the timestamp will be returned with.
-        # And we can not be 100% sure what format the description will have either, at least in the future.
-        # This will have to do for now.
-        substr = re.search("{}(.*) Never ".format(search_string), line)
-        filename = ("{}{}".format(search_string, substr.group(1))).strip()
-
-        return (filename, byte_size)
+        raise gen.Return(latest_descr)
 
+    @gen.coroutine
     def get_pdc_filelist(self, path_to_archive, descr, dsmc_log_dir, dsmc_extra_args):
         """
         Gets the files and their sizes from PDC for a certain path (archive), with a specific description.
 
         :param path_to_archive: The path to the archive
         :param descr: The description label for the uploaded archive
-        :return The dict `uploaded_files` containing a mapping between uploaded file and size in bytes. Raises ArchiveException if there was an error.
+        :return A Future resolving to the dict `uploaded_files` containing a mapping between uploaded file and size in bytes. Raises ArchiveException if there was an error.
         """
         key_values = {
             "subdir": "yes",
@@ -252,58 +409,61 @@ class ReuploadHelper(object):
         cmd = "export DSM_LOG={} && dsmc q ar {}/ {}".format(
             dsmc_log_dir, path_to_archive, args)
 
-        p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-
-        dsmc_out, _ = p.communicate()
-        dsmc_out = dsmc_out.splitlines()
-
-        if p.returncode != 0:
-            msg = "Error when getting filelist from PDC. Output: {}".format(dsmc_out)
-            raise ArchiveException(reason=msg, status_code=500)
-
-        # We're only interested in the lines from the dsmc output that contains the
-        # path to the archive.
-        matched_lines = [line.strip() for line in dsmc_out if path_to_archive in line]
-
-        if not matched_lines:
-            msg = "Error when getting filelist from PDC. No files uploaded for {}".format(path_to_archive)
-            raise ArchiveException(reason=msg, status_code=400)
-
-        log.debug("Uploaded files to PDC: {}".format(matched_lines))
-
+        # We're only interested in the entries from the dsmc output that are beneath the
+        # path to the archive. The sizes are converted to ints by the parser, for easier
+        # comparison with the local size.
+        parser = DsmcQueryParser(path_to_archive)
         uploaded_files = {}
 
-        # We need to convert the sizes to a common format for easier comparison with local size.
-        for line in matched_lines:
-            filename, byte_size = self._parse_name_size(line, path_to_archive)
-
+        def _on_entry(entry):
             # NB A potential error here is if the same file has been uploaded multiple times with the same descriptions.
             # It is then a bit ambigious what to do. TSM sorts and returns them in chronological order though,
             # so we will just keep refering to the last uploaded version of the file.
-            if filename in uploaded_files.keys():
+            if entry.path in uploaded_files:
                 log.info(
-                    "Duplicate uploads of file {} with description {} encountered.".format(filename, descr))
+                    "Duplicate uploads of file {} with description {} encountered.".format(entry.path, descr))
+
+            uploaded_files[entry.path] = entry.size
+
+        returncode = yield self._run_dsmc_query(cmd, parser, _on_entry)
+
+        if returncode != 0:
+            msg = "Error when getting filelist from PDC. dsmc returned {}. Output: {}".format(
+                returncode, list(parser.unparsed_lines))
+            raise ArchiveException(reason=msg, status_code=500)
 
-            uploaded_files[filename] = int(byte_size)
+        if not uploaded_files:
+            msg = "Error when getting filelist from PDC. No files uploaded for {}".format(path_to_archive)
+            raise ArchiveException(reason=msg, status_code=400)
 
-        log.debug("Previously uploaded files for the archive are: {}".format(uploaded_files))
+        log.debug("Found {} previously uploaded files for the archive".format(len(uploaded_files)))
 
-        return uploaded_files
+        raise gen.Return(uploaded_files)
 
-    def get_local_filelist(self, path_to_archive):
+    def get_local_filelist(self, path_to_archive, manifest_file=None):
         """
         Gets the list of all files and their sizes in the local archive.
 
         :param path_to_archive: The path to the local archive
+        :param manifest_file: If set, the filelist is taken from the manifest of the archive, which is refreshed first
         :return: The dict `local_files` that maps between local file and size in bytes. Raises an ArchiveException if there was an error.
         """
         log.info("Generating local filelist for {}...".format(path_to_archive))
-        local_files = {}
-        for root, directories, filenames in os.walk(path_to_archive):
-            for filename in filenames:
-                full_path = os.path.join(root, filename)
-                local_size = os.path.getsize(full_path)
-                local_files[full_path] = int(local_size)
+        if manifest_file:
+            manifest = ArchiveManifest.load(path_to_archive, manifest_file)
+            manifest.refresh()
+            manifest.save()
+            # the manifest uses absolute paths, keep the paths as they were given
+            local_files = {
+                os.path.join(path_to_archive, os.path.relpath(path, manifest.path_to_archive)): size
+                for path, size in manifest.local_files().iteritems()}
+        else:
+            local_files = {}
+            for root, directories, filenames in os.walk(path_to_archive):
+                for filename in filenames:
+                    full_path = os.path.join(root, filename)
+                    local_size = os.path.getsize(full_path)
+                    local_files[full_path] = int(local_size)
 
         if not local_files:
             msg = "Error when generating local filelist. No files found for {}".format(path_to_archive)
@@ -313,36 +473,55 @@ class ReuploadHelper(object):
 
         return local_files
 
-    def get_files_to_reupload(self, local_files, uploaded_files):
+    def get_local_checksums(self, path_to_archive):
         """
-        Compare the list of local and uploaded files. If the size in byte differs,
-        or if the file exists locally, but not remotely, then it should be re-uploaded.
+        Gets the MD5 checksums of the local files from the checksum file written by gen_checksums. The checksum
+        file itself is checksummed too, since it is uploaded with the archive.
+
+        :param path_to_archive: The path to the local archive
+        :return: The dict `local_checksums` that maps between local file and MD5 checksum, empty if the archive
+                 has no checksum file
+        """
+        checksum_file = os.path.join(path_to_archive, CHECKSUM_FILENAME)
+        if not os.path.isfile(checksum_file):
+            log.info("No checksum file found for {}".format(path_to_archive))
+            return {}
+
+        # the paths in the checksum file are relative to the archive, e.g. ./Logs/run.log
+        local_checksums = {
+            os.path.join(path_to_archive, os.path.normpath(path)): hexdigest
+            for path, hexdigest in ChecksumUtils.read_md5sum_file(checksum_file).iteritems()}
+        local_checksums[checksum_file] = ChecksumUtils.md5_of_file(checksum_file)
+        return local_checksums
+
+    def get_files_to_reupload(self, local_files, uploaded_files, local_checksums=None, uploaded_checksums=None):
+        """
+        Compare the list of local and uploaded files. If the file exists locally, but not remotely,
+        or if the size in byte differs, then it should be re-uploaded. If checksums are given, a file
+        whose local and uploaded MD5 checksums are both known should also be re-uploaded if they differ.
+        Other files are only compared by size.
 
         :param local_files: Dict local files -> size in bytes
         :param uploaded_files: Dict of remote files -> size in bytes
-        :return: List `reupload_files` with the path to all files that needs reuploading
-        """
-        reupload_files = []
-        for name, size in local_files.iteritems():
-            if name in uploaded_files:
-                assert isinstance(size, int), "Local file size needs to be of type int"
-                assert isinstance(
-                    uploaded_files[name], int), "Remote file size needs to be of type int"
-                log.debug("Local file has been uploaded {}".format(name))
-
-                if size != uploaded_files[name]:
-                    log.info("Local file size {} doesn't match remote file size {} for file {}".format(
-                        size, uploaded_files[name], name))
-                    reupload_files.append(name)
-                else:
-                    log.debug("Local file ({}) size matches uploaded file size".format(name))
-            else:
-                log.info("Local file has NOT been uploaded {}".format(name))
-                reupload_files.append(name)
+        :param local_checksums: Dict of local files -> MD5 checksum, if checksums should be compared
+        :param uploaded_checksums: Dict of remote files -> MD5 checksum recorded when they were uploaded
+        :return: Sorted list `reupload_files` with the path to all files that needs reuploading
+        """
+        not_uploaded = local_files.viewkeys() - uploaded_files.viewkeys()
+        uploaded = local_files.viewkeys() & uploaded_files.viewkeys()
+        size_differs = {name for name in uploaded if local_files[name] != uploaded_files[name]}
+
+        checksum_differs = set()
+        if local_checksums and uploaded_checksums:
+            checksummed = (uploaded - size_differs) & local_checksums.viewkeys() & uploaded_checksums.viewkeys()
+            checksum_differs = {name for name in checksummed if local_checksums[name] != uploaded_checksums[name]}
+
+        log.info("Of {} local files, {} have not been uploaded, {} differ in size and {} differ in checksum".format(
+            len(local_files), len(not_uploaded), len(size_differs), len(checksum_differs)))
 
-        return reupload_files
+        return sorted(not_uploaded | size_differs | checksum_differs)
 
-    def reupload(self, reupload_files, descr, dsmc_log_dir, dsmc_extra_args, runner_service):
+    def reupload(self, reupload_files, descr, dsmc_log_dir, dsmc_extra_args, runner_service, priority=0):
         """
         Tells `dsmc` to upload all files in the given filelist.
 
@@ -351,15 +530,13 @@ class ReuploadHelper(object):
         :param uniq_id: A uniq ID for this sessions DSMC interactions
         :param dsmc_log_dir: The dir where `dsmc` will write log files
         :param runner_service: The runner service to use
+        :param priority: The priority of the job in the queue of the runner service
         :return: The LocalQ job id associated with this job
         """
         log.info("Will now reupload the following files: {}".format(reupload_files))
 
         reupload_file = self._tmp_file("archive-upload-reupload")
-
-        with open(reupload_file, 'wa') as f:
-            for r in reupload_files:
-                f.write('"{}"\n'.format(r))
+        self.write_filelist(reupload_files, reupload_file)
 
         log.debug("Written files to reupload to {}".format(reupload_file))
 
@@ -375,11 +552,265 @@ class ReuploadHelper(object):
         cmd = "export DSM_LOG={} && dsmc archive {}".format(
             dsmc_log_dir, args)
         log.debug("Running command {}".format(cmd))
+        # the files to reupload are all in the archive, so they are on the same volume
         job_id = runner_service.start(
-            cmd, nbr_of_cores=1, run_dir=dsmc_log_dir, stdout=output_file, stderr=output_file)
+            cmd, nbr_of_cores=1, run_dir=dsmc_log_dir, stdout=output_file, stderr=output_file,
+            resources=BaseDsmcHandler._dsmc_resources(reupload_files[0]), priority=priority,
+            dsmc_output=output_file)
 
         return job_id
 
+    @staticmethod
+    def compare_method_from_config(config):
+        """
+        :param config: The app config
+        :return: How files should be compared when planning a reupload, `reupload.compare` in the config
+                 (COMPARE_SIZE if not set). Raises ArchiveException if it is not one of COMPARE_METHODS.
+        """
+        compare = (config.get("reupload") or {}).get("compare", ReuploadHelper.COMPARE_SIZE)
+        if compare not in ReuploadHelper.COMPARE_METHODS:
+            msg = "Unknown reupload compare method {} in the config, should be one of {}.".format(
+                compare, ReuploadHelper.COMPARE_METHODS)
+            raise ArchiveException(reason=msg, status_code=500)
+        return compare
+
+    @staticmethod
+    def reconcile_from_request(request_data):
+        """
+        :param request_data: The JSON body of a reupload request
+        :return: True if PDC should be queried even if the inventory knows the latest upload
+        """
+        reconcile = request_data.get("reconcile", False)
+        if reconcile and isinstance(reconcile, basestring):
+            reconcile = reconcile.lower() in ["true"]
+        return reconcile
+
+    @staticmethod
+    def inventory_filelist(path_to_archive, inventory):
+        """
+        :param path_to_archive: The path to the archive
+        :param inventory: The `ArchiveInventory` to look the latest upload of the archive up in
+        :return: A tuple with the description and the dict of uploaded files and sizes of the latest upload,
+                 (None, None) if the inventory does not know about an upload of the archive
+        """
+        descr = inventory.latest_description(path_to_archive)
+        if descr is not None:
+            uploaded_files = inventory.uploaded_files(descr)
+            if uploaded_files:
+                log.info("Using the inventory for latest upload {} of {}".format(descr, path_to_archive))
+                return descr, uploaded_files
+        return None, None
+
+    @staticmethod
+    def record_pdc_filelist(path_to_archive, descr, uploaded_files, inventory):
+        """
+        Updates the inventory with the uploaded files of the latest upload of an archive, as answered by PDC
+        """
+        # PDC does not know the checksums, keep the ones recorded at upload time
+        inventory.record_files(path_to_archive, descr, uploaded_files, replace=True, source="pdc",
+                               checksums=inventory.uploaded_checksums(descr))
+
+    @gen.coroutine
+    def get_uploaded_filelist(self, path_to_archive, dsmc_log_dir, dsmc_extra_args, inventory=None,
+                              reconcile=False):
+        """
+        Gets the description and the filelist of the latest upload of an archive. They are taken from the
+        inventory if it knows about an upload of the archive, otherwise (or if `reconcile` is set) PDC is
+        queried and the inventory is updated with the answer.
+
+        :param path_to_archive: The path to the archive
+        :param inventory: The `ArchiveInventory` to use, if any
+        :param reconcile: If True, always query PDC
+        :return: A Future resolving to a tuple with the description, the dict of uploaded files and sizes, and
+                 where they were taken from ("inventory" or "pdc")
+        """
+        if inventory is not None and not reconcile:
+            descr, uploaded_files = self.inventory_filelist(path_to_archive, inventory)
+            if descr is not None:
+                raise gen.Return((descr, uploaded_files, "inventory"))
+
+        descr = yield self.get_pdc_descr(path_to_archive, dsmc_log_dir, dsmc_extra_args)
+        uploaded_files = yield self.get_pdc_filelist(path_to_archive, descr, dsmc_log_dir, dsmc_extra_args)
+        if inventory is not None:
+            self.record_pdc_filelist(path_to_archive, descr, uploaded_files, inventory)
+
+        raise gen.Return((descr, uploaded_files, "pdc"))
+
+    @gen.coroutine
+    def plan_files_to_reupload(self, path_to_archive, descr, uploaded_files, manifest_file=None, inventory=None,
+                               compare=COMPARE_SIZE):
+        """
+        Compares the local files of an archive with the files of its latest upload.
+
+        :param path_to_archive: The path to the archive
+        :param descr: The description of the latest upload
+        :param uploaded_files: The dict of uploaded files and sizes of the latest upload
+        :param manifest_file: The manifest to take the local filelist from, if any
+        :param inventory: The `ArchiveInventory` the checksums of the uploaded files were recorded in, if any
+        :param compare: How to compare the local files with the uploaded ones, see `plan_and_reupload`
+        :return: A Future resolving to a tuple with the dict of local files and sizes, the dict of local files
+                 and checksums (empty unless comparing by checksum or recording in the inventory) and the
+                 sorted list of files to reupload. Raises ArchiveException if the local filelist is empty.
+        """
+        local_files = yield run_in_thread(self.get_local_filelist, path_to_archive, manifest_file)
+        # the local checksums are also recorded for the reuploaded files, to compare by checksum later on
+        local_checksums = {}
+        if compare == ReuploadHelper.COMPARE_CHECKSUM or inventory is not None:
+            local_checksums = yield run_in_thread(self.get_local_checksums, path_to_archive)
+        uploaded_checksums = None
+        if compare == ReuploadHelper.COMPARE_CHECKSUM and inventory is not None:
+            uploaded_checksums = inventory.uploaded_checksums(descr)
+        reupload_files = self.get_files_to_reupload(
+            local_files, uploaded_files, local_checksums, uploaded_checksums)
+
+        raise gen.Return((local_files, local_checksums, reupload_files))
+
+    def record_reupload_when_done(self, job_id, path_to_archive, descr, runner_service, inventory, local_files,
+                                  local_checksums, reupload_files):
+        """
+        Records the files reuploaded by a job in the inventory, in the background once the job is done
+        """
+        IOLoop.current().spawn_callback(
+            self.record_upload_when_done,
+            job_id,
+            path_to_archive,
+            descr,
+            runner_service,
+            inventory,
+            uploaded_files={f: local_files[f] for f in reupload_files},
+            checksums={f: local_checksums[f] for f in reupload_files if f in local_checksums})
+
+    @gen.coroutine
+    def wait_for_job(self, job_id, runner_service, on_state=None):
+        """
+        Waits for a job to finish, polling its state every JOB_POLL_INTERVAL seconds.
+
+        :param job_id: The job to wait for
+        :param runner_service: The runner service running the job
+        :param on_state: If given, called with the state of the job every time it has been polled
+        :return: A Future resolving to the state the job ended in
+        """
+        state = runner_service.status(job_id)
+        while state in [State.PENDING, State.STARTED]:
+            if on_state is not None:
+                on_state(state)
+            yield gen.sleep(ReuploadHelper.JOB_POLL_INTERVAL)
+            state = runner_service.status(job_id)
+        if on_state is not None:
+            on_state(state)
+        raise gen.Return(state)
+
+    @gen.coroutine
+    def record_upload_when_done(self, job_id, path_to_archive, descr, runner_service, inventory,
+                                uploaded_files=None, manifest_file=None, checksums=None):
+        """
+        Waits for an upload job to finish and then records the uploaded files in the inventory.
+
+        :param job_id: The upload job
+        :param path_to_archive: The path to the uploaded archive
+        :param descr: The description of the upload
+        :param runner_service: The runner service running the job
+        :param inventory: The `ArchiveInventory` to record the upload in
+        :param uploaded_files: The files, and their sizes, uploaded by the job. If not given, the whole archive
+                               was uploaded and the files in it are recorded, replacing any previously recorded files
+        :param manifest_file: The manifest to take the local filelist from, if any
+        :param checksums: The MD5 checksums of the files uploaded by the job, if known. If the whole archive was
+                          uploaded, they are taken from its checksum file
+        """
+        state = yield self.wait_for_job(job_id, runner_service)
+
+        try:
+            if state != State.DONE:
+                log.info("Upload job {} of {} ended in state {}, not recording it".format(
+                    job_id, path_to_archive, state))
+                if uploaded_files is None:
+                    inventory.set_state(descr, inventory.FAILED)
+            elif uploaded_files is None:
+                local_files = yield run_in_thread(self.get_local_filelist, path_to_archive, manifest_file)
+                checksums = yield run_in_thread(self.get_local_checksums, path_to_archive)
+                inventory.record_files(path_to_archive, descr, local_files, replace=True, checksums=checksums)
+            else:
+                inventory.record_files(path_to_archive, descr, uploaded_files, checksums=checksums)
+        except Exception:
+            log.exception("Could not record upload {} of {} in the inventory".format(descr, path_to_archive))
+
+    @gen.coroutine
+    def plan_and_reupload(self, job_id, path_to_archive, dsmc_log_dir, dsmc_extra_args, runner_service,
+                          manifest_file=None, inventory=None, reconcile=False, priority=0, compare=COMPARE_SIZE):
+        """
+        Runs the planning phase of a reupload in the background: fetches the description and the
+        remote filelist of the latest upload, compares it with the local filelist and then starts
+        the reupload of the missing files. Progress and failures are reported on the phased job.
+
+        :param job_id: The phased job that was registered for this reupload
+        :param path_to_archive: The path to the archive to reupload
+        :param dsmc_log_dir: The dir where `dsmc` will write log files
+        :param runner_service: The runner service to use
+        :param manifest_file: The manifest to take the local filelist from, if any
+        :param inventory: The `ArchiveInventory` to plan from and record the reupload in, if any
+        :param reconcile: If True, query PDC for the latest upload even if it is known by the inventory
+        :param priority: The priority of the reupload job in the queue of the runner service
+        :param compare: How to compare the local files with the uploaded ones, one of COMPARE_METHODS. With
+                        COMPARE_CHECKSUM, the checksums in the checksum file of the archive are compared with the
+                        checksums recorded in the inventory when the files were uploaded
+        """
+        try:
+            # Fetch the description and the filelist of the last uploaded version of this archive.
+            # NB. Uploaded list contains folders as well, but when we check local
+            # content we only look at the files, and ignore the folders.
+            descr, uploaded_files, source = yield self.get_uploaded_filelist(
+                path_to_archive,
+                dsmc_log_dir,
+                dsmc_extra_args,
+                inventory,
+                reconcile)
+            runner_service.set_phase(
+                job_id, ReuploadHelper.PLANNING_PHASE, archive_description=descr, filelist_source=source,
+                compared_by=compare)
+
+            # Get the local filelist, and then get the list of files
+            # that are missing on remote side, or differs in byte size (or checksum).
+            local_files, local_checksums, reupload_files = yield self.plan_files_to_reupload(
+                path_to_archive, descr, uploaded_files, manifest_file, inventory, compare)
+
+            if not reupload_files:
+                log.debug("Nothing to do - everything already uploaded.")
+                runner_service.fail_phased(job_id, "nothing to reupload")
+                return
+
+            # Upload the missing files with the same description previously used.
+            upload_job_id = self.reupload(
+                reupload_files,
+                descr,
+                dsmc_log_dir,
+                dsmc_extra_args,
+                runner_service,
+                priority)
+
+            if upload_job_id is None:
+                runner_service.fail_phased(job_id, "could not start the reupload job")
+            else:
+                runner_service.set_phase(job_id, ReuploadHelper.UPLOADING_PHASE, child_job_id=upload_job_id)
+                if inventory is not None:
+                    self.record_reupload_when_done(
+                        upload_job_id, path_to_archive, descr, runner_service, inventory, local_files,
+                        local_checksums, reupload_files)
+        except ArchiveException as e:
+            log.error("Planning reupload of {} failed: {}".format(path_to_archive, e.reason))
+            runner_service.fail_phased(job_id, e.reason)
+        except Exception as e:
+            log.exception("Unexpected error when planning reupload of {}".format(path_to_archive))
+            runner_service.fail_phased(job_id, "unexpected error: {}".format(e))
+
+    @staticmethod
+    def write_filelist(paths, filelist_file):
+        """
+        Write paths to a file that can be passed to `dsmc` with the `filelist` option
+        """
+        with open(filelist_file, 'wa') as f:
+            for path in paths:
+                f.write('"{}"\n'.format(path))
+
     def _tmp_file(self, component):
         uniq_id = str(uuid.uuid4())
         return os.path.join("/tmp", "{}-{}".format(component, uniq_id))
@@ -398,6 +829,356 @@ class ReuploadHelper(object):
         return " ".join(args)
 
 
+class UploadHelper(object):
+
+    """
+    Helper class for the UploadHandler, for uploads that are split into shards which are uploaded by
+    parallel `dsmc` sessions.
+    """
+
+    @staticmethod
+    def list_archive(path_to_archive, manifest_file=None):
+        """
+        List everything `dsmc` should archive for an archive, i.e. the archive itself and all files and
+        directories beneath it.
+
+        :param path_to_archive: The absolute path to the archive
+        :param manifest_file: If set, the archive is listed through its manifest
+        :return: A dict mapping the path of each file and directory to its size in bytes (0 for directories)
+        """
+        if manifest_file:
+            manifest = ArchiveManifest.load(path_to_archive, manifest_file)
+            manifest.refresh()
+            manifest.save()
+            sizes = dict.fromkeys(manifest.all_paths(), 0)
+            sizes.update(manifest.local_files())
+        else:
+            sizes = {
+                path: os.path.getsize(path) if os.path.isfile(path) else 0
+                for path in FileUtils.list_all_paths(path_to_archive)}
+        sizes[path_to_archive] = 0
+        return sizes
+
+    @gen.coroutine
+    def shard_and_upload(self, job_id, path_to_archive, descr, dsmc_log_dir, dsmc_extra_args, nbr_of_shards,
+                         runner_service, manifest_file=None, priority=0):
+        """
+        Lists the archive in the background, divides it into shards of about the same size and starts a
+        `dsmc archive` job for each shard, all with the same description. The phased job follows the shard
+        jobs once they have been started.
+
+        :param job_id: The phased job that was registered for this upload
+        :param path_to_archive: The absolute path to the archive to upload
+        :param descr: The description to upload the archive with
+        :param dsmc_log_dir: The dir where `dsmc` will write log files
+        :param nbr_of_shards: The number of shards to divide the archive into
+        :param runner_service: The runner service to use
+        :param manifest_file: The manifest to list the archive through, if any
+        :param priority: The priority of the shard jobs in the queue of the runner service
+        """
+        try:
+            sizes = yield run_in_thread(self.list_archive, path_to_archive, manifest_file)
+            shards = FileUtils.balanced_shards(sizes, nbr_of_shards)
+
+            shard_job_ids = []
+            for i, shard in enumerate(shards, 1):
+                filelist = os.path.join(dsmc_log_dir, "{}.shard{}.filelist".format(descr, i))
+                ReuploadHelper.write_filelist(shard, filelist)
+                output_file = BaseDsmcHandler._rename_log_file(dsmc_log_dir, "dsmc_output.shard{}".format(i))
+
+                key_values = {
+                    "filelist": filelist,
+                    "description": descr
+                }
+                key_values.update(dsmc_extra_args)
+                cmd = "export DSM_LOG={} && dsmc archive {}".format(
+                    dsmc_log_dir, ReuploadHelper.dsmc_args(key_values))
+                log.debug("Running command {}".format(cmd))
+                # the shards only take a tsm_session, as they would otherwise wait for each other's disk
+                shard_job_id = runner_service.start(
+                    cmd, nbr_of_cores=1, run_dir=dsmc_log_dir, stdout=output_file, stderr=output_file,
+                    resources={ResourcePool.TSM_SESSION: 1}, priority=priority, dsmc_output=output_file)
+
+                if shard_job_id is None:
+                    for started_job_id in shard_job_ids:
+                        runner_service.stop(started_job_id)
+                    runner_service.fail_phased(job_id, "could not start the upload of shard {}".format(i))
+                    return
+                shard_job_ids.append(shard_job_id)
+
+            # the jobs are only added once all of them have been started, so that the upload is not
+            # reported as done when the first shard has finished
+            for shard_job_id in shard_job_ids:
+                runner_service.set_phase(
+                    job_id, ReuploadHelper.UPLOADING_PHASE, child_job_id=shard_job_id, shards=len(shards))
+            log.info("Uploading {} in {} shards, jobs {}".format(path_to_archive, len(shards), shard_job_ids))
+        except Exception as e:
+            log.exception("Unexpected error when starting sharded upload of {}".format(path_to_archive))
+            runner_service.fail_phased(job_id, "unexpected error: {}".format(e))
+
+
+class BulkReuploadHelper(ReuploadHelper):
+
+    """
+    Helper class for the BulkReuploadHandler, which reuploads several archives together: PDC is queried for the
+    latest descriptions of all archives at once and for the uploaded files once per description, and the files of
+    all archives are then reuploaded by a single `dsmc` session, with one filelist per description.
+    """
+
+    # State of an archive whose reupload could not be planned, or that has nothing to reupload
+    FAILED = State.ERROR
+
+    # dsmc returns 8 for warnings, e.g. when some of the archives in a query have never been uploaded
+    DSMC_WARNING_RETURNCODE = 8
+
+    @gen.coroutine
+    def _run_dsmc_filelist_query(self, paths, key_values, dsmc_log_dir, dsmc_extra_args, on_entry):
+        """
+        Runs one `dsmc q ar` for several paths, passed to dsmc as a filelist
+
+        :param paths: The paths to query
+        :param key_values: The dsmc options of the query
+        :param on_entry: Called with the `DsmcQueryParser` and each `DsmcArchiveEntry` parsed from the output
+        :return: A Future resolving when the query has finished, raises ArchiveException if it failed
+        """
+        filelist = self._tmp_file("archive-upload-bulk-query")
+        self.write_filelist(paths, filelist)
+        key_values = dict(key_values, filelist=filelist)
+        key_values.update(dsmc_extra_args)
+        cmd = "export DSM_LOG={} && dsmc q ar {}".format(dsmc_log_dir, self.dsmc_args(key_values))
+        parser = DsmcQueryParser([path.rstrip("/") for path in paths])
+
+        try:
+            returncode = yield self._run_dsmc_query(cmd, parser, lambda entry: on_entry(parser, entry))
+        finally:
+            os.remove(filelist)
+
+        if returncode not in [0, BulkReuploadHelper.DSMC_WARNING_RETURNCODE]:
+            msg = "Error when querying PDC. dsmc returned {}. Output: {}".format(
+                returncode, list(parser.unparsed_lines))
+            raise ArchiveException(reason=msg, status_code=500)
+
+    @gen.coroutine
+    def get_pdc_descrs(self, paths_to_archives, dsmc_log_dir, dsmc_extra_args):
+        """
+        Fetches the description of the latest upload of each archive from PDC, in one query.
+
+        :param paths_to_archives: The paths to the archives
+        :return: A Future resolving to a dict mapping the path of each archive that has been uploaded to the
+                 description of its latest upload. Raises ArchiveException if the query failed.
+        """
+        log.info("Fetching descriptions for latest uploads of {} archives from PDC...".format(len(paths_to_archives)))
+        descrs = {}
+
+        def _on_entry(parser, entry):
+            # uploads are chronologically sorted, so the latest upload of an archive comes last
+            if entry.path in parser.paths_to_archives:
+                descrs[entry.path] = entry.description.split()[-1]
+
+        yield self._run_dsmc_filelist_query(paths_to_archives, {}, dsmc_log_dir, dsmc_extra_args, _on_entry)
+        raise gen.Return(descrs)
+
+    @gen.coroutine
+    def get_pdc_filelists(self, descrs, dsmc_log_dir, dsmc_extra_args):
+        """
+        Gets the files and their sizes from PDC for archives uploaded with known descriptions, in one query for
+        each description.
+
+        :param descrs: A dict mapping the path of each archive to the description of its latest upload
+        :return: A Future resolving to a dict mapping the path of each archive to a dict of its uploaded files and
+                 their sizes in bytes. Raises ArchiveException if a query failed.
+        """
+        paths_by_descr = collections.defaultdict(list)
+        for path_to_archive, descr in descrs.iteritems():
+            paths_by_descr[descr].append(path_to_archive)
+        uploaded_files = {path_to_archive: {} for path_to_archive in descrs}
+
+        def _on_entry(parser, entry):
+            uploaded_files[parser.archive_of(entry.path)][entry.path] = entry.size
+
+        for descr, paths_to_archives in sorted(paths_by_descr.iteritems()):
+            log.info("Fetching remote filelists for {} from PDC...".format(paths_to_archives))
+            yield self._run_dsmc_filelist_query(
+                ["{}/".format(path_to_archive) for path_to_archive in paths_to_archives],
+                {"subdir": "yes", "description": descr},
+                dsmc_log_dir,
+                dsmc_extra_args,
+                _on_entry)
+
+        raise gen.Return(uploaded_files)
+
+    def reupload_all(self, planned, dsmc_log_dir, dsmc_extra_args, runner_service, priority=0):
+        """
+        Tells a single `dsmc` session to upload the files of all archives, with a filelist per description. The
+        `archive` commands are run from a dsmc macro.
+
+        :param planned: A dict mapping each description to the list of files to reupload with it
+        :param dsmc_log_dir: The dir where `dsmc` will write log files
+        :param runner_service: The runner service to use
+        :param priority: The priority of the job in the queue of the runner service
+        :return: The LocalQ job id associated with this job
+        """
+        macro_file = self._tmp_file("archive-upload-bulk-reupload")
+        resources = {ResourcePool.TSM_SESSION: 1}
+        with open(macro_file, "w") as macro:
+            for descr, reupload_files in sorted(planned.iteritems()):
+                filelist = self._tmp_file("archive-upload-reupload")
+                self.write_filelist(reupload_files, filelist)
+                key_values = {
+                    "filelist": filelist,
+                    "description": descr
+                }
+                key_values.update(dsmc_extra_args)
+                macro.write("archive {}\n".format(self.dsmc_args(key_values)))
+                resources[ResourcePool.disk(reupload_files[0])] = 1
+        log.debug("Written dsmc macro for {} descriptions to {}".format(len(planned), macro_file))
+
+        output_file = BaseDsmcHandler._rename_log_file(dsmc_log_dir)
+        cmd = "export DSM_LOG={} && dsmc macro {}".format(dsmc_log_dir, macro_file)
+        log.debug("Running command {}".format(cmd))
+        return runner_service.start(
+            cmd, nbr_of_cores=1, run_dir=dsmc_log_dir, stdout=output_file, stderr=output_file,
+            resources=resources, priority=priority, dsmc_output=output_file)
+
+    @gen.coroutine
+    def follow_reupload_job(self, job_id, upload_job_id, names, archives, runner_service):
+        """
+        Keeps the `state` of the archives reuploaded by the job of a bulk reupload in step with the state of the
+        job, until it has finished.
+
+        :param job_id: The phased job of the bulk reupload
+        :param upload_job_id: The job reuploading the files of the archives
+        :param names: The names of the archives reuploaded by the job
+        :param archives: The results of the archives of the phased job
+        :param runner_service: The runner service running the job
+        """
+        def _on_state(state):
+            for name in names:
+                archives[name]["state"] = state
+
+        yield self.wait_for_job(upload_job_id, runner_service, _on_state)
+        # so that the final states of the archives are recorded with the phased job
+        runner_service.set_phase(job_id, ReuploadHelper.UPLOADING_PHASE, archives=archives)
+
+    @gen.coroutine
+    def plan_and_reupload_all(self, job_id, archives, dsmc_log_dir, dsmc_extra_args, runner_service,
+                              manifest_files=None, inventory=None, reconcile=False, priority=0,
+                              compare=ReuploadHelper.COMPARE_SIZE):
+        """
+        Runs the planning phase of a bulk reupload in the background, like `plan_and_reupload` does for a single
+        archive, and then starts one job that reuploads the files of all archives. The result of each archive is
+        reported in the `archives` of the phased job: its `phase`, and once known its `archive_description`,
+        `filelist_source` and the number of `files_to_reupload`. An archive that could not be planned, or that has
+        nothing to reupload, is in state `error` with a `message`. An archive whose files are being reuploaded
+        reports the `job_id` of the reupload job, and its `state` follows the state of that job.
+
+        :param job_id: The phased job that was registered for this bulk reupload
+        :param archives: A dict mapping the name of each archive to its result, with the `archive_path`
+        :param manifest_files: A dict mapping the name of each archive to its manifest file, if any
+        :param inventory: The `ArchiveInventory` to plan from and record the reuploads in, if any
+        :param reconcile: If True, query PDC for the latest uploads even if they are known by the inventory
+        :param priority: The priority of the reupload job in the queue of the runner service
+        :param compare: How to compare the local files with the uploaded ones, see `plan_and_reupload`
+        """
+        manifest_files = manifest_files or {}
+
+        def _fail(name, message):
+            log.info("Not reuploading {}: {}".format(name, message))
+            archives[name].update(state=BulkReuploadHelper.FAILED, message=message)
+
+        try:
+            to_plan = {name: result["archive_path"] for name, result in archives.iteritems()
+                       if result.get("state") != BulkReuploadHelper.FAILED}
+
+            # Take the latest uploads from the inventory where possible, and ask PDC about the rest
+            descrs = {}
+            uploaded_files = {}
+            if inventory is not None and not reconcile:
+                for name, path_to_archive in to_plan.iteritems():
+                    descr, files = self.inventory_filelist(path_to_archive, inventory)
+                    if descr is not None:
+                        descrs[path_to_archive] = descr
+                        uploaded_files[path_to_archive] = files
+                        archives[name].update(archive_description=descr, filelist_source="inventory")
+
+            to_query = sorted(path for path in to_plan.itervalues() if path not in descrs)
+            if to_query:
+                pdc_descrs = yield self.get_pdc_descrs(to_query, dsmc_log_dir, dsmc_extra_args)
+                pdc_files = yield self.get_pdc_filelists(pdc_descrs, dsmc_log_dir, dsmc_extra_args)
+                for path_to_archive, files in pdc_files.iteritems():
+                    if inventory is not None and files:
+                        self.record_pdc_filelist(path_to_archive, pdc_descrs[path_to_archive], files, inventory)
+                descrs.update(pdc_descrs)
+                uploaded_files.update(pdc_files)
+                for name, path_to_archive in to_plan.iteritems():
+                    if path_to_archive in pdc_descrs:
+                        archives[name].update(
+                            archive_description=pdc_descrs[path_to_archive], filelist_source="pdc")
+            runner_service.set_phase(job_id, ReuploadHelper.PLANNING_PHASE, archives=archives, compared_by=compare)
+
+            planned = collections.defaultdict(list)
+            uploading = []
+            for name, path_to_archive in sorted(to_plan.iteritems()):
+                if path_to_archive not in descrs:
+                    _fail(name, "no upload found in PDC")
+                    continue
+                if not uploaded_files[path_to_archive]:
+                    _fail(name, "no files uploaded with description {}".format(descrs[path_to_archive]))
+                    continue
+                try:
+                    local_files, local_checksums, reupload_files = yield self.plan_files_to_reupload(
+                        path_to_archive, descrs[path_to_archive], uploaded_files[path_to_archive],
+                        manifest_files.get(name), inventory, compare)
+                except ArchiveException as e:
+                    _fail(name, e.reason)
+                    continue
+
+                archives[name]["files_to_reupload"] = len(reupload_files)
+                if not reupload_files:
+                    _fail(name, "nothing to reupload")
+                    continue
+                archives[name]["phase"] = ReuploadHelper.UPLOADING_PHASE
+                planned[descrs[path_to_archive]].extend(reupload_files)
+                uploading.append((name, path_to_archive, local_files, local_checksums, reupload_files))
+
+            if not planned:
+                runner_service.set_phase(job_id, ReuploadHelper.PLANNING_PHASE, archives=archives)
+                runner_service.fail_phased(job_id, "nothing to reupload")
+                return
+
+            upload_job_id = self.reupload_all(planned, dsmc_log_dir, dsmc_extra_args, runner_service, priority)
+
+            if upload_job_id is None:
+                for name, _, _, _, _ in uploading:
+                    _fail(name, "could not start the reupload job")
+                runner_service.set_phase(job_id, ReuploadHelper.PLANNING_PHASE, archives=archives)
+                runner_service.fail_phased(job_id, "could not start the reupload job")
+                return
+
+            upload_state = runner_service.status(upload_job_id)
+            for name, path_to_archive, local_files, local_checksums, reupload_files in uploading:
+                archives[name].update(job_id=upload_job_id, state=upload_state)
+                if inventory is not None:
+                    self.record_reupload_when_done(
+                        upload_job_id, path_to_archive, descrs[path_to_archive], runner_service, inventory,
+                        local_files, local_checksums, reupload_files)
+            runner_service.set_phase(
+                job_id, ReuploadHelper.UPLOADING_PHASE, child_job_id=upload_job_id, archives=archives)
+            IOLoop.current().spawn_callback(
+                self.follow_reupload_job,
+                job_id,
+                upload_job_id,
+                [name for name, _, _, _, _ in uploading],
+                archives,
+                runner_service)
+        except ArchiveException as e:
+            log.error("Planning bulk reupload failed: {}".format(e.reason))
+            runner_service.fail_phased(job_id, e.reason)
+        except Exception as e:
+            log.exception("Unexpected error when planning bulk reupload")
+            runner_service.fail_phased(job_id, "unexpected error: {}".format(e))
+
+
 class ReuploadHandler(BaseDsmcHandler):
 
     """
@@ -405,26 +1186,155 @@ class ReuploadHandler(BaseDsmcHandler):
     Useful when e.g. a previous upload was interrupted, or if new files should be added.
     """
 
-    def post(self, runfolder_archive):
+    def post(self, runfolder_archive):
+        """
+        Compares local copy of the runfolder archive with the latest uploaded version.
+        If any files are missing on the remote (PDC) side then they will be uploaded.
+        Returns at once with a `job_id` to be polled by the status endpoint. The job starts
+        in the `planning` phase, where the remote and local filelists are compared, and then
+        moves on to the `uploading` phase. The status of the job reports the active phase and,
+        once known, the `archive_description`. If there is nothing to reupload (as it is
+        unexpected from the client's perspective), the job ends in state `error`.
+
+        If the inventory is enabled in the config, the latest upload is looked up in the
+        inventory instead of querying PDC, unless the body contains `{"reconcile": true}`.
+        The status of the job reports where the uploaded filelist was taken from as `filelist_source`.
+
+        Files are compared by size, unless `reupload.compare` is `checksum` in the config. Then files
+        whose size is unchanged are also compared by MD5 checksum, if the checksum of the local file is
+        in the checksum file of the archive and the checksum of the uploaded file was recorded in the
+        inventory when it was uploaded. The status of the job reports the method as `compared_by`.
+
+        :param runfolder_archive: the archive we want to re-upload
+        :param reconcile: boolean to indicate that PDC should be queried even if the inventory knows the latest upload
+        :param priority: integer priority of the reupload job when it is queued (higher goes first, default 0)
+        :return: HTTP 202 if reupload planning started successfully, with a `job_id` to be used for later polling,
+                 HTTP 400 or HTTP 500 if unexpected error detected.
+
+        """
+        monitored_dir = self.config["path_to_archive_root"]
+        helper = ReuploadHelper()
+
+        try:
+            request_data = json.loads(self.request.body) if self.request.body else {}
+            reconcile = ReuploadHelper.reconcile_from_request(request_data)
+        except (ValueError, AttributeError):
+            raise ArchiveException(reason="Invalid body format.", status_code=400)
+
+        priority = self._request_priority()
+        compare = ReuploadHelper.compare_method_from_config(self.config)
+
+        if not self._validate_runfolder_exists(runfolder_archive, monitored_dir, self.config):
+            msg = "Error when validating runfolder. {} is not found under {}.".format(
+                runfolder_archive, monitored_dir)
+            raise ArchiveException(reason=msg, status_code=400)
+
+        path_to_archive = os.path.join(monitored_dir, runfolder_archive)
+        dsmc_log_root_dir = self.config["log_directory"]
+        dsmc_extra_args = self.config.get("dsmc_extra_args", {})
+
+        if not self._is_valid_log_dir(dsmc_log_root_dir):
+            msg = "Error when validating log dir. {} is not a directory.".format(dsmc_log_root_dir)
+            raise ArchiveException(reason=msg, status_code=500)
+
+        dsmc_log_dir = "{}/dsmc_{}".format(dsmc_log_root_dir, runfolder_archive)
+
+        if not os.path.exists(dsmc_log_dir):
+            os.makedirs(dsmc_log_dir)
+
+        job_id = self.runner_service.start_phased(
+            ReuploadHelper.PLANNING_PHASE, job_type="reupload", archive=runfolder_archive)
+        IOLoop.current().spawn_callback(
+            helper.plan_and_reupload,
+            job_id,
+            path_to_archive,
+            dsmc_log_dir,
+            dsmc_extra_args,
+            self.runner_service,
+            ArchiveManifest.manifest_file_from_config(self.config, path_to_archive),
+            ArchiveInventory.from_config(self.config),
+            reconcile,
+            priority,
+            compare)
+        log.debug("Reupload job_id {}".format(job_id))
+
+        self._register_callback(job_id)
+
+        status_end_point = "{0}://{1}{2}".format(
+            self.request.protocol,
+            self.request.host,
+            self.reverse_url("status", job_id))
+
+        response_data = {
+            "job_id": job_id,
+            "service_version": version,
+            "link": status_end_point,
+            "state": State.STARTED,
+            "phase": ReuploadHelper.PLANNING_PHASE,
+            "dsmc_log_dir": dsmc_log_dir,
+            "archive_path": path_to_archive,
+            "archive_host": socket.gethostname() }
+
+        self.set_status(202, reason="started planning reupload")
+        self.write_object(response_data)
+
+
+class BulkReuploadHandler(BaseDsmcHandler):
+
+    """
+    Handler for reuploading the missing files of several archives already uploaded to PDC in one go,
+    e.g. to recover from an outage of PDC.
+    """
+
+    def post(self):
         """
-        Compares local copy of the runfolder archive with the latest uploaded version.
-        If any files are missing on the remote (PDC) side then they will be uploaded.
-        Job is run in the background to be polled by the status endpoint.
-
-        :param runfolder_archive: the archive we want to re-upload
-        :return: HTTP 400 if nothing to reupload (as it is unexpected from the client's perspective), HTTP 202 if reupload started successfully, with a `job_id` to be used for later polling,
-                 HTTP 500 if unexpected error detected.
-
+        Does what the `reupload` endpoint does for each archive in the `archives` list of the JSON body,
+        but with fewer sessions to the TSM server: the latest uploads of all archives are looked up in one
+        query, their uploaded files in one query per description, and the missing files of all archives
+        are then reuploaded by a single `dsmc` session. Returns at once with a `job_id` to be polled by the
+        status endpoint, like `reupload`, and with the result of each archive as `archives`. An archive that
+        is not found is rejected at once, and the status of the job reports the results of the others as
+        they are planned (see `BulkReuploadHelper.plan_and_reupload_all`).
+
+        :param archives: list of the archives to reupload
+        :param reconcile: boolean to indicate that PDC should be queried even if the inventory knows the latest uploads
+        :param priority: integer priority of the reupload job when it is queued (higher goes first, default 0)
+        :return: HTTP 202 if reupload planning started successfully, with a `job_id` to be used for later polling,
+                 HTTP 400 if none of the archives are found or HTTP 500 if unexpected error detected.
         """
         monitored_dir = self.config["path_to_archive_root"]
-        helper = ReuploadHelper()
+        helper = BulkReuploadHelper()
 
-        if not self._validate_runfolder_exists(runfolder_archive, monitored_dir):
-            msg = "Error when validating runfolder. {} is not found under {}.".format(
-                runfolder_archive, monitored_dir)
+        try:
+            request_data = json.loads(self.request.body) if self.request.body else {}
+            archive_names = request_data.get("archives")
+            reconcile = ReuploadHelper.reconcile_from_request(request_data)
+        except (ValueError, AttributeError):
+            raise ArchiveException(reason="Invalid body format.", status_code=400)
+
+        if not archive_names or not isinstance(archive_names, list) or \
+                not all(isinstance(name, basestring) for name in archive_names):
+            raise ArchiveException(reason="`archives` must be a non-empty list of archive names.", status_code=400)
+        priority = self._request_priority()
+        compare = ReuploadHelper.compare_method_from_config(self.config)
+
+        archives = {}
+        for name in archive_names:
+            path_to_archive = os.path.join(monitored_dir, name)
+            if self._validate_runfolder_exists(name, monitored_dir, self.config):
+                archives[name] = {
+                    "archive_path": path_to_archive, "state": State.STARTED, "phase": ReuploadHelper.PLANNING_PHASE}
+            else:
+                archives[name] = {
+                    "archive_path": path_to_archive,
+                    "state": BulkReuploadHelper.FAILED,
+                    "message": "{} is not found under {}".format(name, monitored_dir)}
+
+        if all(result["state"] == BulkReuploadHelper.FAILED for result in archives.itervalues()):
+            msg = "Error when validating runfolders. None of {} are found under {}.".format(
+                archive_names, monitored_dir)
             raise ArchiveException(reason=msg, status_code=400)
 
-        path_to_archive = os.path.join(monitored_dir, runfolder_archive)
         dsmc_log_root_dir = self.config["log_directory"]
         dsmc_extra_args = self.config.get("dsmc_extra_args", {})
 
@@ -432,62 +1342,46 @@ class ReuploadHandler(BaseDsmcHandler):
             msg = "Error when validating log dir. {} is not a directory.".format(dsmc_log_root_dir)
             raise ArchiveException(reason=msg, status_code=500)
 
-        dsmc_log_dir = "{}/dsmc_{}".format(dsmc_log_root_dir, runfolder_archive)
+        dsmc_log_dir = "{}/dsmc_bulk_reupload".format(dsmc_log_root_dir)
 
         if not os.path.exists(dsmc_log_dir):
             os.makedirs(dsmc_log_dir)
 
-        # Fetch the description of the last uploaded version of this archive
-        descr = helper.get_pdc_descr(path_to_archive, dsmc_log_dir, dsmc_extra_args)
-
-        # Get the local and remote filelist, and then get the list of files
-        # that are missing on remote side, or differs in byte size.
-        # NB. Uploaded list contains folders as well, but when we check local
-        # content we only look at the files, and ignore the folders.
-        uploaded_files = helper.get_pdc_filelist(
-            path_to_archive,
-            descr,
+        job_id = self.runner_service.start_phased(
+            ReuploadHelper.PLANNING_PHASE, job_type="bulk_reupload", archives=archives)
+        IOLoop.current().spawn_callback(
+            helper.plan_and_reupload_all,
+            job_id,
+            archives,
             dsmc_log_dir,
-            dsmc_extra_args)
-        local_files = helper.get_local_filelist(path_to_archive)
-        reupload_files = helper.get_files_to_reupload(local_files, uploaded_files)
-
-        # Upload the missing files with the same description previously used.
-        if reupload_files:
-            job_id = helper.reupload(
-                reupload_files,
-                descr,
-                dsmc_log_dir,
-                dsmc_extra_args,
-                self.runner_service)
-            log.debug("Reupload job_id {}".format(job_id))
-
-            status_end_point = "{0}://{1}{2}".format(
-                self.request.protocol,
-                self.request.host,
-                self.reverse_url("status", job_id))
-
-            response_data = {
-                "job_id": job_id,
-                "service_version": version,
-                "link": status_end_point,
-                "state": State.STARTED,
-                "dsmc_log_dir": dsmc_log_dir,
-                "archive_path": path_to_archive,
-                "archive_description": descr,
-                "archive_host": socket.gethostname() }
-
-            self.set_status(202, reason="started reuploading")
-        else:
-            log.debug("Nothing to do - everything already uploaded.")
+            dsmc_extra_args,
+            self.runner_service,
+            {name: ArchiveManifest.manifest_file_from_config(self.config, result["archive_path"])
+             for name, result in archives.iteritems()},
+            ArchiveInventory.from_config(self.config),
+            reconcile,
+            priority,
+            compare)
+        log.debug("Bulk reupload job_id {}".format(job_id))
+
+        self._register_callback(job_id)
 
-            response_data = {
-                "service_version": version,
-                "state": State.ERROR,
-                "dsmc_log_dir": dsmc_log_dir}
+        status_end_point = "{0}://{1}{2}".format(
+            self.request.protocol,
+            self.request.host,
+            self.reverse_url("status", job_id))
 
-            self.set_status(400, reason="nothing to reupload")
+        response_data = {
+            "job_id": job_id,
+            "service_version": version,
+            "link": status_end_point,
+            "state": State.STARTED,
+            "phase": ReuploadHelper.PLANNING_PHASE,
+            "archives": archives,
+            "dsmc_log_dir": dsmc_log_dir,
+            "archive_host": socket.gethostname() }
 
+        self.set_status(202, reason="started planning bulk reupload")
         self.write_object(response_data)
 
 
@@ -497,28 +1391,31 @@ class UploadHandler(BaseDsmcHandler):
     Handler for uploading an archive to PDC.
     """
 
-    def post(self, runfolder_archive):
+    @staticmethod
+    def start_job(config, runner_service, runfolder_archive, priority=0):
         """
-        Tells `dsmc` to upload `runfolder_archive` to PDC, with a uniquely generated description label.
-        Job is run in the background to be polled by the status endpoint.
-
-        :param runfolder_archive: the name of the archive that we want to upload
-        :return: HTTP 202 if the upload as started successfully, with a `job_id` to be used for later status polling, HTTP 400 or HTTP 500 if an unexpected error was encountered
+        Validate an archive and start uploading it, see `post`
+
+        :param config: the app config
+        :param runner_service: the runner service to run the upload with
+        :param runfolder_archive: the name of the archive to upload
+        :param priority: the priority of the upload in the queue of the runner service
+        :return: a dict with the `job_id` of the upload, the `dsmc_log_dir`, the `archive_path`, the
+                 `archive_description` and a `message`. Raises ArchiveException if the upload can not be started.
         """
+        monitored_dir = config["path_to_archive_root"]
 
-        monitored_dir = self.config["path_to_archive_root"]
-
-        if not self._validate_runfolder_exists(runfolder_archive, monitored_dir):
+        if not UploadHandler._validate_runfolder_exists(runfolder_archive, monitored_dir, config):
             msg = "Error when validating runfolder. {} is not found under {}".format(
                 runfolder_archive, monitored_dir)
             raise ArchiveException(reason=msg, status_code=400)
 
         path_to_archive = os.path.join(monitored_dir, runfolder_archive)
-        dsmc_log_root_dir = self.config["log_directory"]
-        dsmc_extra_args = self.config.get("dsmc_extra_args", {})
+        dsmc_log_root_dir = config["log_directory"]
+        dsmc_extra_args = config.get("dsmc_extra_args", {})
         uniq_id = str(uuid.uuid4())
 
-        if not self._is_valid_log_dir(dsmc_log_root_dir):
+        if not UploadHandler._is_valid_log_dir(dsmc_log_root_dir):
             msg = "Error when validating log dir. {} is not a directory.".format(dsmc_log_root_dir)
             raise ArchiveException(reason=msg, status_code=500)
 
@@ -527,53 +1424,118 @@ class UploadHandler(BaseDsmcHandler):
         if not os.path.exists(dsmc_log_dir):
             os.makedirs(dsmc_log_dir)
 
-        output_file = self._rename_log_file(dsmc_log_dir)
-
-        key_values = {
-            "subdir": "yes",
-            "description": uniq_id
-        }
-        key_values.update(dsmc_extra_args)
-        args = ReuploadHelper.dsmc_args(key_values)
-
-        log.info("Uploading {} to PDC...".format(path_to_archive))
-        cmd = "export DSM_LOG={} && dsmc archive {}/ {}".format(
-            dsmc_log_dir, path_to_archive, args)
-
         # Mock starting the TSM process if mock mode is enabled
         try:
-            tsm_mock_enabled = self.config["tsm_mock_enabled"]
+            tsm_mock_enabled = config["tsm_mock_enabled"]
         except KeyError:
             tsm_mock_enabled = False
         if tsm_mock_enabled:
-            self.runner_service.start = Mock(return_value=self.config["tsm_mock_job_id"])
+            runner_service.start = Mock(return_value=config["tsm_mock_job_id"])
             log.warning("Running TSM client on mock mode for archive: {}, job: {}".format(
-                runfolder_archive, self.config["tsm_mock_job_id"]))
+                runfolder_archive, config["tsm_mock_job_id"]))
 
-        job_id = self.runner_service.start(
-            cmd, nbr_of_cores=1, run_dir=dsmc_log_dir, stdout=output_file, stderr=output_file)
+        manifest_file = ArchiveManifest.manifest_file_from_config(config, path_to_archive)
+        nbr_of_shards = int((config.get("upload") or {}).get("shards", 1))
 
-        status_end_point = "{0}://{1}{2}".format(
-            self.request.protocol,
-            self.request.host,
-            self.reverse_url("status", job_id))
+        log.info("Uploading {} to PDC...".format(path_to_archive))
+
+        if nbr_of_shards > 1 and not tsm_mock_enabled:
+            job_id = runner_service.start_phased(
+                ReuploadHelper.PLANNING_PHASE, job_type="upload", archive=runfolder_archive,
+                archive_description=uniq_id)
+            IOLoop.current().spawn_callback(
+                UploadHelper().shard_and_upload,
+                job_id,
+                os.path.abspath(path_to_archive),
+                uniq_id,
+                dsmc_log_dir,
+                dsmc_extra_args,
+                nbr_of_shards,
+                runner_service,
+                manifest_file,
+                priority)
+        else:
+            output_file = UploadHandler._rename_log_file(dsmc_log_dir)
+
+            key_values = {
+                "subdir": "yes",
+                "description": uniq_id
+            }
+            key_values.update(dsmc_extra_args)
+            args = ReuploadHelper.dsmc_args(key_values)
+
+            cmd = "export DSM_LOG={} && dsmc archive {}/ {}".format(
+                dsmc_log_dir, path_to_archive, args)
+
+            job_id = runner_service.start(
+                cmd, nbr_of_cores=1, run_dir=dsmc_log_dir, stdout=output_file, stderr=output_file,
+                job_type="upload", archive=runfolder_archive,
+                resources=UploadHandler._dsmc_resources(path_to_archive), priority=priority,
+                dsmc_output=output_file)
+
+        inventory = ArchiveInventory.from_config(config)
+        if inventory is not None and job_id is not None and not tsm_mock_enabled:
+            # record the upload, and its files once the job has finished, so that a later reupload
+            # can be planned without querying PDC
+            inventory.record_upload(path_to_archive, uniq_id)
+            IOLoop.current().spawn_callback(
+                ReuploadHelper().record_upload_when_done,
+                job_id,
+                path_to_archive,
+                uniq_id,
+                runner_service,
+                inventory,
+                manifest_file=manifest_file)
 
         message = ""
         if tsm_mock_enabled:
             message = "tsm_mock_enabled"
 
-        response_data = {
+        return {
             "job_id": job_id,
-            "service_version": version,
-            "link": status_end_point,
-            "state": State.STARTED,
             "dsmc_log_dir": dsmc_log_dir,
             "archive_path": path_to_archive,
             "archive_description": uniq_id,
-            "archive_host": socket.gethostname(),
-            "message": message }
+            "message": message}
+
+    def post(self, runfolder_archive):
+        """
+        Tells `dsmc` to upload `runfolder_archive` to PDC, with a uniquely generated description label.
+        Job is run in the background to be polled by the status endpoint.
+
+        If `shards` in the `upload` section of the config is larger than 1, the archive is divided into
+        that many shards of about the same size, which are uploaded by parallel `dsmc` sessions with the
+        same description. The returned job is then a phased job, whose state follows the shard jobs.
+
+        While dsmc is running, the status of the job reports its `progress`, parsed from its output: the
+        objects inspected, archived and failed, the bytes transferred, the elapsed seconds and the average
+        and current transfer rates (bytes per second). For an upload in shards, the sessions are summed.
+        The same is reported for reuploads.
+
+        :param runfolder_archive: the name of the archive that we want to upload
+        :param priority: integer priority of the upload when it is queued (higher goes first, default 0)
+        :return: HTTP 202 if the upload as started successfully, with a `job_id` to be used for later status polling, HTTP 400 or HTTP 500 if an unexpected error was encountered
+        """
+        upload = self.start_job(self.config, self.runner_service, runfolder_archive, self._request_priority())
+        job_id = upload["job_id"]
+
+        self._register_callback(job_id)
 
+        status_end_point = "{0}://{1}{2}".format(
+            self.request.protocol,
+            self.request.host,
+            self.reverse_url("status", job_id))
 
+        response_data = {
+            "job_id": job_id,
+            "service_version": version,
+            "link": status_end_point,
+            "state": State.STARTED,
+            "dsmc_log_dir": upload["dsmc_log_dir"],
+            "archive_path": upload["archive_path"],
+            "archive_description": upload["archive_description"],
+            "archive_host": socket.gethostname(),
+            "message": upload["message"] }
 
         self.set_status(202, reason="started processing")
         self.write_object(response_data)
@@ -585,28 +1547,53 @@ class GenChecksumsHandler(BaseDsmcHandler):
     Handler for generating checksums for an archive before uploading to PDC.
     """
 
-    def post(self, runfolder_archive):
+    @staticmethod
+    def start_job(config, runner_service, runfolder_archive, priority=0):
         """
-        Calculates the MD5 checksums for each file in the runfolder archive, before uploading to PDC.
-        Job is run in the background to be polled by the status endpoint.
+        Validate an archive and start checksumming it, see `post`
 
-        :param runfolder_archive: Name of the runfolder archive
-        :returns: HTTP 202 if checksum job has started successfully, with a `job_id` to be used in later polling, HTTP 400 or HTTP 500 if an unexpected error was encountered
+        :param config: the app config
+        :param runner_service: the runner service to run the job with
+        :param runfolder_archive: the name of the archive to checksum
+        :param priority: the priority of the job in the queue of the runner service
+        :return: the job id, raises ArchiveException if the job can not be started
         """
-        path_to_archive_root = os.path.abspath(self.config["path_to_archive_root"])
-        log_dir = os.path.abspath(self.config["log_directory"])
+        path_to_archive_root = os.path.abspath(config["path_to_archive_root"])
+        log_dir = os.path.abspath(config["log_directory"])
         checksum_log = os.path.abspath(os.path.join(log_dir, "checksum.log"))
 
-        if not self._validate_runfolder_exists(runfolder_archive, path_to_archive_root):
+        if not GenChecksumsHandler._validate_runfolder_exists(runfolder_archive, path_to_archive_root, config):
             msg = "Error when validating runfolder. {} is not found under {}".format(
                 runfolder_archive, path_to_archive_root)
             raise ArchiveException(reason=msg, status_code=400)
 
         path_to_archive = os.path.join(path_to_archive_root, runfolder_archive)
-        filename = "checksums_prior_to_pdc.md5"
+        filename = CHECKSUM_FILENAME
+
+        checksum_config = config.get("checksums") or {}
+        checksum_mode = checksum_config.get("mode", "shell")
+        event_log = GenChecksumsHandler._new_event_log(config, runfolder_archive, "checksum")
+
+        if checksum_mode == "native":
+            nbr_of_cores = GenChecksumsHandler._native_processes(config)
+            progress_file = GenChecksumsHandler._new_progress_file(config, runfolder_archive, "checksum")
+            args = [path_to_archive, "--processes", nbr_of_cores, "--progress-file", progress_file]
+            args.extend(GenChecksumsHandler._event_log_args(event_log))
+            manifest_file = ArchiveManifest.manifest_file_from_config(config, path_to_archive)
+            if manifest_file:
+                args.extend(["--manifest-file", manifest_file])
+            cmd = GenChecksumsHandler._python_module_cmd("archive_upload.lib.checksums", *args)
+        elif checksum_mode == "shell":
+            nbr_of_cores = 1
+            progress_file = None
+            cmd = "cd {} && /usr/bin/find -L . -type f ! -path './{}' -exec /usr/bin/md5sum {{}} + > {}".format(
+                path_to_archive, filename, filename)
+            cmd = GenChecksumsHandler._step_cmd(
+                event_log, "md5", cmd, count_lines=os.path.join(path_to_archive, filename))
+        else:
+            msg = "Unknown checksum mode '{}', expected 'shell' or 'native'".format(checksum_mode)
+            raise ArchiveException(reason=msg, status_code=500)
 
-        cmd = "cd {} && /usr/bin/find -L . -type f ! -path './{}' -exec /usr/bin/md5sum {{}} + > {}".format(
-            path_to_archive, filename, filename)
         log.info("Generating checksums for {}".format(path_to_archive))
         log.debug("Will now execute command {}".format(cmd))
 
@@ -618,16 +1605,48 @@ class GenChecksumsHandler(BaseDsmcHandler):
                 )
             )
         )
-        self.write_command_to_wrapper(cmd, wrapper)
+        GenChecksumsHandler.write_command_to_wrapper(cmd, wrapper)
 
-        job_id = self.runner_service.start(
+        return runner_service.start(
             wrapper,
-            nbr_of_cores=1,
+            nbr_of_cores=nbr_of_cores,
             run_dir=log_dir,
             stdout=checksum_log,
-            stderr=checksum_log
+            stderr=checksum_log,
+            job_type="checksum",
+            archive=runfolder_archive,
+            resources={ResourcePool.disk(path_to_archive): 1},
+            priority=priority,
+            progress_file=progress_file,
+            event_log=event_log
         )
 
+    @staticmethod
+    def _native_processes(config):
+        """
+        :return: the number of worker processes to checksum with in native mode, at most the cores of the service
+        """
+        nbr_of_cores = int((config.get("checksums") or {}).get("processes", 1))
+        max_cores = config.get("number_of_cores")
+        if max_cores:
+            nbr_of_cores = min(nbr_of_cores, int(max_cores))
+        return nbr_of_cores
+
+    def post(self, runfolder_archive):
+        """
+        Calculates the MD5 checksums for each file in the runfolder archive, before uploading to PDC.
+        Job is run in the background to be polled by the status endpoint. With `mode: native` in the
+        `checksums` section of the config, the files are checksummed by a pool of worker processes
+        instead of a single `md5sum`.
+
+        :param runfolder_archive: Name of the runfolder archive
+        :param priority: integer priority of the checksum job when it is queued (higher goes first, default 0)
+        :returns: HTTP 202 if checksum job has started successfully, with a `job_id` to be used in later polling, HTTP 400 or HTTP 500 if an unexpected error was encountered
+        """
+        job_id = self.start_job(self.config, self.runner_service, runfolder_archive, self._request_priority())
+
+        self._register_callback(job_id)
+
         status_end_point = "{0}://{1}{2}".format(
             self.request.protocol,
             self.request.host,
@@ -694,12 +1713,9 @@ class CreateDirHandler(BaseDsmcHandler):
             return True
 
     @staticmethod
-    def _prune_subdirs_cmd(dirpath, subdirs, exclude_dirs):
-        exclude_dirs = exclude_dirs or []
+    def _prune_subdirs_cmd(dirpath, subdirs, dir_matcher):
         cmd = []
-        for dir_to_prune in list(filter(
-                lambda d: d in exclude_dirs,
-                subdirs)):
+        for dir_to_prune in [d for d in subdirs if dir_matcher.excludes_name(d)]:
             cmd.append(
                 "rm -rf "
                 "{}".format(
@@ -707,17 +1723,13 @@ class CreateDirHandler(BaseDsmcHandler):
                         dirpath,
                         dir_to_prune)))
             # prune the tree to walk down
-            del subdirs[
-                subdirs.index(dir_to_prune)]
+            subdirs.remove(dir_to_prune)
         return " && ".join(cmd), subdirs
 
     @staticmethod
-    def _exclude_extension_cmd(dirpath, dirfiles, exclude_extensions):
-        exclude_extensions = exclude_extensions or []
+    def _exclude_extension_cmd(dirpath, dirfiles, file_matcher):
         cmd = []
-        for file_to_exclude in filter(
-                lambda f: os.path.splitext(f)[1] in exclude_extensions,
-                dirfiles):
+        for file_to_exclude in [f for f in dirfiles if file_matcher.has_excluded_extension(f)]:
             cmd.append(
                 "rm -f "
                 "{}".format(
@@ -728,14 +1740,16 @@ class CreateDirHandler(BaseDsmcHandler):
         return " && ".join(cmd)
 
     @staticmethod
-    def _create_archive_cmd(oldtree, newtree, exclude_dirs=None, exclude_extensions=None):
+    def _create_archive_cmd(oldtree, newtree, exclude_dirs=None, exclude_extensions=None, event_log=None):
         oldtree = os.path.abspath(oldtree)
-        cmd = "cp " \
-              "-as " \
-              "{} " \
-              "{}".format(
-            oldtree,
-            newtree)
+        dir_matcher = ExclusionMatcher(exclude_dirs)
+        file_matcher = ExclusionMatcher(extensions=exclude_extensions)
+        cmds = ["cp "
+                "-as "
+                "{} "
+                "{}".format(
+                    oldtree,
+                    newtree)]
         for dirpath, subdirs, dirfiles in os.walk(oldtree, topdown=True):
             newpath = dirpath.replace(
                 oldtree,
@@ -744,45 +1758,55 @@ class CreateDirHandler(BaseDsmcHandler):
             prune_cmd, subdirs = CreateDirHandler._prune_subdirs_cmd(
                 newpath,
                 subdirs,
-                exclude_dirs
+                dir_matcher
             )
             exclude_files_cmd = CreateDirHandler._exclude_extension_cmd(
                 newpath,
                 dirfiles,
-                exclude_extensions
+                file_matcher
             )
             if prune_cmd:
-                cmd = "{} && {}".format(cmd, prune_cmd)
+                cmds.append(prune_cmd)
             if exclude_files_cmd:
-                cmd = "{} && {}".format(cmd, exclude_files_cmd)
+                cmds.append(exclude_files_cmd)
 
-        return cmd
+        if event_log:
+            # the copy, and the removal of what is excluded, as two steps
+            copy_cmd, remove_cmds = cmds[0], cmds[1:]
+            cmds = [CreateDirHandler._step_cmd(event_log, "copy_tree", copy_cmd)]
+            if remove_cmds:
+                cmds.append(CreateDirHandler._step_cmd(event_log, "remove_excluded", " && ".join(remove_cmds)))
 
-    def post(self, runfolder):
-        """
-        Create a directory to be used for archiving.
+        return " && ".join(cmds)
 
-        :param runfolder: name of the runfolder we want to create an archive dir of
-        :param remove: boolean to indicate if we should remove previous archive
-        :param required_dirs: comma-separated list of directory names that are required for archival
-        :param exclude_dirs: comma-separated list of directory names to exclude from the archive
-        :param exclude_extensions: comma-separated list of extensions to exclude from the archive (include the dot)
-        :return: HTTP 200 if runfolder archive was created successfully,
-                 HTTP 400 or HTTP 500 if something unexpected occurred
-        """
-        monitored_dir = self.config["monitored_directory"]
-        path_to_runfolder = os.path.abspath(os.path.join(monitored_dir, runfolder))
-        path_to_archive_root = self.config["path_to_archive_root"]
-        path_to_archive = os.path.abspath(
-            os.path.join(path_to_archive_root, runfolder) + "_archive")
+    @staticmethod
+    def _build_archive_tree_cmd(oldtree, newtree, exclude_dirs=None, exclude_extensions=None, progress_file=None,
+                                event_log=None):
+        # build the archive tree in a single walk of the runfolder, leaving out the excluded directories
+        # and files instead of linking and then removing them
+        args = [os.path.abspath(oldtree), os.path.abspath(newtree)]
+        for d in exclude_dirs or []:
+            args.extend(["--exclude-dir", d])
+        for extension in exclude_extensions or []:
+            args.extend(["--exclude-extension", extension])
+        if progress_file:
+            args.extend(["--progress-file", progress_file])
+        args.extend(CreateDirHandler._event_log_args(event_log))
+        return CreateDirHandler._python_module_cmd("archive_upload.lib.archive_tree", *args)
 
-        # Messages
-        invalid_body_msg = "Invalid body format."
+    @staticmethod
+    def _create_dir_options(body):
+        """
+        Parse the body of a request to create an archive
 
+        :param body: the JSON body of the request
+        :return: a dict with the `remove`, `required_dirs`, `exclude_dirs` and `exclude_extensions` given in
+                 the body. Raises ArchiveException if the body is invalid.
+        """
         try:
-            request_data = json.loads(self.request.body)
+            request_data = json.loads(body)
         except (ValueError, KeyError):
-            raise ArchiveException(reason=invalid_body_msg, status_code=400)
+            raise ArchiveException(reason="Invalid body format.", status_code=400)
 
         remove = request_data.get("remove", False)
 
@@ -798,31 +1822,70 @@ class CreateDirHandler(BaseDsmcHandler):
                 val = [d.strip() for d in val.split(',')]
             return val
 
-        required_dirs = _process_comma_separated_param("required_dirs")
-        exclude_dirs = _process_comma_separated_param("exclude_dirs")
-        exclude_extensions = _process_comma_separated_param("exclude_extensions")
+        return {
+            "remove": remove,
+            "required_dirs": _process_comma_separated_param("required_dirs"),
+            "exclude_dirs": _process_comma_separated_param("exclude_dirs"),
+            "exclude_extensions": _process_comma_separated_param("exclude_extensions")}
+
+    @staticmethod
+    def start_job(config, runner_service, runfolder, remove=False, required_dirs=None, exclude_dirs=None,
+                  exclude_extensions=None, priority=0):
+        """
+        Validate a runfolder and start creating an archive of it, see `post`
+
+        :param config: the app config
+        :param runner_service: the runner service to run the job with
+        :param runfolder: the name of the runfolder to create an archive of
+        :param priority: the priority of the job in the queue of the runner service
+        :return: the job id, raises ArchiveException if the job can not be started
+        """
+        monitored_dir = config["monitored_directory"]
+        path_to_runfolder = os.path.abspath(os.path.join(monitored_dir, runfolder))
+        path_to_archive_root = config["path_to_archive_root"]
+        path_to_archive = os.path.abspath(
+            os.path.join(path_to_archive_root, runfolder) + "_archive")
 
-        if not self._validate_runfolder_exists(runfolder, monitored_dir):
+        create_mode = (config.get("create_dir") or {}).get("mode", "shell")
+        if create_mode not in ["shell", "native"]:
+            msg = "Unknown create_dir mode '{}', expected 'shell' or 'native'".format(create_mode)
+            raise ArchiveException(reason=msg, status_code=500)
+
+        if not CreateDirHandler._validate_runfolder_exists(runfolder, monitored_dir, config):
             msg = "Error encountered when validating runfolder. {} is not under {}".format(
                 runfolder, monitored_dir)
             raise ArchiveException(reason=msg, status_code=400)
 
-        for d in required_dirs:
-            if not self._verify_required_dir(path_to_runfolder, d):
+        for d in required_dirs or []:
+            if not CreateDirHandler._verify_required_dir(path_to_runfolder, d):
                 msg = "Error when validating required directories. " \
                       "Directory '{}' in {} broken or missing.".format(d, path_to_runfolder)
                 raise ArchiveException(reason=msg, status_code=500)
 
-        if not self._verify_dest(path_to_archive, remove):
+        if not CreateDirHandler._verify_dest(path_to_archive, remove):
             msg = "Error when validating destination path {} (remove={})".format(
                 path_to_archive, remove)
             raise ArchiveException(reason=msg, status_code=500)
 
+        log_dir = os.path.abspath(config["log_directory"])
+        progress_file = None
+        event_log = CreateDirHandler._new_event_log(config, os.path.basename(path_to_archive), "create_dir")
+
         log.info("Creating a new archive {}...".format(path_to_archive))
-        cmd = self._create_archive_cmd(
-            path_to_runfolder, path_to_archive, exclude_dirs, exclude_extensions)
+        if create_mode == "native":
+            progress_file = CreateDirHandler._new_progress_file(
+                config, os.path.basename(path_to_archive), "create_dir")
+            cmd = CreateDirHandler._build_archive_tree_cmd(
+                path_to_runfolder, path_to_archive, exclude_dirs, exclude_extensions, progress_file, event_log)
+        else:
+            cmd = CreateDirHandler._create_archive_cmd(
+                path_to_runfolder, path_to_archive, exclude_dirs, exclude_extensions, event_log)
+        manifest_file = ArchiveManifest.manifest_file_from_config(config, path_to_archive)
+        if manifest_file:
+            # list the new archive once, so that the following steps can start from its manifest
+            cmd = "{} && {}".format(cmd, CreateDirHandler._step_cmd(
+                event_log, "manifest", CreateDirHandler._refresh_manifest_cmd(path_to_archive, manifest_file)))
         log.info("run command: {}".format(cmd))
-        log_dir = os.path.abspath(self.config["log_directory"])
         archive_log = os.path.abspath(os.path.join(log_dir, "create_archive.log"))
 
         wrapper = os.path.abspath(
@@ -831,14 +1894,42 @@ class CreateDirHandler(BaseDsmcHandler):
                 "{}.wrapper.create.sh".format(runfolder)
             )
         )
-        self.write_command_to_wrapper(cmd, wrapper)
+        CreateDirHandler.write_command_to_wrapper(cmd, wrapper)
 
-        job_id = self.runner_service.start(
+        return runner_service.start(
             wrapper,
             nbr_of_cores=1,
             run_dir=log_dir,
             stdout=archive_log,
-            stderr=archive_log)
+            stderr=archive_log,
+            job_type="create_dir",
+            archive=os.path.basename(path_to_archive),
+            priority=priority,
+            progress_file=progress_file,
+            event_log=event_log)
+
+    def post(self, runfolder):
+        """
+        Create a directory to be used for archiving. With `mode: native` in the `create_dir` section of
+        the config, the archive is built by walking the runfolder once, and the status of the job reports
+        the number of directories and links created, and of directories and files excluded, as `progress`.
+
+        :param runfolder: name of the runfolder we want to create an archive dir of
+        :param remove: boolean to indicate if we should remove previous archive
+        :param required_dirs: comma-separated list of directory names that are required for archival
+        :param exclude_dirs: comma-separated list of directory names, or glob patterns, to exclude from the archive
+        :param exclude_extensions: comma-separated list of extensions to exclude from the archive (include the dot),
+                                   which may have several parts, e.g. `.fastq.gz`
+        :param priority: integer priority of the job when it is queued (higher goes first, default 0)
+        :return: HTTP 200 if runfolder archive was created successfully,
+                 HTTP 400 or HTTP 500 if something unexpected occurred
+        """
+        priority = self._request_priority()
+        options = self._create_dir_options(self.request.body)
+
+        job_id = self.start_job(self.config, self.runner_service, runfolder, priority=priority, **options)
+
+        self._register_callback(job_id)
 
         status_end_point = "{0}://{1}{2}".format(
             self.request.protocol,
@@ -865,7 +1956,8 @@ class CompressArchiveHandler(BaseDsmcHandler):
     """
 
     @staticmethod
-    def _create_tarball_cmd(tarball_name, path_to_archive, exclude_from_tarball):
+    def _create_tarball_cmd(tarball_name, path_to_archive, exclude_from_tarball, compression_engine=None):
+        compression_engine = compression_engine or CompressionEngine()
         exclude_patterns = " ".join(
             [
                 "--exclude={}".format(p)
@@ -876,7 +1968,7 @@ class CompressArchiveHandler(BaseDsmcHandler):
                "touch {} && " \
                "tar " \
                "--create " \
-               "--gzip " \
+               "{} " \
                "--dereference " \
                "--hard-dereference " \
                "--file={} " \
@@ -884,54 +1976,43 @@ class CompressArchiveHandler(BaseDsmcHandler):
                ".".format(
                    path_to_archive,
                    tarball_name,
+                   compression_engine.tar_option,
                    tarball_name,
                    exclude_patterns
                )
 
     @staticmethod
-    def _remove_tarballed_files_cmd(tarball_list_file):
-        # list all non-directory paths, starting at the deepest level, filter them against the
-        # tarball contents and remove the paths that have been added to the tarball
-        # grep -x ensures that the entire line is matched against the patterns in the file given
-        # by -f (which will be the list of files and folders in the tar archive)
-        # -n1 ensures that xargs will process each entry separately and -I% assigns the entry to
-        # the variable "%" which can be referenced in the rm expression
-        return "find . " \
-               "-depth " \
-               "-not -type d |" \
-               "grep " \
-               "-x " \
-               "-f {} |" \
-               "xargs " \
-               "-n1 " \
-               "-I% " \
-               "rm -f \"%\"".format(
-                   tarball_list_file
-               )
+    def _stream_tarball_cmd(tarball_name, path_to_archive, exclude_from_tarball, compression_engine,
+                            tarball_list_file, progress_file=None, event_log=None):
+        # build the tarball, the list of its members and the checksums of the archive in a single pass,
+        # replacing both `tar --create` + `tar --list` and the separate checksum step
+        args = [path_to_archive,
+                "--tarball", tarball_name,
+                "--engine", compression_engine.name,
+                "--threads", compression_engine.threads,
+                "--list-file", tarball_list_file]
+        for pattern in exclude_from_tarball:
+            args.extend(["--exclude", pattern])
+        if progress_file:
+            args.extend(["--progress-file", progress_file])
+        args.extend(BaseDsmcHandler._event_log_args(event_log))
+        return "cd {} && {}".format(
+            path_to_archive,
+            BaseDsmcHandler._python_module_cmd("archive_upload.lib.tarstream", *args))
 
     @staticmethod
-    def _remove_empty_dirs_cmd(tarball_list_file):
-        # list all directory paths, starting at the deepest level, filter them against the
-        # tarball contents and remove the paths that have been added to the tarball
-        # grep -x ensures that the entire line is matched against the patterns in the file given
-        # by -f (which will be the list of files and folders in the tar archive)
-        # -n1 ensures that xargs will process each entry separately and -I% assigns the entry to
-        # the variable "%" which can be referenced in the rm expression
-        return "find . " \
-               "-mindepth 1 " \
-               "-depth " \
-               "-type d |" \
-               "grep " \
-               "-x " \
-               "-f {} |" \
-               "xargs " \
-               "-n1 " \
-               "-I% " \
-               "rmdir " \
-               "--ignore-fail-on-non-empty " \
-               "\"%\"".format(
-                   tarball_list_file
-               )
+    def _remove_tarballed_paths_cmd(tarball_list_file, path_to_archive, manifest_file=None, event_log=None):
+        # remove the files and directories that have been added to the tarball. The paths on disk
+        # are matched against the tarball contents with a set intersection, the files are unlinked
+        # deepest first and the directories that are empty afterwards are removed
+        args = [tarball_list_file, path_to_archive]
+        if manifest_file:
+            args.extend(["--manifest-file", manifest_file])
+        args.extend(BaseDsmcHandler._event_log_args(event_log))
+        return BaseDsmcHandler._python_module_cmd(
+            "archive_upload.lib.utils",
+            "remove-tarballed",
+            *args)
 
     @staticmethod
     def _list_tarfile_contents(tarball_name, tarball_list_file):
@@ -944,25 +2025,39 @@ class CompressArchiveHandler(BaseDsmcHandler):
                     tarball_list_file
                )
 
-    def post(self, archive):
+    @staticmethod
+    def _compression_engine(config):
         """
-        Create a gziped tarball of most files in the archive, with the exception of
-        certain excluded files and directories that are to be kept as-is in the archive.
+        :return: the `CompressionEngine` set up in the config, raises ArchiveException if it is invalid
+        """
+        try:
+            return CompressionEngine.from_config(config, max_cores=config.get("number_of_cores"))
+        except ValueError as e:
+            msg = "Error when setting up the compression engine. {}".format(e)
+            raise ArchiveException(reason=msg, status_code=500)
 
-        :param archive: The name of the archive which we should pack together
-        :return: HTTP 200 if the tarball was created successfully,
-                 HTTP 400 or HTTP 500 if something unexpected occurred
+    @staticmethod
+    def start_job(config, runner_service, archive, priority=0):
+        """
+        Validate an archive and start compressing it, see `post`
 
+        :param config: the app config
+        :param runner_service: the runner service to run the job with
+        :param archive: the name of the archive to compress
+        :param priority: the priority of the job in the queue of the runner service
+        :return: the job id, raises ArchiveException if the job can not be started
         """
-        path_to_archive_root = self.config["path_to_archive_root"]
+        path_to_archive_root = config["path_to_archive_root"]
         path_to_archive = os.path.abspath(os.path.join(path_to_archive_root, archive))
 
-        if not self._validate_runfolder_exists(archive, path_to_archive_root):
+        if not CompressArchiveHandler._validate_runfolder_exists(archive, path_to_archive_root, config):
             msg = "Error encountered when validating runfolder. {} is not under {}".format(
                 archive, path_to_archive_root)
             raise ArchiveException(reason=msg, status_code=400)
 
-        tarball_name = "{}.tar.gz".format(archive)
+        compression_engine = CompressArchiveHandler._compression_engine(config)
+
+        tarball_name = "{}{}".format(archive, compression_engine.tarball_suffix)
         tarball_path = os.path.join(path_to_archive, tarball_name)
         tarball_list_file = "{}.list".format(path_to_archive)
 
@@ -972,19 +2067,47 @@ class CompressArchiveHandler(BaseDsmcHandler):
             msg = "Error when creating archive tarball. {} already exists.".format(tarball_path)
             raise ArchiveException(reason=msg, status_code=400)
 
-        exclude_from_tarball = self.config["exclude_from_tarball"]
-        cmd = "{}\n{}\n{}\n{}".format(
-            self._create_tarball_cmd(
+        exclude_from_tarball = config["exclude_from_tarball"]
+        stream_checksums = (config.get("compression") or {}).get("stream_checksums", False)
+
+        progress_file = None
+        event_log = CompressArchiveHandler._new_event_log(config, archive, "compress")
+
+        if stream_checksums:
+            progress_file = CompressArchiveHandler._new_progress_file(config, archive, "compress")
+            create_tarball_cmd = CompressArchiveHandler._stream_tarball_cmd(
                 tarball_name,
                 path_to_archive,
-                exclude_from_tarball),
-            self._list_tarfile_contents(
-                tarball_name,
-                tarball_list_file),
-            self._remove_tarballed_files_cmd(
-                tarball_list_file),
-            self._remove_empty_dirs_cmd(
-                tarball_list_file)
+                exclude_from_tarball,
+                compression_engine,
+                tarball_list_file,
+                progress_file,
+                event_log)
+        else:
+            list_tarball_cmd = CompressArchiveHandler._list_tarfile_contents(tarball_name, tarball_list_file)
+            if event_log:
+                # each step runs in a shell of its own, so the listing does not start in the archive
+                list_tarball_cmd = "cd {} && {}".format(path_to_archive, list_tarball_cmd)
+            create_tarball_cmd = "{}\n{}".format(
+                CompressArchiveHandler._step_cmd(
+                    event_log,
+                    "tar_create",
+                    CompressArchiveHandler._create_tarball_cmd(
+                        tarball_name,
+                        path_to_archive,
+                        exclude_from_tarball,
+                        compression_engine),
+                    size_of=tarball_path),
+                CompressArchiveHandler._step_cmd(
+                    event_log, "tar_list", list_tarball_cmd, count_lines=tarball_list_file))
+
+        cmd = "{}\n{}".format(
+            create_tarball_cmd,
+            CompressArchiveHandler._remove_tarballed_paths_cmd(
+                tarball_list_file,
+                path_to_archive,
+                ArchiveManifest.manifest_file_from_config(config, path_to_archive),
+                event_log)
         )
 
         log.info("run command: {}".format(cmd))
@@ -999,17 +2122,42 @@ class CompressArchiveHandler(BaseDsmcHandler):
                 "{}.wrapper.compress.sh".format(archive)
             )
         )
-        self.write_command_to_wrapper(cmd, wrapper)
+        CompressArchiveHandler.write_command_to_wrapper(cmd, wrapper)
 
-        log_dir = os.path.abspath(self.config["log_directory"])
+        log_dir = os.path.abspath(config["log_directory"])
         tarball_log = os.path.abspath(os.path.join(log_dir, "compress_archive.log"))
 
-        job_id = self.runner_service.start(
+        return runner_service.start(
             wrapper,
-            nbr_of_cores=1,
+            nbr_of_cores=compression_engine.nbr_of_cores,
             run_dir=log_dir,
             stdout=tarball_log,
-            stderr=tarball_log)
+            stderr=tarball_log,
+            job_type="compress",
+            archive=archive,
+            resources={ResourcePool.disk(path_to_archive): 1},
+            priority=priority,
+            progress_file=progress_file,
+            event_log=event_log)
+
+    def post(self, archive):
+        """
+        Create a compressed tarball of most files in the archive, with the exception of
+        certain excluded files and directories that are to be kept as-is in the archive.
+        The compression engine (gzip, pigz or zstd) and its number of threads are set in the
+        `compression` section of the config. If `stream_checksums` is enabled in that section,
+        the checksum file is written while the tarball is built, so that a separate call to
+        `gen_checksums` is no longer needed.
+
+        :param archive: The name of the archive which we should pack together
+        :param priority: integer priority of the job when it is queued (higher goes first, default 0)
+        :return: HTTP 200 if the tarball was created successfully,
+                 HTTP 400 or HTTP 500 if something unexpected occurred
+
+        """
+        job_id = self.start_job(self.config, self.runner_service, archive, self._request_priority())
+
+        self._register_callback(job_id)
 
         status_end_point = "{0}://{1}{2}".format(
             self.request.protocol,
@@ -1029,17 +2177,301 @@ class CompressArchiveHandler(BaseDsmcHandler):
         self.write_object(response_data)
 
 
+PipelineStage = collections.namedtuple("PipelineStage", ["name", "depends_on", "start"])
+
+
+class PipelineHelper(object):
+
+    """
+    Helper class for the ArchivePipelineHandler, that runs the stages of a pipeline as a graph of jobs.
+    """
+
+    # Seconds between checks of whether the jobs of the started stages have finished
+    JOB_POLL_INTERVAL = 2
+
+    # The state of the stages that are waiting for the stages they depend on
+    WAITING = "waiting"
+
+    @staticmethod
+    def _stop_running(stages, job_ids, states, runner_service):
+        for stage in stages:
+            if states[stage.name] in [State.PENDING, State.STARTED]:
+                runner_service.stop(job_ids[stage.name])
+
+    @gen.coroutine
+    def run_stages(self, job_id, stages, runner_service, started_jobs=None):
+        """
+        Runs a pipeline in the background: each stage is started as soon as all the stages it depends on are
+        done, so that stages that do not depend on each other run at the same time. The jobs of the stages
+        are added to the open ended phased job of the pipeline, whose phase is the stages that are running.
+        The state of each stage is reported as `stages` in the status of the phased job. If a stage fails,
+        the running stages are stopped and the pipeline fails.
+
+        :param job_id: The phased job that was registered for the pipeline
+        :param stages: The `PipelineStage`s of the pipeline, in the order they should be started in when
+                       several can be started. `start` is called without arguments and returns the id of
+                       the job of the stage, or raises ArchiveException if it can not be started.
+        :param runner_service: The runner service to use
+        :param started_jobs: A dict of stage name -> job id, of stages that have already been started
+        """
+        job_ids = dict(started_jobs or {})
+        states = dict((stage.name, PipelineHelper.WAITING) for stage in stages)
+        reported = {}
+
+        def _report(child_job_id=None):
+            running = [stage.name for stage in stages if states[stage.name] in [State.PENDING, State.STARTED]]
+            runner_service.set_phase(
+                job_id,
+                ",".join(running) if running else State.DONE,
+                child_job_id=child_job_id,
+                stages=dict((name, {"state": state, "job_id": job_ids.get(name)})
+                            for name, state in states.iteritems()))
+            reported.clear()
+            reported.update(states)
+
+        try:
+            for name, stage_job_id in job_ids.iteritems():
+                states[name] = runner_service.status(stage_job_id)
+                _report(stage_job_id)
+
+            while True:
+                for stage in stages:
+                    if stage.name not in job_ids and all(states[d] == State.DONE for d in stage.depends_on):
+                        stage_job_id = stage.start()
+                        if stage_job_id is None:
+                            raise ArchiveException(
+                                reason="could not start the {} stage".format(stage.name), status_code=500)
+                        log.info("Started the {} stage of pipeline {} as job {}".format(
+                            stage.name, job_id, stage_job_id))
+                        job_ids[stage.name] = stage_job_id
+                        states[stage.name] = runner_service.status(stage_job_id)
+                        _report(stage_job_id)
+                if states != reported:
+                    _report()
+
+                yield gen.sleep(PipelineHelper.JOB_POLL_INTERVAL)
+                for name, stage_job_id in job_ids.iteritems():
+                    states[name] = runner_service.status(stage_job_id)
+
+                failed = [stage.name for stage in stages
+                          if states[stage.name] in [State.ERROR, State.CANCELLED, State.NONE]]
+                if failed:
+                    _report()
+                    self._stop_running(stages, job_ids, states, runner_service)
+                    runner_service.fail_phased(job_id, "the {} stage ended in state {}".format(
+                        failed[0], states[failed[0]]))
+                    return
+                if all(state == State.DONE for state in states.itervalues()):
+                    _report()
+                    runner_service.finish_phased(job_id)
+                    return
+        except ArchiveException as e:
+            log.error("Pipeline {} failed: {}".format(job_id, e.reason))
+            self._stop_running(stages, job_ids, states, runner_service)
+            runner_service.fail_phased(job_id, e.reason)
+        except Exception as e:
+            log.exception("Unexpected error in pipeline {}".format(job_id))
+            self._stop_running(stages, job_ids, states, runner_service)
+            runner_service.fail_phased(job_id, "unexpected error: {}".format(e))
+
+
+class ArchivePipelineHandler(BaseDsmcHandler):
+
+    """
+    Handler for creating, compressing, checksumming and uploading an archive as one job.
+    """
+
+    PHASE = "create_dir"
+
+    @staticmethod
+    def _start_kept_checksums(config, runner_service, archive, kept_checksum_file, priority=0):
+        """
+        Start a job that checksums the files that are kept as-is in an archive, which can run while the
+        archive is compressed, since it does not read the files that go into the tarball.
+
+        :return: the job id, raises ArchiveException if the job can not be started
+        """
+        path_to_archive = os.path.abspath(os.path.join(config["path_to_archive_root"], archive))
+        compression_engine = CompressArchiveHandler._compression_engine(config)
+        args = [path_to_archive,
+                "--tarball", "{}{}".format(archive, compression_engine.tarball_suffix),
+                "--kept-only",
+                "--checksum-file", kept_checksum_file]
+        for pattern in config["exclude_from_tarball"]:
+            args.extend(["--exclude", pattern])
+        progress_file = ArchivePipelineHandler._new_progress_file(config, archive, "kept_checksum")
+        args.extend(["--progress-file", progress_file])
+        event_log = ArchivePipelineHandler._new_event_log(config, archive, "kept_checksum")
+        args.extend(ArchivePipelineHandler._event_log_args(event_log))
+        log_dir = os.path.abspath(config["log_directory"])
+        checksum_log = os.path.join(log_dir, "checksum.log")
+        return runner_service.start(
+            ArchivePipelineHandler._python_module_cmd("archive_upload.lib.tarstream", *args),
+            nbr_of_cores=1,
+            run_dir=log_dir,
+            stdout=checksum_log,
+            stderr=checksum_log,
+            job_type="checksum",
+            archive=archive,
+            priority=priority,
+            progress_file=progress_file,
+            event_log=event_log)
+
+    @staticmethod
+    def _start_tarball_checksum(config, runner_service, archive, kept_checksum_file, priority=0):
+        """
+        Start a job that checksums the tarball of a compressed archive, and writes the checksum file of the
+        archive with the checksums of the tarball and of the files kept as-is.
+
+        :return: the job id, raises ArchiveException if the job can not be started
+        """
+        path_to_archive = os.path.abspath(os.path.join(config["path_to_archive_root"], archive))
+        compression_engine = CompressArchiveHandler._compression_engine(config)
+        log_dir = os.path.abspath(config["log_directory"])
+        checksum_log = os.path.join(log_dir, "checksum.log")
+        progress_file = ArchivePipelineHandler._new_progress_file(config, archive, "tarball_checksum")
+        event_log = ArchivePipelineHandler._new_event_log(config, archive, "tarball_checksum")
+        cmd = ArchivePipelineHandler._python_module_cmd(
+            "archive_upload.lib.checksums",
+            path_to_archive,
+            "--only", "{}{}".format(archive, compression_engine.tarball_suffix),
+            "--merge", kept_checksum_file,
+            "--progress-file", progress_file,
+            *ArchivePipelineHandler._event_log_args(event_log))
+        return runner_service.start(
+            cmd,
+            nbr_of_cores=1,
+            run_dir=log_dir,
+            stdout=checksum_log,
+            stderr=checksum_log,
+            job_type="checksum",
+            archive=archive,
+            resources={ResourcePool.disk(path_to_archive): 1},
+            priority=priority,
+            progress_file=progress_file,
+            event_log=event_log)
+
+    @staticmethod
+    def stages(config, runner_service, archive, priority=0):
+        """
+        :param config: the app config
+        :param runner_service: the runner service to run the jobs with
+        :param archive: the name of the archive
+        :param priority: the priority of the jobs in the queue of the runner service
+        :return: the `PipelineStage`s that follow the creation of the archive (the `create_dir` stage):
+                 compressing it, checksumming it and uploading it. Unless the checksums are calculated
+                 while the tarball is built (`stream_checksums` in the `compression` section of the config),
+                 the files that are kept as-is are checksummed while the archive is compressed.
+        """
+        stream_checksums = (config.get("compression") or {}).get("stream_checksums", False)
+        stages = [PipelineStage(
+            "compress", ["create_dir"],
+            lambda: CompressArchiveHandler.start_job(config, runner_service, archive, priority))]
+
+        if stream_checksums:
+            upload_depends_on = ["compress"]
+        else:
+            kept_checksum_file = os.path.join(
+                os.path.abspath(config["log_directory"]), "{}.kept.md5".format(archive))
+            stages.extend([
+                PipelineStage(
+                    "checksum_kept", ["create_dir"],
+                    lambda: ArchivePipelineHandler._start_kept_checksums(
+                        config, runner_service, archive, kept_checksum_file, priority)),
+                PipelineStage(
+                    "checksum", ["compress", "checksum_kept"],
+                    lambda: ArchivePipelineHandler._start_tarball_checksum(
+                        config, runner_service, archive, kept_checksum_file, priority))])
+            upload_depends_on = ["checksum"]
+
+        stages.append(PipelineStage(
+            "upload", upload_depends_on,
+            lambda: UploadHandler.start_job(config, runner_service, archive, priority)["job_id"]))
+        return stages
+
+    def post(self, runfolder):
+        """
+        Create an archive of a runfolder, compress it, generate its checksums and upload it to PDC, as one job.
+        Each step is started as soon as the steps it depends on are done, and the files that are kept as-is
+        in the archive are checksummed while the tarball is built. Returns at once with a `job_id` to be
+        polled by the status endpoint. The status of the job reports the state and job id of each step as
+        `stages`, and the steps that are running as its `phase`. If a step fails, the job ends in state
+        `error`.
+
+        :param runfolder: name of the runfolder we want to archive
+        :param remove: boolean to indicate if we should remove previous archive
+        :param required_dirs: comma-separated list of directory names that are required for archival
+        :param exclude_dirs: comma-separated list of directory names, or glob patterns, to exclude from the archive
+        :param exclude_extensions: comma-separated list of extensions to exclude from the archive (include the dot),
+                                   which may have several parts, e.g. `.fastq.gz`
+        :param priority: integer priority of the jobs of the steps when they are queued (higher goes first, default 0)
+        :return: HTTP 202 if the archive is being created, with a `job_id` to be used for later polling,
+                 HTTP 400 or HTTP 500 if something unexpected occurred
+        """
+        priority = self._request_priority()
+        options = CreateDirHandler._create_dir_options(self.request.body)
+        archive = "{}_archive".format(runfolder)
+
+        # the first step is started right away, so that an invalid runfolder fails the request
+        create_job_id = CreateDirHandler.start_job(
+            self.config, self.runner_service, runfolder, priority=priority, **options)
+        if create_job_id is None:
+            raise ArchiveException(reason="Could not start creating the archive.", status_code=500)
+
+        job_id = self.runner_service.start_phased(
+            self.PHASE, job_type="pipeline", archive=archive, open_ended=True)
+        stages = [PipelineStage("create_dir", [], None)] + \
+            self.stages(self.config, self.runner_service, archive, priority)
+        IOLoop.current().spawn_callback(
+            PipelineHelper().run_stages,
+            job_id,
+            stages,
+            self.runner_service,
+            {"create_dir": create_job_id})
+        log.debug("Pipeline job_id {} for {}".format(job_id, archive))
+
+        self._register_callback(job_id)
+
+        status_end_point = "{0}://{1}{2}".format(
+            self.request.protocol,
+            self.request.host,
+            self.reverse_url("status", job_id))
+
+        response_data = {
+            "job_id": job_id,
+            "service_version": version,
+            "link": status_end_point,
+            "state": State.STARTED,
+            "phase": self.PHASE,
+            "stages": [stage.name for stage in stages],
+            "archive_path": os.path.abspath(os.path.join(self.config["path_to_archive_root"], archive)),
+            "archive_host": socket.gethostname()}
+
+        self.set_status(202, reason="started archive pipeline")
+        self.write_object(response_data)
+
+
 class StatusHandler(BaseDsmcHandler):
 
     """
     Get the status of one or all jobs.
     """
 
+    @gen.coroutine
     def get(self, job_id):
         """
         Get the status of the specified job_id, or if now id is given, the
         status of all jobs.
         :param job_id: to check status for (set to empty to get status for all)
+        :param wait: if set for a job that has not finished, wait up to this many seconds (capped at
+                     `max_wait` in the `notifications` section of the config) for its state to change
+                     before answering
+        :param state: when getting the status of all jobs, only include jobs in this state
+        :param type: when getting the status of all jobs, only include jobs of this type (upload, reupload,
+                     checksum, create_dir, compress, pipeline or bulk_reupload)
+        :param archive: when getting the status of all jobs, only include jobs working on this archive
+        :param offset: when getting the status of all jobs, skip this many of the matching jobs
+        :param limit: when getting the status of all jobs, include at most this many jobs
         """
 
         if job_id:
@@ -1049,14 +2481,38 @@ class StatusHandler(BaseDsmcHandler):
                 tsm_mock_enabled = False
             if tsm_mock_enabled:
                 self.runner_service.status = Mock(return_value=self.config["tsm_mock_status"])
+            state = self.runner_service.status(job_id)
+
+            wait = self.get_argument("wait", None)
+            if wait:
+                try:
+                    wait = float(wait)
+                except ValueError:
+                    raise ArchiveException(reason="`wait` must be a number of seconds.", status_code=400)
+                max_wait = (self.config.get("notifications") or {}).get("max_wait", 300)
+                state = yield self.job_watcher.wait_for_change(job_id, state, min(wait, max_wait))
+
             status = {
-                "state": self.runner_service.status(job_id),
+                "state": state,
                 "job_id": job_id
             }
+            status.update(self.runner_service.status_details(job_id))
         else:
-            # TODO: Update the correct status for all jobs; the filtering in jobrunner
-            # doesn't work here.
-            all_status = self.runner_service.status_all()
+            try:
+                offset = int(self.get_argument("offset", 0))
+                limit = self.get_argument("limit", None)
+                limit = int(limit) if limit is not None else None
+            except ValueError:
+                raise ArchiveException(reason="`offset` and `limit` must be integers.", status_code=400)
+            if offset < 0 or (limit is not None and limit < 0):
+                raise ArchiveException(reason="`offset` and `limit` can not be negative.", status_code=400)
+
+            all_status = self.runner_service.status_all(
+                state=self.get_argument("state", None),
+                job_type=self.get_argument("type", None),
+                archive=self.get_argument("archive", None),
+                offset=offset,
+                limit=limit)
             status_dict = {}
             for k, v in all_status.iteritems():
                 status_dict[k] = {"state": v}
@@ -0,0 +1,142 @@
+"""
+Create the archive of a runfolder as a tree of directories with symlinks to the files of the runfolder, like
+`cp -as`, but leaving out the excluded directories and files instead of removing them afterwards. The runfolder is
+walked once and nothing is created for what is excluded. Meant to be run as a job, e.g.:
+
+    python -m archive_upload.lib.archive_tree /path/to/runfolder /path/to/runfolder_archive \
+        --exclude-dir Thumbnail_Images --exclude-extension .bcl --progress-file progress.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+try:
+    from os import scandir
+except ImportError:
+    from scandir import scandir
+
+from archive_upload.lib.events import JobEventLog
+from archive_upload.lib.exclusion import ExclusionMatcher
+
+log = logging.getLogger(__name__)
+
+
+class ArchiveTreeBuilder(object):
+
+    """
+    Builds the archive tree of a runfolder. Directories are created, regular files are linked to with absolute
+    symlinks and symlinks (also symlinks to directories) are copied as symlinks, which is what `cp -as` does.
+    Directories are excluded by name or glob, at any depth, and files by extension. The counts of what has been
+    created and excluded can be written to a progress file while the tree is built.
+    """
+
+    def __init__(self, path_to_runfolder, path_to_archive, exclude_dirs=None, exclude_extensions=None,
+                 progress_file=None, progress_interval=1.0):
+        """
+        :param path_to_runfolder: the runfolder to create an archive of
+        :param path_to_archive: the archive to create, it must not exist
+        :param exclude_dirs: names, or glob patterns of names, of the directories to leave out
+        :param exclude_extensions: extensions (including the dot) of the files to leave out, e.g. ".fastq.gz"
+        :param progress_file: if set, the counts are written to this file as JSON while the tree is built
+        :param progress_interval: the minimum number of seconds between writes of the progress file
+        """
+        self.path_to_runfolder = os.path.abspath(path_to_runfolder)
+        self.path_to_archive = os.path.abspath(path_to_archive)
+        self.dir_matcher = ExclusionMatcher(exclude_dirs)
+        self.file_matcher = ExclusionMatcher(extensions=exclude_extensions)
+        self.progress_file = progress_file
+        self.progress_interval = progress_interval
+        self.counts = {"dirs": 0, "links": 0, "excluded_dirs": 0, "excluded_files": 0}
+        self._progress_written_at = 0
+
+    def _write_progress(self, done=False):
+        if not self.progress_file:
+            return
+        now = time.time()
+        if not done and now - self._progress_written_at < self.progress_interval:
+            return
+        self._progress_written_at = now
+        tmp_file = "{}.tmp".format(self.progress_file)
+        with open(tmp_file, "w") as fh:
+            json.dump(dict(self.counts, done=done), fh)
+        os.rename(tmp_file, self.progress_file)
+
+    def build(self):
+        """
+        Create the archive tree
+
+        :return: a dict with the number of directories and links created, and of directories and files excluded
+        """
+        log.info("Creating {} from {}".format(self.path_to_archive, self.path_to_runfolder))
+        os.mkdir(self.path_to_archive)
+        self.counts["dirs"] += 1
+        # (source dir, destination dir) of the created directories, to copy their modes and times once
+        # their contents have been created
+        created_dirs = [(self.path_to_runfolder, self.path_to_archive)]
+        to_visit = [(self.path_to_runfolder, self.path_to_archive)]
+
+        while to_visit:
+            src_dir, dest_dir = to_visit.pop()
+            for entry in scandir(src_dir):
+                dest = os.path.join(dest_dir, entry.name)
+                if entry.is_dir():
+                    if self.dir_matcher.excludes_name(entry.name):
+                        self.counts["excluded_dirs"] += 1
+                    elif entry.is_symlink():
+                        os.symlink(os.readlink(entry.path), dest)
+                        self.counts["links"] += 1
+                    else:
+                        os.mkdir(dest)
+                        self.counts["dirs"] += 1
+                        created_dirs.append((entry.path, dest))
+                        to_visit.append((entry.path, dest))
+                elif self.file_matcher.has_excluded_extension(entry.name):
+                    self.counts["excluded_files"] += 1
+                elif entry.is_symlink():
+                    os.symlink(os.readlink(entry.path), dest)
+                    self.counts["links"] += 1
+                else:
+                    os.symlink(entry.path, dest)
+                    self.counts["links"] += 1
+            self._write_progress()
+
+        # deepest first, since creating entries in a directory changes its modification time
+        for src_dir, dest_dir in reversed(created_dirs):
+            shutil.copystat(src_dir, dest_dir)
+
+        self._write_progress(done=True)
+        log.info("Created {dirs} directories and {links} links, excluded {excluded_dirs} directories and "
+                 "{excluded_files} files".format(**self.counts))
+        return self.counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create the archive of a runfolder as a tree of symlinks to its files")
+    parser.add_argument("path_to_runfolder")
+    parser.add_argument("path_to_archive")
+    parser.add_argument("--exclude-dir", action="append", default=[], help="name of directories to leave out")
+    parser.add_argument("--exclude-extension", action="append", default=[],
+                        help="extension (including the dot) of files to leave out")
+    parser.add_argument("--progress-file", help="file to write the progress to, as JSON")
+    parser.add_argument("--event-log", help="file to write the start and end of the step to, see `JobEventLog`")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    with JobEventLog(args.event_log).step("create_tree") as step:
+        step.update(ArchiveTreeBuilder(
+            args.path_to_runfolder,
+            args.path_to_archive,
+            args.exclude_dir,
+            args.exclude_extension,
+            args.progress_file).build())
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,357 @@
+"""
+Helpers for calculating MD5 checksums and writing them in the format used by `md5sum`.
+
+Can also be run as a job to checksum all files in an archive using a pool of worker processes, e.g.:
+
+    python -m archive_upload.lib.checksums /path/to/archive --processes 4
+
+or to checksum some of the files and merge their checksums with checksums calculated earlier, e.g.:
+
+    python -m archive_upload.lib.checksums /path/to/archive --only archive.tar.gz --merge kept.md5
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import sys
+
+from archive_upload.lib.events import JobEventLog
+from archive_upload.lib.manifest import ArchiveManifest
+
+log = logging.getLogger(__name__)
+
+# The name of the checksum file written to the root of an archive before it is uploaded to PDC
+CHECKSUM_FILENAME = "checksums_prior_to_pdc.md5"
+
+# Read files in chunks of this size when calculating checksums
+CHUNK_SIZE = 1024 * 1024
+
+
+class HashingReader(object):
+
+    """
+    Wraps a file object opened for reading and updates an MD5 digest with all data read through it.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.bytes_read = 0
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.md5.update(data)
+        self.bytes_read += len(data)
+        return data
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+
+class HashingWriter(object):
+
+    """
+    Wraps a file object opened for writing and updates an MD5 digest with all data written through it.
+    """
+
+    def __init__(self, fileobj):
+        self.fileobj = fileobj
+        self.md5 = hashlib.md5()
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.md5.update(data)
+        self.bytes_written += len(data)
+        self.fileobj.write(data)
+
+    def flush(self):
+        self.fileobj.flush()
+
+    def close(self):
+        self.fileobj.close()
+
+    def hexdigest(self):
+        return self.md5.hexdigest()
+
+
+def _md5_worker(path):
+    # module level function, so that it can be pickled and sent to the worker processes
+    return path, ChecksumUtils.md5_of_file(path)
+
+
+class ChecksumUtils(object):
+
+    @staticmethod
+    def md5_of_file(path):
+        """
+        Calculate the MD5 checksum of a file, reading it in chunks
+
+        :param path: path to the file
+        :return: the hex digest of the file contents
+        """
+        with open(path, "rb") as fh:
+            reader = HashingReader(fh)
+            while reader.read(CHUNK_SIZE):
+                pass
+        return reader.hexdigest()
+
+    @staticmethod
+    def md5sum_line(hexdigest, path):
+        """
+        Format a checksum line the way `md5sum` does, including its escaping of file names that contain
+        backslashes or newlines.
+
+        :param hexdigest: the MD5 hex digest
+        :param path: the path to the file, as it should appear in the checksum file (e.g. "./dir/file")
+        :return: a line, without the trailing newline, that `md5sum -c` understands
+        """
+        if "\\" in path or "\n" in path:
+            return "\\{}  {}".format(hexdigest, path.replace("\\", "\\\\").replace("\n", "\\n"))
+        return "{}  {}".format(hexdigest, path)
+
+    @staticmethod
+    def _unescape(path):
+        # undo the escaping of `md5sum_line`
+        unescaped = []
+        chars = iter(path)
+        for c in chars:
+            if c == "\\":
+                c = next(chars, "")
+                unescaped.append("\n" if c == "n" else c)
+            else:
+                unescaped.append(c)
+        return "".join(unescaped)
+
+    @staticmethod
+    def read_md5sum_file(checksum_file):
+        """
+        Read a checksum file in the format produced by `md5sum`
+
+        :param checksum_file: the path to the file to read
+        :return: a dict mapping the paths in the file to MD5 hex digests
+        """
+        checksums = {}
+        with open(checksum_file) as fh:
+            for line in fh:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                escaped = line.startswith("\\")
+                hexdigest, path = (line[1:] if escaped else line).split("  ", 1)
+                checksums[ChecksumUtils._unescape(path) if escaped else path] = hexdigest
+        return checksums
+
+    @staticmethod
+    def write_md5sum_file(checksums, checksum_file):
+        """
+        Write checksums to a file in the format produced by `md5sum`. The entries are sorted on path to
+        make the output deterministic.
+
+        :param checksums: a dict mapping paths, as they should appear in the file, to MD5 hex digests
+        :param checksum_file: the path to the file to write
+        """
+        tmp_file = "{}.tmp".format(checksum_file)
+        with open(tmp_file, "w") as fh:
+            for path in sorted(checksums.keys()):
+                fh.write("{}\n".format(ChecksumUtils.md5sum_line(checksums[path], path)))
+        os.rename(tmp_file, checksum_file)
+
+    @staticmethod
+    def walk_following_links(top, root=None):
+        """
+        Walk a tree like `os.walk` with `followlinks=True`, but guard against symlink loops like `find -L`: a
+        directory that is the same (device, inode) as one of its ancestors is left out, with all that is beneath it.
+
+        :param top: the directory to walk
+        :param root: if set, a parent of `top` that the walk is part of, e.g. the archive. The directories from the
+                     root down to `top` then count as ancestors as well.
+        :return: a generator of (dirpath, subdirs, files) tuples, where subdirs can be pruned like with `os.walk`
+        """
+        # normalised dirpath -> the (device, inode) of the directory and of its ancestors
+        ancestors = {}
+        top_parent = os.path.dirname(os.path.normpath(top))
+        relpath = os.path.relpath(top_parent, root) if root is not None else os.pardir
+        if relpath != os.pardir and not relpath.startswith(os.pardir + os.sep):
+            parents = [root]
+            for component in relpath.split(os.sep):
+                if component != os.curdir:
+                    parents.append(os.path.join(parents[-1], component))
+            ancestors[top_parent] = tuple((st.st_dev, st.st_ino) for st in (os.stat(path) for path in parents))
+        for dirpath, subdirs, dirfiles in os.walk(top, followlinks=True):
+            st = os.stat(dirpath)
+            parent_ancestors = ancestors.get(os.path.dirname(os.path.normpath(dirpath)), ())
+            if (st.st_dev, st.st_ino) in parent_ancestors:
+                log.warning("Not descending into {}, it links back to one of its parents".format(dirpath))
+                del subdirs[:]
+                continue
+            ancestors[os.path.normpath(dirpath)] = parent_ancestors + ((st.st_dev, st.st_ino),)
+            yield dirpath, subdirs, dirfiles
+
+    @staticmethod
+    def files_to_checksum(path_to_archive, exclude=None):
+        """
+        List all files beneath the archive, following symlinks like `find -L . -type f`, together with their sizes.
+        The files are sorted on size, largest first, so that a pool of workers can start with the files that take
+        the longest time to checksum.
+
+        :param path_to_archive: the archive to list files in
+        :param exclude: paths, relative to the archive root, to leave out
+        :return: a list of (full path, size) tuples
+        """
+        exclude = set(exclude or [])
+        files = []
+        for dirpath, subdirs, dirfiles in ChecksumUtils.walk_following_links(path_to_archive):
+            for f in dirfiles:
+                full_path = os.path.join(dirpath, f)
+                if os.path.relpath(full_path, path_to_archive) in exclude or not os.path.isfile(full_path):
+                    continue
+                files.append((full_path, os.path.getsize(full_path)))
+
+        return sorted(files, key=lambda f: f[1], reverse=True)
+
+    @staticmethod
+    def _checksum_files(files, processes, stats=None):
+        # checksum the files, given as a list of full paths, with a pool of worker processes, and add the
+        # number of files and bytes hashed to `stats`, if given
+        pool = multiprocessing.Pool(processes)
+        try:
+            checksums = dict(pool.imap_unordered(_md5_worker, files, chunksize=1))
+        finally:
+            pool.terminate()
+            pool.join()
+        if stats is not None:
+            stats["files"] = stats.get("files", 0) + len(checksums)
+            stats["bytes_hashed"] = stats.get("bytes_hashed", 0) + sum(os.path.getsize(f) for f in checksums)
+        return checksums
+
+    @staticmethod
+    def write_progress_file(progress, progress_file):
+        """
+        Write the progress of a job as a JSON object, replacing the file atomically
+
+        :param progress: a dict, e.g. with the number of bytes hashed
+        :param progress_file: the path to the file to write
+        """
+        tmp_file = "{}.tmp".format(progress_file)
+        with open(tmp_file, "w") as fh:
+            json.dump(progress, fh)
+        os.rename(tmp_file, progress_file)
+
+    @staticmethod
+    def checksum_archive(path_to_archive, processes=1, manifest_file=None, stats=None):
+        """
+        Calculate the MD5 checksums of all files in the archive using a pool of worker processes.
+
+        :param path_to_archive: the archive to checksum
+        :param processes: the number of worker processes to use
+        :param manifest_file: if set, the files are listed through the manifest of the archive, checksums
+                              recorded in the manifest are reused for files that are unchanged and the
+                              calculated checksums are recorded in it
+        :param stats: if set, a dict that the number of files and bytes hashed are added to
+        :return: a dict mapping paths relative to the archive root, prefixed with "./", to MD5 hex digests
+        """
+        if manifest_file:
+            return ChecksumUtils._checksum_archive_with_manifest(path_to_archive, processes, manifest_file, stats)
+
+        files = ChecksumUtils.files_to_checksum(path_to_archive, exclude=[CHECKSUM_FILENAME])
+        log.info("Calculating checksums for {} files in {} using {} processes".format(
+            len(files), path_to_archive, processes))
+
+        checksums = ChecksumUtils._checksum_files([f[0] for f in files], processes, stats)
+        return {
+            "./{}".format(os.path.relpath(path, path_to_archive)): hexdigest
+            for path, hexdigest in checksums.iteritems()}
+
+    @staticmethod
+    def checksum_paths(path_to_archive, relpaths, processes=1, stats=None):
+        """
+        Calculate the MD5 checksums of some of the files in the archive using a pool of worker processes.
+
+        :param path_to_archive: the archive the files are in
+        :param relpaths: the paths of the files relative to the archive root
+        :param processes: the number of worker processes to use
+        :param stats: if set, a dict that the number of files and bytes hashed are added to
+        :return: a dict mapping paths relative to the archive root, prefixed with "./", to MD5 hex digests
+        """
+        files = [os.path.join(path_to_archive, os.path.normpath(relpath)) for relpath in relpaths]
+        checksums = ChecksumUtils._checksum_files(files, processes, stats)
+        return {
+            "./{}".format(os.path.relpath(path, path_to_archive)): hexdigest
+            for path, hexdigest in checksums.iteritems()}
+
+    @staticmethod
+    def _checksum_archive_with_manifest(path_to_archive, processes, manifest_file, stats=None):
+        manifest = ArchiveManifest.load(path_to_archive, manifest_file)
+        # the cached checksums are only valid if the files themselves are unchanged, so stat all files
+        manifest.refresh(verify_files=True)
+
+        checksums = {}
+        to_checksum = []
+        for relpath, entry in manifest.regular_files():
+            if relpath == CHECKSUM_FILENAME:
+                continue
+            if "md5" in entry:
+                checksums[relpath] = entry["md5"]
+            else:
+                to_checksum.append((relpath, entry["size"]))
+
+        log.info("Calculating checksums for {} files in {} using {} processes, reusing {} from the manifest".format(
+            len(to_checksum), path_to_archive, processes, len(checksums)))
+
+        # largest files first, see `files_to_checksum`
+        to_checksum.sort(key=lambda f: f[1], reverse=True)
+        calculated = ChecksumUtils._checksum_files(
+            [os.path.join(manifest.path_to_archive, f[0]) for f in to_checksum], processes, stats)
+        for relpath, _ in to_checksum:
+            hexdigest = calculated[os.path.join(manifest.path_to_archive, relpath)]
+            manifest.set_md5(relpath, hexdigest)
+            checksums[relpath] = hexdigest
+        manifest.save()
+
+        return {"./{}".format(relpath): hexdigest for relpath, hexdigest in checksums.iteritems()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Calculate MD5 checksums for all files in an archive, using a pool of worker processes")
+    parser.add_argument("path_to_archive")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--manifest-file", help="list the archive through this manifest, and reuse and record "
+                                                "checksums in it")
+    parser.add_argument("--checksum-file", help="file to write to, default is {} in the archive root".format(
+        CHECKSUM_FILENAME))
+    parser.add_argument("--only", action="append", default=[],
+                        help="only checksum this file, given relative to the archive root")
+    parser.add_argument("--merge", action="append", default=[],
+                        help="checksum file whose checksums are written together with the calculated ones")
+    parser.add_argument("--progress-file", help="file to write the number of files and bytes hashed to, as JSON, "
+                                                "once the checksums have been written")
+    parser.add_argument("--event-log", help="file to write the start and end of the step to, see `JobEventLog`")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    path_to_archive = os.path.abspath(args.path_to_archive)
+    checksums = {}
+    stats = {"files": 0, "bytes_hashed": 0}
+    with JobEventLog(args.event_log).step("md5", processes=args.processes) as step:
+        for merge_file in args.merge:
+            checksums.update(ChecksumUtils.read_md5sum_file(merge_file))
+        if args.only:
+            checksums.update(ChecksumUtils.checksum_paths(path_to_archive, args.only, args.processes, stats))
+        else:
+            checksums.update(ChecksumUtils.checksum_archive(
+                path_to_archive, args.processes, args.manifest_file, stats))
+        ChecksumUtils.write_md5sum_file(
+            checksums,
+            args.checksum_file or os.path.join(path_to_archive, CHECKSUM_FILENAME))
+        step.update(files=stats["files"], bytes=stats["bytes_hashed"])
+    if args.progress_file:
+        ChecksumUtils.write_progress_file(dict(stats, done=True), args.progress_file)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+import logging
+
+log = logging.getLogger(__name__)
+
+
+class CompressionEngine(object):
+
+    """
+    Describes the program used to compress the archive tarball and how many cores it needs.
+
+    Supported engines are:
+
+      - `gzip`: the single-threaded gzip built into tar (default)
+      - `pigz`: a parallel, gzip-compatible block compressor
+      - `zstd`: zstandard, using the specified number of worker threads
+    """
+
+    # engine name -> (tarball suffix, tar option template, stand-alone compression command template)
+    ENGINES = {
+        "gzip": (".tar.gz", "--gzip", "gzip -c"),
+        "pigz": (".tar.gz", "--use-compress-program='pigz -p {threads}'", "pigz -p {threads} -c"),
+        "zstd": (".tar.zst", "--use-compress-program='zstd -T{threads}'", "zstd -T{threads} -q -c"),
+    }
+
+    DEFAULT_ENGINE = "gzip"
+
+    def __init__(self, name=DEFAULT_ENGINE, threads=1):
+        """
+        :param name: the name of the engine, must be one of the keys in `CompressionEngine.ENGINES`
+        :param threads: the number of threads the engine should use (ignored for gzip)
+        """
+        if name not in CompressionEngine.ENGINES:
+            raise ValueError(
+                "Unknown compression engine '{}', expected one of {}".format(
+                    name, sorted(CompressionEngine.ENGINES.keys())))
+        try:
+            threads = int(threads)
+        except (TypeError, ValueError):
+            raise ValueError("The number of compression threads must be an integer, got '{}'".format(threads))
+        if threads < 1:
+            raise ValueError("The number of compression threads must be at least 1, got {}".format(threads))
+
+        self.name = name
+        self.threads = 1 if name == "gzip" else threads
+
+    @staticmethod
+    def from_config(config, max_cores=None):
+        """
+        Create a `CompressionEngine` from the `compression` section of the app config. If the section is missing,
+        the default single-threaded gzip engine is used.
+
+        :param config: the app config
+        :param max_cores: if given, the number of threads is capped to this value, since the job runner will not be
+                          able to schedule a job that requires more cores than it has been given
+        :return: a `CompressionEngine`
+        """
+        compression_config = config.get("compression") or {}
+        engine = CompressionEngine(
+            compression_config.get("engine", CompressionEngine.DEFAULT_ENGINE),
+            compression_config.get("threads", 1))
+
+        if max_cores and engine.threads > int(max_cores):
+            log.warning(
+                "Requested {} compression threads but only {} cores are available, using {} threads".format(
+                    engine.threads, max_cores, max_cores))
+            engine.threads = int(max_cores)
+
+        return engine
+
+    @property
+    def tarball_suffix(self):
+        return CompressionEngine.ENGINES[self.name][0]
+
+    @property
+    def tar_option(self):
+        """
+        :return: the option that should be passed to `tar` in order to use this engine
+        """
+        return CompressionEngine.ENGINES[self.name][1].format(threads=self.threads)
+
+    @property
+    def compress_cmd(self):
+        """
+        :return: a command that compresses stdin to stdout using this engine
+        """
+        return CompressionEngine.ENGINES[self.name][2].format(threads=self.threads)
+
+    @property
+    def nbr_of_cores(self):
+        """
+        :return: the number of cores that should be reserved in the job runner for a job using this engine
+        """
+        return self.threads
@@ -0,0 +1,363 @@
+import collections
+import logging
+import os
+import re
+import time
+
+log = logging.getLogger(__name__)
+
+
+# An entry in the output from `dsmc q ar`
+DsmcArchiveEntry = collections.namedtuple("DsmcArchiveEntry", ["path", "size", "description"])
+
+
+class DsmcQueryParser(object):
+
+    """
+    Incrementally parses the output from `dsmc q ar` for the entries beneath an archive path, or beneath any of
+    several archive paths when one query covers several archives. Output can be fed in chunks as it is read from
+    dsmc, so the full output never has to be held in memory.
+
+    A (TSM) line can look like:
+    4,096  B  2017-07-27 17.48.34    /data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive/Config Never e374bd6b-ab36-4f41-94d3-f4eaea9f30d4
+    but varies, depending on the environment's locale. Size can e.g. be "4 096".
+    """
+
+    # Number of lines that did not describe an archived file to keep, for error messages
+    UNPARSED_LINES_TO_KEEP = 20
+
+    def __init__(self, path_to_archive):
+        """
+        :param path_to_archive: the archive path that entries should be beneath, or a list of archive paths. It is
+                                escaped, so that regex metacharacters in runfolder names match literally.
+        """
+        if isinstance(path_to_archive, basestring):
+            path_to_archive = [path_to_archive]
+        self.paths_to_archives = set(path.rstrip("/") for path in path_to_archive)
+        self.path_to_archive = path_to_archive[0].rstrip("/")
+        # We can't be completely sure what format the timestamp will be returned with.
+        # And we can not be 100% sure what format the description will have either, at least in the future.
+        # So we rely on the size being first, followed by " B ", and the path being followed by the
+        # expiration "Never".
+        self.pattern = re.compile(
+            r"^\s*(?P<size>\d[\d,. ]*?)\s+B\s.*?"
+            r"(?P<path>(?:{})(?:/.*)?)\s+Never\s+(?P<description>.*?)\s*$".format(
+                "|".join(re.escape(path) for path in sorted(self.paths_to_archives, key=len, reverse=True))))
+        self.unparsed_lines = collections.deque(maxlen=DsmcQueryParser.UNPARSED_LINES_TO_KEEP)
+        self._partial_line = ""
+
+    def archive_of(self, path):
+        """
+        :param path: the path of a parsed entry
+        :return: the archive path that the entry is beneath (or is), None if it is not beneath any of them
+        """
+        while path not in self.paths_to_archives:
+            parent = os.path.dirname(path)
+            if parent == path:
+                return None
+            path = parent
+        return path
+
+    @staticmethod
+    def parse_size(size):
+        """
+        Convert a size as printed by dsmc, e.g. "4,096" or "4 096", to an int
+        """
+        return int(re.sub(r"\D", "", size))
+
+    def parse_line(self, line):
+        """
+        :param line: a line of dsmc output
+        :return: a `DsmcArchiveEntry` if the line describes an entry beneath the archive path, None otherwise
+        """
+        match = self.pattern.match(line)
+        if match is None:
+            if line.strip():
+                self.unparsed_lines.append(line.strip())
+            return None
+        return DsmcArchiveEntry(
+            match.group("path").strip(),
+            self.parse_size(match.group("size")),
+            match.group("description"))
+
+    def feed(self, chunk):
+        """
+        Parse a chunk of dsmc output. Any incomplete line at the end of the chunk is kept until the next call.
+
+        :param chunk: a string with dsmc output
+        :return: a generator of `DsmcArchiveEntry` for the complete lines in the chunk
+        """
+        lines = (self._partial_line + chunk).split("\n")
+        self._partial_line = lines.pop()
+        for line in lines:
+            entry = self.parse_line(line)
+            if entry is not None:
+                yield entry
+
+    def close(self):
+        """
+        Parse what is left of the output once dsmc has finished.
+
+        :return: a generator of `DsmcArchiveEntry`
+        """
+        line, self._partial_line = self._partial_line, ""
+        entry = self.parse_line(line)
+        if entry is not None:
+            yield entry
+
+    def parse(self, lines):
+        """
+        Parse an iterable of output lines, e.g. an open file or a pipe, as they are read.
+
+        :param lines: an iterable of dsmc output lines
+        :return: a generator of `DsmcArchiveEntry`
+        """
+        for line in lines:
+            entry = self.parse_line(line.rstrip("\n"))
+            if entry is not None:
+                yield entry
+
+
+class DsmcLogScanner(object):
+
+    """
+    Scans a dsmc log for warnings (e.g. ANS1809W). The log is read incrementally: each scan only reads what
+    has been appended since the previous scan, so a log can be scanned repeatedly at a cost proportional to
+    its growth. Scanning stops at the first warning that is not whitelisted.
+    """
+
+    WARNING_PATTERN = re.compile(r"ANS[0-9]+W")
+
+    def __init__(self, log_file, whitelisted_warnings):
+        """
+        :param log_file: the dsmc log to scan
+        :param whitelisted_warnings: the warnings that are acceptable
+        """
+        self.log_file = log_file
+        self.whitelisted_warnings = set(whitelisted_warnings)
+        self.warnings = set()
+        self.non_whitelisted_warning = None
+        self.offset = 0
+
+    def scan(self, complete=False):
+        """
+        Scan the lines that have been appended to the log since the previous scan. A line that has not been
+        completely written yet is left for the next scan.
+
+        :param complete: if True, the log is not written to anymore and a last line without a newline is scanned
+        :return: True if only whitelisted warnings (or none) have been found so far, False otherwise
+        """
+        if self.non_whitelisted_warning is not None:
+            return False
+
+        with open(self.log_file, "rb") as fh:
+            if os.fstat(fh.fileno()).st_size < self.offset:
+                log.info("{} has been truncated, scanning it from the start".format(self.log_file))
+                self.offset = 0
+            fh.seek(self.offset)
+            for line in iter(fh.readline, ""):
+                if not line.endswith("\n") and not complete:
+                    break
+                self.offset = fh.tell()
+                for warning in DsmcLogScanner.WARNING_PATTERN.findall(line):
+                    self.warnings.add(warning)
+                    if warning not in self.whitelisted_warnings:
+                        self.non_whitelisted_warning = warning
+                        return False
+        return True
+
+
+class DsmcProgressParser(object):
+
+    """
+    Follows the progress of a `dsmc archive` session from its output file. Like `DsmcLogScanner`, each scan only
+    reads what has been appended since the previous scan. While dsmc is running, the objects and bytes are counted
+    from the line it prints for each object it sends, e.g.:
+
+    Normal File-->         1,048,576 /data/mm-xart002/runfolders/run_archive/Data/s_1.bcl [Sent]
+
+    and once it has finished, they are taken from the summary it prints (e.g. "Total number of objects
+    archived:"). The current transfer rate is the rate over the scans of the last `RATE_WINDOW` seconds. The warnings
+    in the output (e.g. ANS1809W) are counted by code in `warnings`.
+    """
+
+    OBJECT_PATTERN = re.compile(
+        r"^(?:Retry # \d+\s+)?(?:Normal File|Directory|Symbolic Link|Special File)-->\s+(?P<size>\d[\d,. ]*?)\s+"
+        r"/.*\[(?P<result>[^\]]*)\]\s*$")
+    # e.g. ANS1898I ***** Processed     1,500 files *****
+    PROCESSED_PATTERN = re.compile(r"ANS1898I\s+\*+\s+Processed\s+(?P<count>\d[\d,. ]*?)\s+files")
+    # e.g. ANS1228E Sending of object '/data/...' failed
+    FAILED_PATTERN = re.compile(r"ANS1228E")
+    SUMMARY_PATTERN = re.compile(r"^\s*(?P<label>[A-Za-z ]+?):\s+(?P<value>\S.*?)\s*$")
+    AMOUNT_PATTERN = re.compile(r"^(?P<number>\d[\d,. ]*?)\s*(?P<unit>[KMGTP]?B)\b")
+
+    SUMMARY_COUNTS = {
+        "Total number of objects inspected": "objects_inspected",
+        "Total number of objects archived": "objects_archived",
+        "Total number of objects failed": "objects_failed",
+    }
+    UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3, "TB": 1024 ** 4, "PB": 1024 ** 5}
+
+    # Seconds of scans that the current transfer rate is calculated over
+    RATE_WINDOW = 60
+
+    def __init__(self, output_file, started_at=None):
+        """
+        :param output_file: the file that the output of dsmc is written to
+        :param started_at: when the job running dsmc was started, to work out the elapsed time while it is running
+        """
+        self.output_file = output_file
+        self.started_at = started_at
+        self._reset()
+
+    def _reset(self):
+        self.offset = 0
+        self.objects_inspected = 0
+        self.objects_archived = 0
+        self.objects_failed = 0
+        self.bytes_transferred = 0
+        self.elapsed_seconds = None
+        self.finished = False
+        # warning code -> the number of lines it is on, e.g. ANS1809W when the session was disconnected
+        self.warnings = collections.Counter()
+        # (time of scan, bytes transferred) of the scans in the rate window
+        self._samples = collections.deque()
+
+    @staticmethod
+    def parse_amount(amount):
+        """
+        Convert an amount of bytes as printed in the summary of dsmc, e.g. "1,234.56 KB" or "1.234,56 KB", to an int
+        """
+        match = DsmcProgressParser.AMOUNT_PATTERN.match(amount.strip())
+        if match is None:
+            return None
+        number = re.sub(r"\s", "", match.group("number"))
+        # the summary has two decimals, the other separators group the thousands
+        if re.search(r"[.,]\d\d$", number):
+            number = "{}.{}".format(re.sub(r"\D", "", number[:-3]), number[-2:])
+        else:
+            number = re.sub(r"\D", "", number)
+        return int(float(number) * DsmcProgressParser.UNITS[match.group("unit")])
+
+    @staticmethod
+    def parse_duration(duration):
+        """
+        Convert a duration as printed in the summary of dsmc, e.g. "01:02:03", to seconds
+        """
+        seconds = 0
+        for part in duration.split(":"):
+            seconds = seconds * 60 + int(part)
+        return seconds
+
+    def _parse_line(self, line):
+        self.warnings.update(DsmcLogScanner.WARNING_PATTERN.findall(line))
+
+        match = DsmcProgressParser.OBJECT_PATTERN.match(line)
+        if match is not None:
+            self.objects_inspected += 1
+            if match.group("result").strip() == "Sent":
+                self.objects_archived += 1
+                self.bytes_transferred += DsmcQueryParser.parse_size(match.group("size"))
+            return
+
+        match = DsmcProgressParser.PROCESSED_PATTERN.search(line)
+        if match is not None:
+            self.objects_inspected = max(self.objects_inspected, DsmcQueryParser.parse_size(match.group("count")))
+            return
+
+        if DsmcProgressParser.FAILED_PATTERN.search(line):
+            self.objects_failed += 1
+            return
+
+        match = DsmcProgressParser.SUMMARY_PATTERN.match(line)
+        if match is None:
+            return
+        label, value = match.group("label"), match.group("value")
+        if label in DsmcProgressParser.SUMMARY_COUNTS:
+            setattr(self, DsmcProgressParser.SUMMARY_COUNTS[label], DsmcQueryParser.parse_size(value))
+            self.finished = True
+        elif label == "Total number of bytes transferred":
+            amount = self.parse_amount(value)
+            if amount is not None:
+                self.bytes_transferred = amount
+        elif label == "Elapsed processing time":
+            self.elapsed_seconds = self.parse_duration(value)
+
+    def scan(self, complete=False, now=None):
+        """
+        Parse the lines that have been appended to the output since the previous scan. A line that has not been
+        completely written yet is left for the next scan.
+
+        :param complete: if True, the output is not written to anymore and a last line without a newline is parsed
+        :param now: the time of the scan (defaults to the current time)
+        :return: the progress, see `progress`, or None if dsmc has not written any output yet
+        """
+        now = now or time.time()
+        try:
+            fh = open(self.output_file, "rb")
+        except IOError:
+            return None
+        with fh:
+            if os.fstat(fh.fileno()).st_size < self.offset:
+                log.info("{} has been truncated, parsing it from the start".format(self.output_file))
+                self._reset()
+            fh.seek(self.offset)
+            for line in iter(fh.readline, ""):
+                if not line.endswith("\n") and not complete:
+                    break
+                self.offset = fh.tell()
+                self._parse_line(line.rstrip("\r\n"))
+
+        self._samples.append((now, self.bytes_transferred))
+        while len(self._samples) > 2 and self._samples[1][0] <= now - DsmcProgressParser.RATE_WINDOW:
+            self._samples.popleft()
+        return self.progress(now)
+
+    def progress(self, now=None):
+        """
+        :param now: the current time (defaults to the current time)
+        :return: a dict with the number of objects inspected, archived and failed, the bytes transferred, the elapsed
+                 seconds, the average and current transfer rates (bytes per second) and whether dsmc has finished.
+                 Values that are not known yet are None.
+        """
+        now = now or time.time()
+        elapsed_seconds = self.elapsed_seconds
+        if elapsed_seconds is None and self.started_at is not None:
+            elapsed_seconds = max(0, int(now - self.started_at))
+
+        transfer_rate = None
+        if not self.finished and len(self._samples) > 1:
+            (first_time, first_bytes), (last_time, last_bytes) = self._samples[0], self._samples[-1]
+            if last_time > first_time:
+                transfer_rate = int((last_bytes - first_bytes) / (last_time - first_time))
+
+        return {
+            "objects_inspected": self.objects_inspected,
+            "objects_archived": self.objects_archived,
+            "objects_failed": self.objects_failed,
+            "bytes_transferred": self.bytes_transferred,
+            "elapsed_seconds": elapsed_seconds,
+            "average_rate": int(self.bytes_transferred / elapsed_seconds) if elapsed_seconds else None,
+            "transfer_rate": transfer_rate,
+            "finished": self.finished,
+        }
+
+    @staticmethod
+    def combine(progresses):
+        """
+        Combine the progress of dsmc sessions that run side by side, e.g. the shards of an upload
+
+        :param progresses: a list of progress dicts, see `progress`
+        :return: the combined progress: the counts, bytes and rates are summed, and the elapsed time is the longest
+        """
+        def _sum(key):
+            values = [progress[key] for progress in progresses if progress[key] is not None]
+            return sum(values) if values else None
+
+        combined = {key: _sum(key) for key in [
+            "objects_inspected", "objects_archived", "objects_failed", "bytes_transferred", "average_rate",
+            "transfer_rate"]}
+        elapsed = [progress["elapsed_seconds"] for progress in progresses if progress["elapsed_seconds"] is not None]
+        combined["elapsed_seconds"] = max(elapsed) if elapsed else None
+        combined["finished"] = all(progress["finished"] for progress in progresses)
+        return combined
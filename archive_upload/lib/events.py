@@ -0,0 +1,176 @@
+"""
+Structured events of the steps of a job, e.g. creating and listing a tarball or removing the files that have been
+added to it. Each step appends a JSON object per line to the event log of the job when it starts and when it ends,
+e.g.:
+
+    {"time": 1500000000.12, "step": "tar_create", "event": "start"}
+    {"time": 1500000312.57, "step": "tar_create", "event": "end", "seconds": 312.45, "bytes": 52613349376}
+
+The steps that run in the service's own modules write their events themselves. A shell command can be run as a step
+of a job with e.g.:
+
+    python -m archive_upload.lib.events /path/to/archive.compress.events.jsonl tar_list \
+        "tar --list --file=archive.tar.gz > archive.list" --count-lines archive.list
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+
+class JobEventLog(object):
+
+    """
+    Appends the events of the steps of a job to its event log. Without an event log, nothing is written, so that the
+    steps can be instrumented whether or not events are enabled.
+    """
+
+    START = "start"
+    END = "end"
+
+    def __init__(self, event_log=None):
+        """
+        :param event_log: the file to append the events to, as JSON lines
+        """
+        self.event_log = event_log
+
+    def emit(self, step, event, **fields):
+        """
+        Append an event to the event log
+
+        :param step: the name of the step, e.g. "tar_create"
+        :param event: what happened, e.g. `START` or `END`
+        :param fields: other fields of the event, e.g. the number of bytes or files the step processed
+        """
+        if not self.event_log:
+            return
+        fields.update({"time": round(time.time(), 3), "step": step, "event": event})
+        # a single write of a line to a file opened for appending, so that the lines of steps that write to the
+        # same event log are not interleaved
+        with open(self.event_log, "a") as fh:
+            fh.write("{}\n".format(json.dumps(fields, sort_keys=True)))
+
+    @contextlib.contextmanager
+    def step(self, name, **fields):
+        """
+        Emit the start and end events of a step around a block of code. The block is given a dict that it can put
+        the counts of what it has processed in, e.g. `files` and `bytes`, which are added to the end event. If the
+        block raises, the end event has the `error` instead.
+
+        :param name: the name of the step
+        :param fields: other fields of the start event
+        """
+        counts = {}
+        started_at = time.time()
+        self.emit(name, JobEventLog.START, **fields)
+        try:
+            yield counts
+        except Exception as e:
+            self.emit(name, JobEventLog.END, seconds=round(time.time() - started_at, 3), error=str(e), **counts)
+            raise
+        self.emit(name, JobEventLog.END, seconds=round(time.time() - started_at, 3), **counts)
+
+    @staticmethod
+    def read(event_log):
+        """
+        :param event_log: the file the events have been written to
+        :return: a list of the events in the file, empty if it has not been written yet. A line that is not
+                 (yet) complete is left out.
+        """
+        events = []
+        try:
+            with open(event_log) as fh:
+                for line in fh:
+                    try:
+                        events.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except IOError:
+            pass
+        return events
+
+    @staticmethod
+    def summarize(events, now=None):
+        """
+        Pair the start and end events of each step
+
+        :param events: a list of events, in the order they were written
+        :param now: the current time, for the seconds of the steps that are still running (defaults to the
+                    current time)
+        :return: a dict with the `steps` in the order they were started, each with its name, start time, seconds
+                 and the fields of its end event, the total `seconds` from the start of the first step to the end of
+                 the last one, and the `slowest_step`. None if there are no steps.
+        """
+        now = now or time.time()
+        steps = []
+        # step name -> the steps with that name that have not ended, latest last
+        running = {}
+        for event in events:
+            if event.get("event") == JobEventLog.START:
+                step = {"step": event["step"], "started_at": event["time"]}
+                steps.append(step)
+                running.setdefault(event["step"], []).append(step)
+            elif event.get("event") == JobEventLog.END and running.get(event["step"]):
+                step = running[event["step"]].pop()
+                step.update((k, v) for k, v in event.items() if k not in ("time", "event", "step"))
+                step["ended_at"] = event["time"]
+
+        if not steps:
+            return None
+
+        for step in steps:
+            if "ended_at" not in step:
+                step["running"] = True
+                step["seconds"] = round(now - step["started_at"], 3)
+        ended_at = max(step.get("ended_at", now) for step in steps)
+        return {
+            "steps": steps,
+            "seconds": round(ended_at - min(step["started_at"] for step in steps), 3),
+            "slowest_step": max(steps, key=lambda step: step["seconds"])["step"],
+        }
+
+
+def _count_lines(path):
+    with open(path) as fh:
+        return sum(1 for _ in fh)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run a shell command as a step of a job, and write its start "
+                                                 "and end to the event log of the job")
+    parser.add_argument("event_log")
+    parser.add_argument("step", help="name of the step, e.g. tar_create")
+    parser.add_argument("command", help="the shell command to run")
+    parser.add_argument("--size-of", help="report the size of this file, once the command is done, as bytes")
+    parser.add_argument("--count-lines", help="report the number of lines in this file, once the command is done, "
+                                              "as files")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    events = JobEventLog(args.event_log)
+    started_at = time.time()
+    events.emit(args.step, JobEventLog.START)
+    returncode = subprocess.call(args.command, shell=True, executable="/bin/bash")
+
+    counts = {"returncode": returncode}
+    try:
+        if args.size_of:
+            counts["bytes"] = os.path.getsize(args.size_of)
+        if args.count_lines:
+            counts["files"] = _count_lines(args.count_lines)
+    except (IOError, OSError) as e:
+        log.warning("Could not count what {} processed: {}".format(args.step, e))
+    events.emit(args.step, JobEventLog.END, seconds=round(time.time() - started_at, 3), **counts)
+    return returncode
+
+
+if __name__ == "__main__":
+    sys.exit(main())
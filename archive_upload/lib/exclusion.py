@@ -0,0 +1,109 @@
+"""
+Matching of paths against the rules for what to leave out of an archive or a tarball. The rules are compiled once,
+so that the cost of matching a path does not grow with the number of rules.
+"""
+
+import fnmatch
+import re
+
+# characters that make a pattern a glob rather than a plain name
+GLOB_CHARS = re.compile(r"[*?\[]")
+
+
+class ExclusionMatcher(object):
+
+    """
+    A compiled set of exclusion rules, given as patterns and extensions:
+
+    patterns   = names or glob patterns, with the semantics of `tar --exclude`: patterns without a slash are
+                 matched against the name of a path, other patterns against the end of the path relative to
+                 the root, starting at any component, i.e. "a/b" excludes "a/b" as well as "x/a/b" (a leading
+                 "./" is ignored). Plain names and paths are looked up in sets, and all globs are combined into
+                 one regex for names and one for paths.
+    extensions = file extensions, including the dot, that may have several parts, e.g. ".fastq.gz". They are
+                 kept in a trie of their parts in reverse, so that the extensions of a name are looked up one
+                 part at a time, starting with the last.
+    """
+
+    # marks the end of an extension in the trie
+    _END = None
+
+    def __init__(self, patterns=None, extensions=None):
+        """
+        :param patterns: names or glob patterns of the paths to exclude
+        :param extensions: extensions of the files to exclude, e.g. ".bcl" or ".fastq.gz"
+        """
+        self.names = set()
+        self.paths = set()
+        name_globs = []
+        path_globs = []
+        for pattern in patterns or []:
+            if "/" in pattern:
+                if pattern.startswith("./"):
+                    pattern = pattern[2:]
+                if GLOB_CHARS.search(pattern):
+                    path_globs.append(pattern)
+                else:
+                    self.paths.add(pattern)
+            elif GLOB_CHARS.search(pattern):
+                name_globs.append(pattern)
+            else:
+                self.names.add(pattern)
+        self._name_regex = self._combine(name_globs)
+        # a path glob can match the path starting at any of its components
+        self._path_regex = self._combine(path_globs, prefix="(?:.*/)?")
+
+        self._extension_trie = {}
+        for extension in extensions or []:
+            node = self._extension_trie
+            for part in reversed(extension.lstrip(".").split(".")):
+                node = node.setdefault(part, {})
+            node[ExclusionMatcher._END] = True
+
+    @staticmethod
+    def _combine(globs, prefix=""):
+        if not globs:
+            return None
+        return re.compile("|".join("(?:{}{})".format(prefix, fnmatch.translate(glob)) for glob in globs))
+
+    def has_excluded_extension(self, name):
+        """
+        :return: True if the name ends with one of the excluded extensions. Like `os.path.splitext`, leading
+                 dots are part of the stem, i.e. ".bashrc" has no extension.
+        """
+        parts = name.lstrip(".").split(".")
+        node = self._extension_trie
+        for part in reversed(parts[1:]):
+            node = node.get(part)
+            if node is None:
+                return False
+            if ExclusionMatcher._END in node:
+                return True
+        return False
+
+    def excludes_name(self, name):
+        """
+        :return: True if a path with this name is excluded by a pattern without a slash, or by its extension
+        """
+        return name in self.names or \
+            (self._name_regex is not None and self._name_regex.match(name) is not None) or \
+            (bool(self._extension_trie) and self.has_excluded_extension(name))
+
+    def _excludes_path(self, relpath):
+        # the plain paths are looked up for the path and for each of its ends that start at a component
+        if self.paths:
+            end = relpath
+            while True:
+                if end in self.paths:
+                    return True
+                if "/" not in end:
+                    break
+                end = end.split("/", 1)[1]
+        return self._path_regex is not None and self._path_regex.match(relpath) is not None
+
+    def excludes(self, relpath):
+        """
+        :param relpath: a path relative to the root, without a leading "./"
+        :return: True if the path is excluded by its name or by a pattern for its path
+        """
+        return self.excludes_name(relpath.rsplit("/", 1)[-1]) or self._excludes_path(relpath)
@@ -0,0 +1,168 @@
+"""
+A local inventory of what has been archived to PDC, so that a reupload can be planned without querying the
+(shared and often slow) TSM server for the description and filelist of the latest upload.
+"""
+
+import contextlib
+import logging
+import os
+import sqlite3
+import time
+
+log = logging.getLogger(__name__)
+
+
+class ArchiveInventory(object):
+
+    """
+    SQLite database with the uploads of each archive and the files (and their sizes) in each upload. An upload is
+    identified by its dsmc description. Uploads are recorded when they are started and the files are filled in
+    when the upload job has finished, or from the output of `dsmc q ar` when PDC has been queried. The MD5
+    checksums of the files are recorded too when they are known at upload time (PDC does not know them).
+    """
+
+    # An upload that has been started, but whose files are not known yet
+    STARTED = "started"
+    # An upload that has finished, and whose files are known
+    COMPLETED = "completed"
+    # An upload that failed, these are never used to plan reuploads
+    FAILED = "failed"
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS uploads (
+            description TEXT PRIMARY KEY,
+            archive_path TEXT NOT NULL,
+            state TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            updated_at REAL NOT NULL,
+            source TEXT)""",
+        """CREATE INDEX IF NOT EXISTS uploads_by_archive ON uploads (archive_path, started_at)""",
+        """CREATE TABLE IF NOT EXISTS files (
+            description TEXT NOT NULL REFERENCES uploads (description),
+            path TEXT NOT NULL,
+            size INTEGER NOT NULL,
+            md5 TEXT,
+            PRIMARY KEY (description, path))"""
+    ]
+
+    def __init__(self, db_file):
+        """
+        :param db_file: the SQLite database to use, it is created if it does not exist
+        """
+        self.db_file = db_file
+        with self._connect() as conn:
+            for statement in ArchiveInventory.SCHEMA:
+                conn.execute(statement)
+            # inventories created before checksums were recorded
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(files)")]
+            if "md5" not in columns:
+                conn.execute("ALTER TABLE files ADD COLUMN md5 TEXT")
+
+    @staticmethod
+    def from_config(config):
+        """
+        Set up the inventory according to the `inventory` section of the config
+
+        :param config: the app config
+        :return: an ArchiveInventory, or None if the inventory is not enabled
+        """
+        inventory_config = config.get("inventory") or {}
+        if not inventory_config.get("enabled", False):
+            return None
+        db_file = inventory_config.get("database") or os.path.join(config["log_directory"], "inventory.sqlite")
+        return ArchiveInventory(os.path.abspath(db_file))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # a connection per operation, so that the inventory can be used from any thread
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.text_factory = str
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _archive_key(path_to_archive):
+        return os.path.normpath(os.path.abspath(path_to_archive))
+
+    def record_upload(self, path_to_archive, description, state=STARTED, source="upload"):
+        """
+        Record an upload of an archive
+
+        :param path_to_archive: the archive that is uploaded
+        :param description: the dsmc description of the upload
+        :param state: the state of the upload, one of STARTED, COMPLETED or FAILED
+        :param source: what the information about the upload comes from, e.g. "upload" or "pdc"
+        """
+        now = time.time()
+        with self._connect() as conn:
+            updated = conn.execute(
+                "UPDATE uploads SET state = ?, updated_at = ?, source = ? WHERE description = ?",
+                (state, now, source, description)).rowcount
+            if not updated:
+                conn.execute(
+                    "INSERT INTO uploads (description, archive_path, state, started_at, updated_at, source) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (description, self._archive_key(path_to_archive), state, now, now, source))
+
+    def set_state(self, description, state):
+        """
+        Update the state of a recorded upload
+        """
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE uploads SET state = ?, updated_at = ? WHERE description = ?",
+                (state, time.time(), description))
+
+    def record_files(self, path_to_archive, description, files, replace=False, source="upload", checksums=None):
+        """
+        Record the files of an upload and mark it as completed
+
+        :param path_to_archive: the archive that was uploaded
+        :param description: the dsmc description of the upload
+        :param files: a dict mapping the full path of each uploaded file to its size in bytes
+        :param replace: if True, the files replace any files previously recorded for the upload, otherwise they
+                        are added to them (e.g. for a reupload of missing files)
+        :param source: what the information about the files comes from, e.g. "upload" or "pdc"
+        :param checksums: a dict mapping the full path of uploaded files to their MD5 checksums, if known
+        """
+        checksums = checksums or {}
+        self.record_upload(path_to_archive, description, ArchiveInventory.COMPLETED, source)
+        with self._connect() as conn:
+            if replace:
+                conn.execute("DELETE FROM files WHERE description = ?", (description,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO files (description, path, size, md5) VALUES (?, ?, ?, ?)",
+                ((description, path, size, checksums.get(path)) for path, size in files.iteritems()))
+        log.debug("Recorded {} files for upload {} of {}".format(len(files), description, path_to_archive))
+
+    def latest_description(self, path_to_archive):
+        """
+        :param path_to_archive: the archive to look up
+        :return: the description of the latest completed upload of the archive, or None if there is none
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT description FROM uploads WHERE archive_path = ? AND state = ? "
+                "ORDER BY started_at DESC LIMIT 1",
+                (self._archive_key(path_to_archive), ArchiveInventory.COMPLETED)).fetchone()
+        return row[0] if row else None
+
+    def uploaded_files(self, description):
+        """
+        :param description: the dsmc description of the upload
+        :return: a dict mapping the full path of each file in the upload to its size in bytes
+        """
+        with self._connect() as conn:
+            return dict(conn.execute("SELECT path, size FROM files WHERE description = ?", (description,)))
+
+    def uploaded_checksums(self, description):
+        """
+        :param description: the dsmc description of the upload
+        :return: a dict mapping the full path of each file in the upload whose MD5 checksum is known to the checksum
+        """
+        with self._connect() as conn:
+            return dict(conn.execute(
+                "SELECT path, md5 FROM files WHERE description = ? AND md5 IS NOT NULL", (description,)))
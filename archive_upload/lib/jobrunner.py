@@ -1,9 +1,20 @@
+import collections
+import itertools
+import json
 import logging
-import re
+import threading
+import time
 
 from localq.localQ_server import LocalQServer, Status
 from arteria.web.state import State as arteria_state
 
+from archive_upload.lib.dsmc import DsmcLogScanner, DsmcProgressParser
+from archive_upload.lib.events import JobEventLog
+from archive_upload.lib.jobstore import JobStore
+from archive_upload.lib.metrics import BYTES_PROCESSED, DSMC_WARNINGS, JOB_QUEUE_WAIT, JOB_RUN_TIME
+from archive_upload.lib.queueing import JobQueue
+from archive_upload.lib.resources import ResourcePool
+
 log = logging.getLogger(__name__)
 
 
@@ -13,7 +24,8 @@ class JobRunnerAdapter:
     Specifies interface that should be used by jobrunners.
     """
 
-    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None):
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, job_type=None, archive=None,
+              resources=None, priority=0, progress_file=None, dsmc_output=None, event_log=None):
         """
         Start a job corresponding to cmd
         :param cmd: to run
@@ -21,6 +33,19 @@ class JobRunnerAdapter:
         :param run_dir: where to run the job
         :param stdout: Reroute stdout to here
         :param stderr: Reroute stderr to here
+        :param job_type: the kind of job, e.g. "upload", used to filter `status_all`
+        :param archive: the name of the archive the job works on, used to filter `status_all`
+        :param resources: other resources the job needs besides cores, as a dict of resource name -> amount
+                          (see `ResourcePool`). The job is kept pending until they are available.
+        :param priority: jobs with a higher priority are started first, if the runner queues jobs by priority
+        :param progress_file: a file that the job writes its progress to as a JSON object, which is reported
+                              as `progress` in the status of the job
+        :param dsmc_output: the file that the output of a dsmc session run by the job is written to. The
+                            progress of the session (see `DsmcProgressParser`) is reported as `progress` in
+                            the status of the job, and of the phased job it belongs to
+        :param event_log: a file that the steps of the job write their start and end events to (see
+                          `JobEventLog`), which are summarised as `events` in the status of the job, and of
+                          the phased job it belongs to
         :return: the jobid associated with it (None on failure).
         """
         raise NotImplementedError("Subclasses should implement this!")
@@ -48,14 +73,118 @@ class JobRunnerAdapter:
         """
         raise NotImplementedError("Subclasses should implement this!")
 
-    def status_all(self):
+    def status_all(self, state=None, job_type=None, archive=None, offset=0, limit=None):
         """
-        Get status for all jobs
-        :param job_id: to get status for.
-        :return: A dict containing all jobs with job_id as key and status as value.
+        Get status for all jobs, or the jobs matching the given filters
+        :param state: only include jobs in this state
+        :param job_type: only include jobs of this type
+        :param archive: only include jobs working on this archive
+        :param offset: skip this many of the matching jobs (ordered by job_id)
+        :param limit: include at most this many jobs
+        :return: A dict containing the jobs with job_id as key and status as value.
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def status_details(self, job_id):
+        """
+        Additional information about a job, e.g. the phase a phased job is in
+        :param job_id: to get details for.
+        :return: A dict with details to include in the status of the job (empty if there are none).
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def start_phased(self, phase, job_type=None, archive=None, open_ended=False, **details):
+        """
+        Register a job that is driven by the service itself, e.g. planning work done in the
+        service that is followed by one or more jobs started through `start`.
+        :param phase: the name of the phase the job starts in
+        :param job_type: the kind of job, e.g. "reupload", used to filter `status_all`
+        :param archive: the name of the archive the job works on, used to filter `status_all`
+        :param open_ended: if True, jobs are added to the phased job one after the other, and it is not
+                           done until `finish_phased` has been called, even if all its jobs so far are done
+        :param details: extra information to report in the status of the job
+        :return: the jobid associated with it.
         """
         raise NotImplementedError("Subclasses should implement this!")
 
+    def set_phase(self, job_id, phase, child_job_id=None, **details):
+        """
+        Move a phased job into a new phase
+        :param job_id: of the phased job
+        :param phase: the name of the new phase
+        :param child_job_id: a job (from `start`) that the phased job is now waiting for, it
+                             is given the job type and archive of the phased job unless it has its own
+        :param details: extra information to report in the status of the job
+        :return: Nothing
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def fail_phased(self, job_id, message):
+        """
+        Mark a phased job as failed
+        :param job_id: of the phased job
+        :param message: describing what went wrong
+        :return: Nothing
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def finish_phased(self, job_id):
+        """
+        Mark an open ended phased job as having all its jobs, so that it is done once they are
+        :param job_id: of the phased job
+        :return: Nothing
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def slots(self):
+        """
+        The cores of the runner
+        :return: A dict with the number of cores in `total`, and the number `used` by running jobs.
+        """
+        raise NotImplementedError("Subclasses should implement this!")
+
+
+class PhasedJob(object):
+
+    """
+    A job that is driven by the service itself and goes through one or more named phases. While
+    the service is working on the job, e.g. planning what to upload, it is reported as started.
+    Once jobs have been started for it in the job runner, its state follows those jobs.
+    """
+
+    def __init__(self, job_id, phase, **details):
+        self.job_id = job_id
+        self.phase = phase
+        self.details = details
+        self.child_job_ids = []
+        self.message = None
+        self.failed = False
+        # False while the service may still add jobs to an open ended job
+        self.finished = True
+
+    def state(self, child_states):
+        """
+        :param child_states: the states of the jobs started for this job
+        :return: the arteria state of this job
+        """
+        if self.failed:
+            return arteria_state.ERROR
+        if not child_states:
+            return arteria_state.STARTED
+        for state in [arteria_state.ERROR, arteria_state.CANCELLED, arteria_state.NONE,
+                      arteria_state.STARTED, arteria_state.PENDING]:
+            if state in child_states:
+                return state
+        return arteria_state.DONE if self.finished else arteria_state.STARTED
+
+    def to_dict(self):
+        details = dict(self.details)
+        details["phase"] = self.phase
+        details["child_job_ids"] = list(self.child_job_ids)
+        if self.message:
+            details["message"] = self.message
+        return details
+
 
 class LocalQAdapter(JobRunnerAdapter):
 
@@ -87,72 +216,535 @@ class LocalQAdapter(JobRunnerAdapter):
         else:
             return arteria_state.NONE
 
-    def __init__(self, nbr_of_cores, whitelisted_warnings, interval=30, priority_method="fifo"):
+    # The message of jobs that could not be followed after a restart of the service
+    INTERRUPTED_MESSAGE = "interrupted by a restart of the service"
+
+    # Recorded in the details of open ended phased jobs in the job store, until they are finished
+    OPEN_ENDED = "open_ended"
+
+    # The keys of the progress of a job with the bytes it has processed -> the operation they are counted as
+    # in the metrics
+    BYTES_PROCESSED = {"bytes_hashed": "hashed", "bytes_compressed": "compressed", "bytes_transferred": "uploaded"}
+
+    def __init__(self, nbr_of_cores, whitelisted_warnings, interval=30, priority_method="fifo", job_store=None,
+                 resource_pool=None, aging_interval=600):
+        """
+        :param priority_method: how jobs are queued, one of the `JobQueue` methods. With "fifo", LocalQ
+                                queues the jobs (except the jobs waiting for other resources than cores).
+                                With "fair_share", jobs are queued by the adapter, and cores are handled
+                                like the other resources.
+        :param job_store: a `JobStore` to record the jobs in, so that they survive a restart of the service.
+                          The jobs recorded in it are restored when the adapter is created.
+        :param resource_pool: a `ResourcePool` with the limits on the resources (besides cores) that jobs
+                              declare. Jobs are only handed to LocalQ once their resources are available.
+        :param aging_interval: seconds a queued job has to wait to gain a point of priority (fair_share only)
+        """
         self.nbr_of_cores = nbr_of_cores
         self.whitelisted_warnings = whitelisted_warnings
-        self.server = LocalQServer(nbr_of_cores, interval, priority_method, use_shell=True)
+        self.job_store = job_store
+        self.resource_pool = resource_pool or ResourcePool()
+        self.interval = interval
+        fair_share = priority_method == JobQueue.FAIR_SHARE
+        if fair_share:
+            self.resource_pool.limits.setdefault(ResourcePool.CORES, nbr_of_cores)
+        self.server = LocalQServer(
+            nbr_of_cores, interval, JobQueue.FIFO if fair_share else priority_method, use_shell=True)
         self.server.run()
 
-    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None):
-        return self.server.add(cmd, nbr_of_cores, run_dir, stdout=stdout, stderr=stderr)
+        # The service hands out its own job ids, so that jobs that are not (yet) run by LocalQ,
+        # i.e. phased jobs, can be given ids as well. Jobs run by LocalQ are mapped to their
+        # LocalQ id.
+        self._job_ids = itertools.count(job_store.next_job_id() if job_store else 1)
+        self._lock = threading.Lock()
+        self._localq_ids = {}
+        self._phased_jobs = {}
+        self._dsmc_log_scanners = {}
+        # job_id -> the job type and archive given when the job was started
+        self._job_info = {}
+        # job_id -> the state of a LocalQ job that has terminated. The state of such a job
+        # can not change anymore, so it is only worked out (and its log scanned) once.
+        self._final_states = {}
+        # job_id -> a message about why the job ended, for jobs that were interrupted
+        self._messages = {}
+        # job_id -> the recorded job, for jobs that were still running when the service was
+        # restarted, and that are followed through their pid and exit code files
+        self._reattached = {}
+        # ids of the jobs whose start has been recorded in the job store
+        self._recorded_running = set()
+        # the arguments of `start` of the jobs waiting for resources
+        self._held_jobs = JobQueue(
+            priority_method if priority_method in JobQueue.METHODS else JobQueue.FIFO, aging_interval)
+        # job_id -> the resources of a job that has been handed to LocalQ, until it has terminated
+        self._job_resources = {}
+        self._scheduler_lock = threading.RLock()
+        # job_id -> the file a job writes its progress to
+        self._progress_files = {}
+        # job_id -> the parser of the output of the dsmc session run by a job
+        self._dsmc_progress = {}
+        # job_id -> when the job was started ("queued"), handed to LocalQ ("submitted") and first seen
+        # running ("running"), for the metrics of how long jobs wait and run
+        self._timings = {}
+        # job_id -> the cores of a job that has been handed to LocalQ, until it has terminated
+        self._job_cores = {}
+        # job_id -> the file the steps of a job write their events to
+        self._event_logs = {}
+
+        if job_store:
+            self._restore_jobs()
+
+        if self.resource_pool.limits:
+            scheduler = threading.Thread(target=self._run_scheduler, name="resource-scheduler")
+            scheduler.daemon = True
+            scheduler.start()
+
+    def _restore_jobs(self):
+        jobs = self.job_store.jobs()
+        for job in jobs:
+            job_id = job["job_id"]
+            self._set_job_info(job_id, job["job_type"], job["archive"])
+            if job["message"]:
+                self._messages[job_id] = job["message"]
+            if job["phase"] is None and job["details"].get("progress_file"):
+                self._progress_files[job_id] = job["details"]["progress_file"]
+            if job["phase"] is None and job["details"].get("dsmc_output"):
+                # when the job was started is not known, the elapsed time is known once dsmc has finished
+                self._dsmc_progress[job_id] = DsmcProgressParser(job["details"]["dsmc_output"])
+            if job["phase"] is None and job["details"].get("event_log"):
+                self._event_logs[job_id] = job["details"]["event_log"]
+
+            if job["phase"] is not None:
+                details = dict(job["details"])
+                open_ended = details.pop(LocalQAdapter.OPEN_ENDED, False)
+                phased_job = PhasedJob(job_id, job["phase"], **details)
+                phased_job.child_job_ids = [child["job_id"] for child in jobs if child["parent_job_id"] == job_id]
+                if job["state"] == arteria_state.ERROR:
+                    phased_job.failed = True
+                    phased_job.message = job["message"]
+                elif open_ended or not phased_job.child_job_ids:
+                    # the service was still working on the job, i.e. planning it or adding jobs to it
+                    phased_job.failed = True
+                    phased_job.message = LocalQAdapter.INTERRUPTED_MESSAGE
+                    self.job_store.update_job(
+                        job_id, state=arteria_state.ERROR, message=LocalQAdapter.INTERRUPTED_MESSAGE)
+                self._phased_jobs[job_id] = phased_job
+            elif job["state"] in [arteria_state.DONE, arteria_state.ERROR, arteria_state.CANCELLED]:
+                self._final_states[job_id] = job["state"]
+            else:
+                self._reattached[job_id] = job
+                state = self._reattached_status(job_id)
+                if state == arteria_state.STARTED:
+                    log.info("Reattached to job {} (pid {})".format(job_id, self._reattached[job_id]["pid"]))
+                else:
+                    log.info("Job {} ended while the service was down: {}".format(job_id, state))
+
+    def _next_job_id(self):
+        with self._lock:
+            return next(self._job_ids)
+
+    def _set_job_info(self, job_id, job_type, archive):
+        info = dict((k, v) for k, v in [("job_type", job_type), ("archive", archive)] if v is not None)
+        if info:
+            self._job_info[job_id] = info
+
+    def start(self, cmd, nbr_of_cores, run_dir, stdout=None, stderr=None, job_type=None, archive=None,
+              resources=None, priority=0, progress_file=None, dsmc_output=None, event_log=None):
+        job_id = self._next_job_id()
+        resources = dict(resources or {})
+        fair_share = self._held_jobs.method == JobQueue.FAIR_SHARE
+        if fair_share:
+            resources[ResourcePool.CORES] = min(nbr_of_cores, self.nbr_of_cores)
+        self._set_job_info(job_id, job_type, archive)
+        self._timings[job_id] = {"queued": time.time()}
+        if progress_file:
+            self._progress_files[job_id] = progress_file
+        if dsmc_output:
+            self._dsmc_progress[job_id] = DsmcProgressParser(dsmc_output)
+        if event_log:
+            self._event_logs[job_id] = event_log
+
+        with self._scheduler_lock:
+            self._admit_held_jobs()
+            if self.resource_pool.missing(resources) or (fair_share and len(self._held_jobs)):
+                self._held_jobs.add(
+                    job_id, (cmd, nbr_of_cores, run_dir, stdout, stderr, resources), priority, archive)
+                log.debug("Job {} waits for resources {}".format(job_id, self.resource_pool.missing(resources)))
+                self._admit_held_jobs()
+            elif not self._submit(job_id, cmd, nbr_of_cores, run_dir, stdout, stderr, resources):
+                self._job_info.pop(job_id, None)
+                self._progress_files.pop(job_id, None)
+                self._dsmc_progress.pop(job_id, None)
+                self._timings.pop(job_id, None)
+                self._event_logs.pop(job_id, None)
+                return None
+
+        if self.job_store:
+            details = dict((k, v) for k, v in [
+                ("progress_file", progress_file), ("dsmc_output", dsmc_output), ("event_log", event_log)] if v)
+            self.job_store.record_job(
+                job_id, arteria_state.PENDING, details=details or None,
+                cmd=cmd, run_dir=run_dir, stdout=stdout, stderr=stderr, job_type=job_type, archive=archive)
+        return job_id
+
+    def _submit(self, job_id, cmd, nbr_of_cores, run_dir, stdout, stderr, resources):
+        localq_cmd = self.job_store.wrap_cmd(job_id, cmd) if self.job_store else cmd
+        localq_id = self.server.add(localq_cmd, nbr_of_cores, run_dir, stdout=stdout, stderr=stderr)
+        if localq_id is None:
+            return False
+        self._localq_ids[job_id] = localq_id
+        self._job_cores[job_id] = nbr_of_cores
+        if job_id in self._timings:
+            self._timings[job_id]["submitted"] = time.time()
+        if job_id in self._dsmc_progress:
+            self._dsmc_progress[job_id].started_at = time.time()
+        if resources:
+            self.resource_pool.acquire(resources)
+            self._job_resources[job_id] = resources
+        return True
+
+    def _running_per_archive(self):
+        return collections.Counter(self._job_info.get(job_id, {}).get("archive") for job_id in self._job_resources)
+
+    def _admit_held_jobs(self):
+        # Held jobs are admitted in the order of the queue, but a job whose resources are not
+        # available does not block the jobs after it that need other resources.
+        for job_id in self._held_jobs.ordered(self._running_per_archive()):
+            resources = self._held_jobs.get(job_id)[-1]
+            if self.resource_pool.missing(resources):
+                continue
+            args = self._held_jobs.pop(job_id)
+            if self._submit(job_id, *args):
+                log.debug("Job {} admitted with resources {}".format(job_id, resources))
+            else:
+                self._set_final_state(job_id, arteria_state.ERROR, "could not be started")
+
+    def _run_scheduler(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.schedule()
+            except Exception:
+                log.exception("Could not schedule the jobs waiting for resources")
+
+    def schedule(self):
+        """
+        Release the resources of jobs that have terminated, and hand the jobs waiting for resources
+        to LocalQ if their resources are available. This is done periodically in the background.
+        """
+        with self._scheduler_lock:
+            localq_states = []
+            for job_id in list(self._job_resources.keys()):
+                self._status(job_id, localq_states)
+            self._admit_held_jobs()
+
+    @staticmethod
+    def _stored_details(phased_job):
+        if phased_job.finished:
+            return phased_job.details
+        return dict(phased_job.details, **{LocalQAdapter.OPEN_ENDED: True})
+
+    def start_phased(self, phase, job_type=None, archive=None, open_ended=False, **details):
+        job_id = self._next_job_id()
+        phased_job = self._phased_jobs[job_id] = PhasedJob(job_id, phase, **details)
+        phased_job.finished = not open_ended
+        self._set_job_info(job_id, job_type, archive)
+        if self.job_store:
+            self.job_store.record_job(
+                job_id, arteria_state.STARTED, details=self._stored_details(phased_job), phase=phase,
+                job_type=job_type, archive=archive)
+        log.debug("Phased job {} started in phase {}".format(job_id, phase))
+        return job_id
+
+    def set_phase(self, job_id, phase, child_job_id=None, **details):
+        job = self._phased_jobs[int(job_id)]
+        job.phase = phase
+        job.details.update(details)
+        if child_job_id is not None:
+            job.child_job_ids.append(child_job_id)
+            if child_job_id not in self._job_info and int(job_id) in self._job_info:
+                self._job_info[child_job_id] = dict(self._job_info[int(job_id)])
+        if self.job_store:
+            self.job_store.update_job(int(job_id), details=self._stored_details(job), phase=phase)
+            if child_job_id is not None:
+                info = self._job_info.get(child_job_id, {})
+                self.job_store.update_job(
+                    child_job_id, parent_job_id=int(job_id), job_type=info.get("job_type"),
+                    archive=info.get("archive"))
+        log.debug("Phased job {} moved to phase {}".format(job_id, phase))
+
+    def fail_phased(self, job_id, message):
+        job = self._phased_jobs[int(job_id)]
+        job.failed = True
+        job.message = message
+        if self.job_store:
+            self.job_store.update_job(int(job_id), state=arteria_state.ERROR, message=message)
+        log.info("Phased job {} failed in phase {}: {}".format(job_id, job.phase, message))
+
+    def finish_phased(self, job_id):
+        job = self._phased_jobs[int(job_id)]
+        job.finished = True
+        if self.job_store:
+            self.job_store.update_job(int(job_id), details=job.details)
+        log.debug("Phased job {} has all its jobs".format(job_id))
 
     def stop(self, job_id):
-        return self.server.stop_job_with_id(job_id)
+        with self._scheduler_lock:
+            if int(job_id) in self._held_jobs:
+                self._held_jobs.pop(int(job_id))
+                self._set_final_state(int(job_id), arteria_state.CANCELLED)
+                return job_id
+        localq_id = self._localq_ids.get(int(job_id))
+        if localq_id is None:
+            return None
+        return self.server.stop_job_with_id(localq_id)
 
     def stop_all(self):
         return self.server.stop_all_jobs()
 
-    def _parse_dsmc_return_code(self, job):
+    def _parse_dsmc_return_code(self, job_id, returncode, log_file):
         log.debug("DSMC process returned an error!")
 
         # DSMC sets return code to 8 when a warning was encountered.
-        if job.proc.returncode == 8:
+        if returncode == 8:
             log.debug("DSMC process actually returned a warning.")
 
             # Search through the DSMC log and see if we only have
             # whitelisted warnings. If that is the case, change the
             # return code to 0 instead. Otherwise keep the error state.
-            warnings = []
-
-            with open(job.stdout) as dsmc_log:
-                for line in dsmc_log:
-                    matches = re.findall(r'ANS[0-9]+W', line)
-
-                    for match in matches:
-                        warnings.append(match)
-
-                log.debug("Warnings found in DSMC output: {}".format(set(warnings)))
+            # The scanner is kept for the job, so that the log is only
+            # read once, however many times the status is polled.
+            scanner = self._dsmc_log_scanners.get(job_id)
+            if scanner is None:
+                scanner = DsmcLogScanner(log_file, self.whitelisted_warnings)
+                self._dsmc_log_scanners[job_id] = scanner
 
-                for warning in warnings:
-                    if warning not in self.whitelisted_warnings:
-                        log.debug(
-                            "A non-whitelisted DSMC warning was encountered. Keeping Arteria's error return state.")
-                        return arteria_state.ERROR
+            only_whitelisted = scanner.scan(complete=True)
+            log.debug("Warnings found in DSMC output: {}".format(scanner.warnings))
 
+            if not only_whitelisted:
                 log.debug(
-                    "Only whitelisted DSMC warnings were encountered. Changing Arteria's return state to DONE.")
-                return arteria_state.DONE
+                    "A non-whitelisted DSMC warning was encountered. Keeping Arteria's error return state.")
+                return arteria_state.ERROR
+
+            log.debug(
+                "Only whitelisted DSMC warnings were encountered. Changing Arteria's return state to DONE.")
+            return arteria_state.DONE
         else:
             log.info("An uncatched DSMC error code was encountered!")
             return arteria_state.ERROR
 
-    # Returns the stats of the long running DSMC or md5sum job.
-    def status(self, job_id):
-        job = self.server.get_job_with_id(int(job_id))
-        arteria_status = LocalQAdapter.localq2arteria_status(self.server.get_status(job_id))
-
+    def _error_state(self, job_id, cmd, returncode, log_file):
         # This is not perfect, as we can't be 100% sure that this will only
         # happen for dsmc jobs.
-        if arteria_status == arteria_state.ERROR and "dsmc" in job.cmd and \
-                                                     "md5sum" not in job.cmd:
-            return self._parse_dsmc_return_code(job)
-        else:
+        if "dsmc" in cmd and "md5sum" not in cmd:
+            return self._parse_dsmc_return_code(job_id, returncode, log_file)
+        return arteria_state.ERROR
+
+    def _record_metrics(self, job_id, state):
+        # observe how long a job that has terminated waited and ran, and count the bytes it processed and the
+        # dsmc warnings in its output. Jobs that were started before a restart of the service are only counted
+        # for their bytes and warnings.
+        job_type = self._job_info.get(job_id, {}).get("job_type", "unknown")
+        timings = self._timings.pop(job_id, None) or {}
+        running = timings.get("running", timings.get("submitted"))
+        if running is not None:
+            JOB_QUEUE_WAIT.observe(max(0, running - timings["queued"]), job_type=job_type)
+            JOB_RUN_TIME.observe(max(0, time.time() - running), job_type=job_type, state=state)
+
+        progress = self._progress(job_id) or {}
+        for key, operation in LocalQAdapter.BYTES_PROCESSED.iteritems():
+            if progress.get(key):
+                BYTES_PROCESSED.inc(progress[key], operation=operation)
+        if job_id in self._dsmc_progress:
+            for code, count in self._dsmc_progress[job_id].warnings.iteritems():
+                DSMC_WARNINGS.inc(count, code=code)
+
+    def _set_final_state(self, job_id, state, message=None):
+        # The state of a job is worked out both by the scheduler thread and on the IOLoop, so only the
+        # first of them to see that the job has terminated sets its final state (and records its metrics).
+        # The final state of the job is returned.
+        with self._scheduler_lock:
+            if job_id in self._final_states:
+                return self._final_states[job_id]
+            self._final_states[job_id] = state
+            self._dsmc_log_scanners.pop(job_id, None)
+            self._reattached.pop(job_id, None)
+            self._job_cores.pop(job_id, None)
+            try:
+                self._record_metrics(job_id, state)
+            except Exception:
+                log.exception("Could not record the metrics of job {}".format(job_id))
+            resources = self._job_resources.pop(job_id, None)
+            if resources:
+                self.resource_pool.release(resources)
+            if message:
+                self._messages[job_id] = message
+            if self.job_store:
+                self.job_store.update_job(job_id, state=state, message=message)
+            return state
+
+    def _reattached_status(self, job_id):
+        job = self._reattached[job_id]
+        returncode = self.job_store.exit_code(job_id)
+        if returncode is not None:
+            if returncode == 0:
+                state = arteria_state.DONE
+            else:
+                state = self._error_state(job_id, job["cmd"], returncode, job["stdout"])
+            return self._set_final_state(job_id, state)
+
+        pid = job["pid"] or self.job_store.pid(job_id)
+        if pid is not None and JobStore.is_running(pid):
+            if job["pid"] is None:
+                job["pid"] = pid
+                self.job_store.update_job(job_id, pid=pid, state=arteria_state.STARTED)
+            return arteria_state.STARTED
+
+        return self._set_final_state(job_id, arteria_state.ERROR, LocalQAdapter.INTERRUPTED_MESSAGE)
+
+    def _status(self, job_id, localq_states=None):
+        # `localq_states` is a list that the states of all LocalQ jobs are put in (once) when
+        # they are first needed, for looking up the states of many jobs at once.
+        # The scheduler thread works out the states of jobs as well, so they are worked out under its lock.
+        with self._scheduler_lock:
+            if job_id in self._final_states:
+                return self._final_states[job_id]
+
+            if job_id in self._reattached:
+                return self._reattached_status(job_id)
+
+            if job_id in self._held_jobs:
+                return arteria_state.PENDING
+
+            if job_id in self._phased_jobs:
+                phased_job = self._phased_jobs[job_id]
+                return phased_job.state(
+                    [self._status(child, localq_states) for child in phased_job.child_job_ids])
+
+            localq_id = self._localq_ids.get(job_id)
+            if localq_id is None:
+                return arteria_state.NONE
+
+            if localq_states is None:
+                localq_status = self.server.get_status(localq_id)
+            else:
+                if not localq_states:
+                    localq_states.append(self.server.get_status_all())
+                localq_status = localq_states[0].get(localq_id, Status.NOT_FOUND)
+            arteria_status = LocalQAdapter.localq2arteria_status(localq_status)
+
+            if arteria_status == arteria_state.ERROR:
+                job = self.server.get_job_with_id(localq_id)
+                arteria_status = self._error_state(job_id, job.cmd, job.proc.returncode, job.stdout)
+
+            if arteria_status == arteria_state.STARTED and job_id in self._timings:
+                self._timings[job_id].setdefault("running", time.time())
+
+            if arteria_status in [arteria_state.DONE, arteria_state.ERROR, arteria_state.CANCELLED]:
+                arteria_status = self._set_final_state(job_id, arteria_status)
+            elif arteria_status == arteria_state.STARTED and self.job_store and job_id not in self._recorded_running:
+                self._recorded_running.add(job_id)
+                self.job_store.update_job(job_id, state=arteria_status, pid=self.job_store.pid(job_id))
             return arteria_status
 
-    # TODO: At the moment `status_all()` will not re-write the return code
-    # from dsmc as with `status()`.
-    def status_all(self):
-        jobs_and_status = {}
-        for k, v in self.server.get_status_all().iteritems():
-            jobs_and_status[k] = LocalQAdapter.localq2arteria_status(v)
-        return jobs_and_status
+    # Returns the stats of the long running DSMC or md5sum job.
+    def status(self, job_id):
+        return self._status(int(job_id))
+
+    def status_all(self, state=None, job_type=None, archive=None, offset=0, limit=None):
+        with self._scheduler_lock:
+            job_ids = sorted(set(self._localq_ids.keys()) | set(self._phased_jobs.keys()) |
+                             set(self._final_states.keys()) | set(self._reattached.keys()) |
+                             set(self._held_jobs.ordered()))
+        if job_type is not None:
+            job_ids = [job_id for job_id in job_ids if self._job_info.get(job_id, {}).get("job_type") == job_type]
+        if archive is not None:
+            job_ids = [job_id for job_id in job_ids if self._job_info.get(job_id, {}).get("archive") == archive]
+
+        localq_states = []
+        jobs_and_status = [(job_id, self._status(job_id, localq_states)) for job_id in job_ids]
+        if state is not None:
+            jobs_and_status = [(job_id, job_state) for job_id, job_state in jobs_and_status if job_state == state]
+
+        end = offset + limit if limit is not None else None
+        return dict(jobs_and_status[offset:end])
+
+    def slots(self):
+        localq_states = self.server.get_status_all()
+        used = sum(cores for job_id, cores in self._job_cores.items()
+                   if localq_states.get(self._localq_ids.get(job_id)) == Status.RUNNING)
+        return {"total": self.nbr_of_cores, "used": used}
+
+    def queue_position(self, job_id):
+        """
+        :param job_id: of a pending job
+        :return: the position of the job in the queue, starting at 1 for the job that is started next
+                 (None if the job is not pending). Jobs already queued in LocalQ are ahead of the jobs
+                 queued by the adapter.
+        """
+        localq_id = self._localq_ids.get(job_id)
+        if localq_id is not None and self.server.get_status(localq_id) != Status.PENDING:
+            return None
+
+        localq_pending = sorted(
+            localq_id for localq_id, status in self.server.get_status_all().iteritems() if status == Status.PENDING)
+        with self._scheduler_lock:
+            if job_id in self._held_jobs:
+                return len(localq_pending) + self._held_jobs.ordered(self._running_per_archive()).index(job_id) + 1
+        if localq_id in localq_pending:
+            return localq_pending.index(localq_id) + 1
+        return None
+
+    def status_details(self, job_id):
+        details = dict(self._job_info.get(int(job_id), {}))
+        if int(job_id) in self._messages:
+            details["message"] = self._messages[int(job_id)]
+        with self._scheduler_lock:
+            held_job = self._held_jobs.get(int(job_id))
+            if held_job is not None:
+                details["waiting_for"] = self.resource_pool.missing(held_job[-1])
+        if held_job is not None or (int(job_id) in self._localq_ids and int(job_id) not in self._final_states):
+            queue_position = self.queue_position(int(job_id))
+            if queue_position is not None:
+                details["queue_position"] = queue_position
+        progress = self._progress(int(job_id))
+        if progress is not None:
+            details["progress"] = progress
+        phased_job = self._phased_jobs.get(int(job_id))
+        if phased_job is not None:
+            details.update(phased_job.to_dict())
+            # the dsmc sessions of e.g. an upload in shards, as one
+            dsmc_progress = [self._progress(child) for child in phased_job.child_job_ids
+                             if child in self._dsmc_progress]
+            dsmc_progress = [progress for progress in dsmc_progress if progress is not None]
+            if dsmc_progress and "progress" not in details:
+                details["progress"] = DsmcProgressParser.combine(dsmc_progress)
+        events = self._events(int(job_id))
+        if events is not None:
+            details["events"] = events
+        return details
+
+    def _events(self, job_id):
+        # the summary of the events of a job, or of the jobs of a phased job, e.g. the steps of a pipeline
+        phased_job = self._phased_jobs.get(job_id)
+        job_ids = phased_job.child_job_ids if phased_job is not None else [job_id]
+        events = []
+        for event_job_id in job_ids:
+            if event_job_id in self._event_logs:
+                events.extend(JobEventLog.read(self._event_logs[event_job_id]))
+        return JobEventLog.summarize(events) if events else None
+
+    def _progress(self, job_id):
+        dsmc_progress = self._dsmc_progress.get(job_id)
+        if dsmc_progress is not None:
+            # the output is also scanned by the scheduler thread, when the metrics of the job are recorded
+            with self._scheduler_lock:
+                return dsmc_progress.scan(complete=job_id in self._final_states)
+        progress_file = self._progress_files.get(job_id)
+        if not progress_file:
+            return None
+        try:
+            with open(progress_file) as fh:
+                return json.load(fh)
+        except (IOError, ValueError):
+            # not written yet
+            return None
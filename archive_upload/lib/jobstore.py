@@ -0,0 +1,223 @@
+"""
+A persistent journal of the jobs of the service, so that the jobs (and their ids) survive a restart of the service:
+jobs that were running are followed until they finish, and jobs that can not be followed are reported as interrupted.
+"""
+
+import contextlib
+import errno
+import json
+import logging
+import os
+import pipes
+import sqlite3
+import time
+
+log = logging.getLogger(__name__)
+
+
+class JobStore(object):
+
+    """
+    SQLite database (in write-ahead logging mode) with a row for each job, holding the command, archive, phase,
+    pid, log files and state of the job. The commands of the jobs are wrapped so that the shell running a job
+    writes its pid, and the exit code of the job, to files in the directory of the store. These can be read
+    after a restart of the service, when the job is no longer known to LocalQ.
+    """
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS jobs (
+            job_id INTEGER PRIMARY KEY,
+            job_type TEXT,
+            archive TEXT,
+            cmd TEXT,
+            run_dir TEXT,
+            stdout TEXT,
+            stderr TEXT,
+            pid INTEGER,
+            phase TEXT,
+            details TEXT,
+            parent_job_id INTEGER,
+            state TEXT NOT NULL,
+            message TEXT,
+            started_at REAL NOT NULL,
+            updated_at REAL NOT NULL)""",
+        """CREATE INDEX IF NOT EXISTS jobs_by_archive ON jobs (archive, job_id)"""
+    ]
+
+    COLUMNS = ["job_type", "archive", "cmd", "run_dir", "stdout", "stderr", "pid", "phase", "details",
+               "parent_job_id", "state", "message"]
+
+    def __init__(self, db_file, directory):
+        """
+        :param db_file: the SQLite database to use, it is created if it does not exist
+        :param directory: where the pid and exit code files of the jobs are written
+        """
+        self.db_file = db_file
+        self.directory = directory
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            for statement in JobStore.SCHEMA:
+                conn.execute(statement)
+
+    @staticmethod
+    def from_config(config):
+        """
+        Set up the job store according to the `job_store` section of the config
+
+        :param config: the app config
+        :return: a JobStore, or None if the job store is not enabled
+        """
+        store_config = config.get("job_store") or {}
+        if not store_config.get("enabled", False):
+            return None
+        db_file = store_config.get("database") or os.path.join(config["log_directory"], "jobs.sqlite")
+        directory = store_config.get("directory") or os.path.join(config["log_directory"], "jobs")
+        return JobStore(os.path.abspath(db_file), os.path.abspath(directory))
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # a connection per operation, so that the store can be used from any thread
+        conn = sqlite3.connect(self.db_file, timeout=30)
+        conn.text_factory = str
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA synchronous=NORMAL")
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def next_job_id(self):
+        """
+        :return: the first job id that has not been used by a recorded job
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT MAX(job_id) FROM jobs").fetchone()
+        return (row[0] or 0) + 1
+
+    def record_job(self, job_id, state, details=None, **fields):
+        """
+        Record a new job
+
+        :param job_id: the id of the job
+        :param state: the arteria state of the job
+        :param details: extra information about a phased job, stored as JSON
+        :param fields: values of other columns, e.g. `cmd`, `archive` or `phase`
+        """
+        now = time.time()
+        fields = self._checked_fields(fields)
+        fields.update({"job_id": job_id, "state": state, "started_at": now, "updated_at": now})
+        if details is not None:
+            fields["details"] = json.dumps(details)
+        columns = sorted(fields.keys())
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs ({}) VALUES ({})".format(
+                    ", ".join(columns), ", ".join("?" for _ in columns)),
+                [fields[column] for column in columns])
+
+    def update_job(self, job_id, details=None, **fields):
+        """
+        Update the columns of a recorded job
+
+        :param job_id: the id of the job
+        :param details: extra information about a phased job, stored as JSON
+        :param fields: the columns to update, e.g. `state` or `pid`
+        """
+        fields = self._checked_fields(fields)
+        if details is not None:
+            fields["details"] = json.dumps(details)
+        fields["updated_at"] = time.time()
+        columns = sorted(fields.keys())
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET {} WHERE job_id = ?".format(", ".join("{} = ?".format(c) for c in columns)),
+                [fields[column] for column in columns] + [job_id])
+
+    @staticmethod
+    def _checked_fields(fields):
+        unknown = set(fields.keys()) - set(JobStore.COLUMNS)
+        if unknown:
+            raise ValueError("Unknown job columns: {}".format(", ".join(sorted(unknown))))
+        return dict(fields)
+
+    @staticmethod
+    def _to_dict(row):
+        job = dict(row)
+        job["details"] = json.loads(job["details"]) if job["details"] else {}
+        return job
+
+    def job(self, job_id):
+        """
+        :param job_id: the id of the job
+        :return: the recorded job as a dict, or None if there is no such job
+        """
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._to_dict(row) if row else None
+
+    def jobs(self, archive=None):
+        """
+        :param archive: only return the jobs working on this archive
+        :return: the recorded jobs as dicts, ordered by job id
+        """
+        with self._connect() as conn:
+            if archive is None:
+                rows = conn.execute("SELECT * FROM jobs ORDER BY job_id").fetchall()
+            else:
+                rows = conn.execute(
+                    "SELECT * FROM jobs WHERE archive = ? ORDER BY job_id", (archive,)).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def _pid_file(self, job_id):
+        return os.path.join(self.directory, "{}.pid".format(job_id))
+
+    def _exit_code_file(self, job_id):
+        return os.path.join(self.directory, "{}.exit".format(job_id))
+
+    def wrap_cmd(self, job_id, cmd):
+        """
+        :param job_id: the id of the job
+        :param cmd: the shell command of the job
+        :return: a shell command running `cmd` that also writes the pid of the shell and the exit code of `cmd`
+                 to the directory of the store. The exit code of the command is kept.
+        """
+        exit_code_file = self._exit_code_file(job_id)
+        return "echo $$ > {pid_file}; ( {cmd} ); rc=$?; echo $rc > {tmp_file} && mv {tmp_file} {exit_file}; " \
+               "exit $rc".format(pid_file=pipes.quote(self._pid_file(job_id)),
+                                 cmd=cmd,
+                                 tmp_file=pipes.quote(exit_code_file + ".tmp"),
+                                 exit_file=pipes.quote(exit_code_file))
+
+    @staticmethod
+    def _read_int(path):
+        try:
+            with open(path) as fh:
+                return int(fh.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def pid(self, job_id):
+        """
+        :return: the pid of the shell running the job, or None if it has not been started
+        """
+        return self._read_int(self._pid_file(job_id))
+
+    def exit_code(self, job_id):
+        """
+        :return: the exit code of the job, or None if it has not finished
+        """
+        return self._read_int(self._exit_code_file(job_id))
+
+    @staticmethod
+    def is_running(pid):
+        """
+        :return: True if there is a process with the pid
+        """
+        try:
+            os.kill(pid, 0)
+        except OSError as e:
+            return e.errno == errno.EPERM
+        return True
@@ -0,0 +1,306 @@
+"""
+A persistent manifest of the files in an archive, so that the archive tree does not have to be listed and
+stat'ed from scratch by every step that needs to know what is in it.
+
+The manifest is refreshed incrementally: a directory whose mtime has not changed since the last refresh still
+has the same entries, so it is not listed again and the cached entries are reused. Only the directories are
+stat'ed on a refresh of an unchanged tree. Files that are modified in place do not change the mtime of their
+directory, so steps that need exact file metadata (e.g. to reuse cached checksums) should refresh with
+`verify_files=True`, which re-stats the files without listing the unchanged directories.
+
+Can also be run as a job to refresh the manifest of an archive, e.g.:
+
+    python -m archive_upload.lib.manifest /path/to/archive --manifest-file /path/to/manifest.json
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import stat
+import sys
+import time
+
+log = logging.getLogger(__name__)
+
+# Bumped whenever the format of the manifest changes, manifests of other versions are discarded
+MANIFEST_VERSION = 1
+
+# A directory modified this close to (or after) the start of the last refresh could have been modified again
+# within the resolution of its mtime, so it is always listed again
+RACY_MTIME_WINDOW = 1.0
+
+
+def _to_str(obj):
+    # the json module decodes all strings to unicode, but the paths on disk are byte strings
+    if isinstance(obj, unicode):
+        return obj.encode("utf-8")
+    if isinstance(obj, list):
+        return [_to_str(o) for o in obj]
+    if isinstance(obj, dict):
+        return {_to_str(k): _to_str(v) for k, v in obj.iteritems()}
+    return obj
+
+
+class ArchiveManifest(object):
+
+    """
+    The files and directories in an archive, with the size, mtime and inode of each file and, when it has been
+    calculated, its MD5 checksum. Symlinks are followed like `find -L` does, but it is recorded which
+    directories were reached through a symlink, so that views without followed symlinks can be produced as well.
+    """
+
+    def __init__(self, path_to_archive, manifest_file=None):
+        """
+        :param path_to_archive: the archive the manifest describes
+        :param manifest_file: the file the manifest is persisted in, or None to keep it in memory only
+        """
+        self.path_to_archive = os.path.normpath(os.path.abspath(path_to_archive))
+        self.manifest_file = manifest_file
+        # relative directory path ("" for the archive root) -> {"mtime", "linked", "files", "subdirs", "links"}
+        self.dirs = {}
+        # relative file path -> {"size", "mtime", "inode", "regular"[, "md5"]}
+        self.files = {}
+        self.refreshed_at = None
+
+    @staticmethod
+    def manifest_file_for(path_to_archive, manifest_dir):
+        """
+        :return: the path of the manifest file for the archive in the supplied directory. The name is based on the
+                 name of the archive and a hash of its full path, so that archives with the same name in different
+                 roots do not share a manifest
+        """
+        path_to_archive = os.path.normpath(os.path.abspath(path_to_archive))
+        return os.path.join(
+            manifest_dir,
+            "{}.{}.manifest.json".format(
+                os.path.basename(path_to_archive),
+                hashlib.sha1(path_to_archive).hexdigest()[:8]))
+
+    @staticmethod
+    def manifest_file_from_config(config, path_to_archive):
+        """
+        Look up where the manifest of an archive should be kept, according to the `manifest` section of the config
+
+        :param config: the app config
+        :param path_to_archive: the archive the manifest describes
+        :return: the path to the manifest file, or None if manifests are not enabled
+        """
+        manifest_config = config.get("manifest") or {}
+        if not manifest_config.get("enabled", False):
+            return None
+        manifest_dir = manifest_config.get("directory") or os.path.join(config["log_directory"], "manifests")
+        return ArchiveManifest.manifest_file_for(path_to_archive, os.path.abspath(manifest_dir))
+
+    @staticmethod
+    def load(path_to_archive, manifest_file):
+        """
+        Load the persisted manifest of an archive. A missing, unreadable or outdated manifest file results in an
+        empty manifest, which will be populated by the next refresh.
+
+        :param path_to_archive: the archive the manifest describes
+        :param manifest_file: the file the manifest is persisted in
+        :return: an ArchiveManifest
+        """
+        manifest = ArchiveManifest(path_to_archive, manifest_file)
+        try:
+            with open(manifest_file) as fh:
+                content = _to_str(json.load(fh))
+        except IOError:
+            log.debug("No manifest found at {}".format(manifest_file))
+            return manifest
+        except ValueError as e:
+            log.warning("Ignoring corrupt manifest {}: {}".format(manifest_file, e))
+            return manifest
+
+        if content.get("version") != MANIFEST_VERSION or content.get("root") != manifest.path_to_archive:
+            log.info("Ignoring manifest {}, it is outdated or describes another archive".format(manifest_file))
+            return manifest
+
+        manifest.dirs = content["dirs"]
+        manifest.files = content["files"]
+        manifest.refreshed_at = content["refreshed_at"]
+        return manifest
+
+    def save(self):
+        """
+        Persist the manifest to its manifest file. The file is replaced atomically, so that a concurrent reader
+        never sees a partially written manifest.
+        """
+        manifest_dir = os.path.dirname(self.manifest_file)
+        if manifest_dir and not os.path.isdir(manifest_dir):
+            os.makedirs(manifest_dir)
+        content = {
+            "version": MANIFEST_VERSION,
+            "root": self.path_to_archive,
+            "refreshed_at": self.refreshed_at,
+            "dirs": self.dirs,
+            "files": self.files}
+        tmp_file = "{}.{}.tmp".format(self.manifest_file, os.getpid())
+        try:
+            with open(tmp_file, "w") as fh:
+                json.dump(content, fh)
+        except UnicodeDecodeError as e:
+            # file names that are not valid UTF-8 can not be represented in JSON, keep the manifest in memory only
+            log.warning("Could not persist manifest of {}: {}".format(self.path_to_archive, e))
+            os.unlink(tmp_file)
+            return
+        os.rename(tmp_file, self.manifest_file)
+
+    def _full_path(self, relpath):
+        return os.path.join(self.path_to_archive, relpath) if relpath else self.path_to_archive
+
+    def _file_entry(self, relpath, st, regular, verified_entries):
+        entry = {"size": st.st_size, "mtime": st.st_mtime, "inode": st.st_ino, "regular": regular}
+        old_entry = self.files.get(relpath)
+        # keep the checksum as long as the file looks unchanged
+        if old_entry is not None and "md5" in old_entry and all(
+                old_entry[k] == entry[k] for k in ("size", "mtime", "inode")):
+            entry["md5"] = old_entry["md5"]
+        verified_entries[relpath] = entry
+
+    @staticmethod
+    def _stat(full_path):
+        # follow symlinks, but keep broken symlinks as they are. Returns the lstat and stat results
+        lst = os.lstat(full_path)
+        if not stat.S_ISLNK(lst.st_mode):
+            return lst, lst
+        try:
+            return lst, os.stat(full_path)
+        except OSError:
+            return lst, lst
+
+    def _list_dir(self, relpath, linked, st, files):
+        entry = {"mtime": st.st_mtime, "linked": linked, "files": [], "subdirs": [], "links": []}
+        full_path = self._full_path(relpath)
+        for name in sorted(os.listdir(full_path)):
+            lst, child_st = self._stat(os.path.join(full_path, name))
+            if stat.S_ISDIR(child_st.st_mode):
+                entry["links" if stat.S_ISLNK(lst.st_mode) else "subdirs"].append(name)
+            else:
+                entry["files"].append(name)
+                self._file_entry(os.path.join(relpath, name), child_st, stat.S_ISREG(child_st.st_mode), files)
+        return entry
+
+    def refresh(self, verify_files=False):
+        """
+        Bring the manifest up to date with the archive on disk. Directories that have not been modified since the
+        last refresh are not listed again.
+
+        :param verify_files: if True, stat the files in unmodified directories as well, to pick up files that
+                             have been modified in place
+        :return: the number of directories that had to be listed
+        """
+        refresh_started = time.time()
+        dirs = {}
+        files = {}
+        listed = 0
+
+        # the directories to visit, with whether they were reached through a symlink and the (device, inode) of
+        # their ancestors, to guard against symlinks that loop back to an ancestor
+        stack = [("", False, ())]
+        while stack:
+            relpath, linked, ancestors = stack.pop()
+            st = os.stat(self._full_path(relpath))
+            cached = self.dirs.get(relpath)
+            unchanged = cached is not None and \
+                cached["mtime"] == st.st_mtime and \
+                cached["linked"] == linked and \
+                self.refreshed_at is not None and \
+                st.st_mtime < self.refreshed_at - RACY_MTIME_WINDOW and \
+                all(os.path.join(relpath, f) in self.files for f in cached["files"])
+
+            if unchanged:
+                entry = cached
+                for name in entry["files"]:
+                    file_relpath = os.path.join(relpath, name)
+                    if verify_files:
+                        _, file_st = self._stat(self._full_path(file_relpath))
+                        self._file_entry(file_relpath, file_st, stat.S_ISREG(file_st.st_mode), files)
+                    else:
+                        files[file_relpath] = self.files[file_relpath]
+            else:
+                entry = self._list_dir(relpath, linked, st, files)
+                listed += 1
+            dirs[relpath] = entry
+
+            ancestors = ancestors + ((st.st_dev, st.st_ino),)
+            for name in entry["subdirs"]:
+                stack.append((os.path.join(relpath, name), linked, ancestors))
+            for name in entry["links"]:
+                link_relpath = os.path.join(relpath, name)
+                link_st = os.stat(self._full_path(link_relpath))
+                if (link_st.st_dev, link_st.st_ino) in ancestors:
+                    log.warning("Not descending into {}, it links back to one of its parents".format(
+                        self._full_path(link_relpath)))
+                    continue
+                stack.append((link_relpath, True, ancestors))
+
+        self.dirs = dirs
+        self.files = files
+        self.refreshed_at = refresh_started
+        log.debug("Refreshed manifest of {}, listed {} of {} directories".format(
+            self.path_to_archive, listed, len(dirs)))
+        return listed
+
+    def _dirs(self, followlinks):
+        for relpath, entry in self.dirs.iteritems():
+            if followlinks or not entry["linked"]:
+                yield relpath, entry
+
+    def local_files(self, followlinks=False):
+        """
+        :param followlinks: if True, include the files beneath symlinks to directories
+        :return: a dict mapping the full path of each file (not directory) in the archive to its size in bytes
+        """
+        local_files = {}
+        for relpath, entry in self._dirs(followlinks):
+            for name in entry["files"]:
+                file_relpath = os.path.join(relpath, name)
+                local_files[self._full_path(file_relpath)] = self.files[file_relpath]["size"]
+        return local_files
+
+    def all_paths(self):
+        """
+        Same as `FileUtils.list_all_paths` without following symlinks: the full paths of all files and directories
+        beneath the archive, including symlinks to directories, sorted in reverse lexical order.
+        """
+        all_paths = []
+        for relpath, entry in self._dirs(followlinks=False):
+            all_paths.extend(
+                self._full_path(os.path.join(relpath, name))
+                for name in entry["files"] + entry["subdirs"] + entry["links"])
+        return sorted(all_paths, reverse=True)
+
+    def regular_files(self):
+        """
+        :return: a list of (relative path, manifest entry) for all regular files in the archive, following
+                 symlinks like `find -L . -type f` does
+        """
+        return [(relpath, entry) for relpath, entry in self.files.iteritems() if entry["regular"]]
+
+    def set_md5(self, relpath, hexdigest):
+        """
+        Record the MD5 checksum of a file, so that it can be reused as long as the file is unchanged
+        """
+        self.files[relpath]["md5"] = hexdigest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Refresh the manifest of the files in an archive")
+    parser.add_argument("path_to_archive")
+    parser.add_argument("--manifest-file", required=True)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+
+    manifest = ArchiveManifest.load(args.path_to_archive, args.manifest_file)
+    listed = manifest.refresh()
+    manifest.save()
+    log.info("Refreshed manifest {} of {}, listed {} of {} directories".format(
+        args.manifest_file, manifest.path_to_archive, listed, len(manifest.dirs)))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
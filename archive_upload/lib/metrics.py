@@ -0,0 +1,204 @@
+"""
+Metrics of the service, exposed in the Prometheus text format (version 0.0.4) by the metrics endpoint. The metrics
+are kept in memory by the service process, so they start from zero when the service is restarted.
+"""
+
+import bisect
+import threading
+
+# Upper bounds (in seconds) of the buckets of the histograms of durations. Requests take milliseconds, while jobs
+# wait and run for minutes to days.
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+JOB_BUCKETS = (1, 10, 60, 300, 900, 1800, 3600, 7200, 14400, 28800, 86400, 172800)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{{{}}}".format(",".join("{}=\"{}\"".format(name, _escape(value)) for name, value in labels))
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric(object):
+
+    """
+    A metric with a name and optional labels. The value of each combination of labels is kept separately, keyed on
+    the sorted (name, value) pairs of the labels.
+    """
+
+    TYPE = None
+
+    def __init__(self, name, description, lock):
+        self.name = name
+        self.description = description
+        self._lock = lock
+        self._values = {}
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    def _samples(self):
+        # a list of (name suffix, labels, value) to render
+        raise NotImplementedError("Subclasses should implement this!")
+
+    def render(self):
+        """
+        :return: the lines of the metric in the Prometheus text format
+        """
+        lines = ["# HELP {} {}".format(self.name, self.description.replace("\\", "\\\\").replace("\n", "\\n")),
+                 "# TYPE {} {}".format(self.name, self.TYPE)]
+        with self._lock:
+            samples = self._samples()
+        for suffix, labels, value in samples:
+            lines.append("{}{}{} {}".format(self.name, suffix, _format_labels(labels), _format_value(value)))
+        return lines
+
+
+class Counter(Metric):
+
+    """
+    A value that only goes up, e.g. the number of bytes uploaded
+    """
+
+    TYPE = "counter"
+
+    def inc(self, amount=1, **labels):
+        if amount < 0:
+            raise ValueError("A counter can not be decreased")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def _samples(self):
+        return [("", key, value) for key, value in sorted(self._values.items())]
+
+
+class Gauge(Metric):
+
+    """
+    A value that goes up and down, e.g. the number of LocalQ slots in use
+    """
+
+    TYPE = "gauge"
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels))
+
+    def _samples(self):
+        return [("", key, value) for key, value in sorted(self._values.items())]
+
+
+class Histogram(Metric):
+
+    """
+    Counts observations, e.g. durations, in buckets with the given upper bounds, together with their sum
+    """
+
+    TYPE = "histogram"
+
+    def __init__(self, name, description, lock, buckets):
+        super(Histogram, self).__init__(name, description, lock)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * len(self.buckets), 0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    def count(self, **labels):
+        with self._lock:
+            counts, _ = self._values.get(self._key(labels)) or ([0], 0)
+            return sum(counts)
+
+    def _samples(self):
+        samples = []
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", key + (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", key, total))
+            samples.append(("_count", key, cumulative))
+        return samples
+
+
+class MetricsRegistry(object):
+
+    """
+    Holds the metrics of the service, in the order they were created
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, description):
+        return self._add(Counter(name, description, self._lock))
+
+    def gauge(self, name, description):
+        return self._add(Gauge(name, description, self._lock))
+
+    def histogram(self, name, description, buckets):
+        return self._add(Histogram(name, description, self._lock, buckets))
+
+    def render(self):
+        """
+        :return: all metrics in the Prometheus text format
+        """
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+# The metrics of the service
+REGISTRY = MetricsRegistry()
+
+REQUEST_DURATION = REGISTRY.histogram(
+    "archive_upload_request_duration_seconds",
+    "Time taken to handle requests, by handler, method and status code",
+    REQUEST_BUCKETS)
+JOB_QUEUE_WAIT = REGISTRY.histogram(
+    "archive_upload_job_queue_wait_seconds",
+    "Time from submitting a job until it was seen running, by job type",
+    JOB_BUCKETS)
+JOB_RUN_TIME = REGISTRY.histogram(
+    "archive_upload_job_run_seconds",
+    "Time from a job was seen running until it ended, by job type and final state",
+    JOB_BUCKETS)
+BYTES_PROCESSED = REGISTRY.counter(
+    "archive_upload_bytes_total",
+    "Bytes hashed, compressed and uploaded by jobs, by operation")
+DSMC_WARNINGS = REGISTRY.counter(
+    "archive_upload_dsmc_warnings_total",
+    "Warnings in the output of dsmc sessions, by code")
+LOCALQ_SLOTS = REGISTRY.gauge(
+    "archive_upload_localq_slots",
+    "LocalQ cores, in total and used by running jobs")
@@ -0,0 +1,156 @@
+"""
+Notifications about job state transitions, so that clients do not have to poll the status endpoint: clients can
+wait for the state of a job to change (long-poll), and callback URLs registered for a job are POSTed to whenever
+its state changes.
+"""
+
+import datetime
+import json
+import logging
+
+from arteria.web.state import State
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+from tornado.ioloop import IOLoop
+
+log = logging.getLogger(__name__)
+
+# States after which a job will not change state again
+FINAL_STATES = [State.DONE, State.ERROR, State.CANCELLED, State.NONE]
+
+
+class JobWatcher(object):
+
+    """
+    Watches the state of jobs in a runner service on behalf of waiting clients and registered callbacks. The
+    states of the watched jobs are checked at a fixed interval, on the IOLoop, as long as there are jobs to watch.
+    """
+
+    # one watcher per runner service, see `for_runner_service`
+    _watchers = {}
+
+    def __init__(self, runner_service, poll_interval=1.0):
+        """
+        :param runner_service: the runner service running the jobs
+        :param poll_interval: seconds between checks of the states of the watched jobs
+        """
+        self.runner_service = runner_service
+        self.poll_interval = poll_interval
+        # job_id -> the last state seen for the job
+        self._states = {}
+        # job_id -> list of Futures waiting for the state of the job to change
+        self._waiters = {}
+        # job_id -> list of callback URLs
+        self._callbacks = {}
+        self._io_loop = None
+
+    @staticmethod
+    def for_runner_service(runner_service, poll_interval=1.0):
+        """
+        :return: the JobWatcher of the runner service, created if needed
+        """
+        watcher = JobWatcher._watchers.get(runner_service)
+        if watcher is None:
+            watcher = JobWatcher._watchers[runner_service] = JobWatcher(runner_service, poll_interval)
+        return watcher
+
+    def _watch(self, job_id, state):
+        self._states.setdefault(job_id, state)
+        io_loop = IOLoop.current()
+        if self._io_loop is not io_loop:
+            self._io_loop = io_loop
+            io_loop.spawn_callback(self._poll, io_loop)
+
+    def _unwatch_if_idle(self, job_id):
+        if not self._waiters.get(job_id) and not self._callbacks.get(job_id):
+            self._states.pop(job_id, None)
+            self._waiters.pop(job_id, None)
+            self._callbacks.pop(job_id, None)
+
+    @gen.coroutine
+    def wait_for_change(self, job_id, state, timeout):
+        """
+        Wait for the state of a job to change
+
+        :param job_id: the job to wait for
+        :param state: the state the job is known to be in
+        :param timeout: the maximum number of seconds to wait
+        :return: a Future resolving to the new state of the job, or to `state` if it did not change in time
+        """
+        job_id = str(job_id)
+        if state in FINAL_STATES:
+            raise gen.Return(state)
+
+        waiter = Future()
+        self._waiters.setdefault(job_id, []).append(waiter)
+        self._watch(job_id, state)
+        try:
+            new_state = yield gen.with_timeout(datetime.timedelta(seconds=timeout), waiter)
+        except gen.TimeoutError:
+            new_state = state
+        finally:
+            if waiter in self._waiters.get(job_id, []):
+                self._waiters[job_id].remove(waiter)
+            self._unwatch_if_idle(job_id)
+        raise gen.Return(new_state)
+
+    def add_callback(self, job_id, callback_url):
+        """
+        Register a URL to POST to (with the status of the job as JSON) whenever the state of a job changes, until
+        it has reached a final state
+
+        :param job_id: the job to follow
+        :param callback_url: the URL to POST to
+        """
+        job_id = str(job_id)
+        self._callbacks.setdefault(job_id, []).append(callback_url)
+        self._watch(job_id, self.runner_service.status(job_id))
+        log.debug("Registered callback {} for job {}".format(callback_url, job_id))
+
+    @gen.coroutine
+    def _poll(self, io_loop):
+        # runs as long as there are jobs to watch, and this is still the IOLoop the watcher is used on
+        while self._states and self._io_loop is io_loop:
+            for job_id in list(self._states.keys()):
+                try:
+                    self._check(job_id)
+                except Exception:
+                    log.exception("Could not check the state of job {}".format(job_id))
+            yield gen.sleep(self.poll_interval)
+        if self._io_loop is io_loop:
+            self._io_loop = None
+
+    def _check(self, job_id):
+        state = self.runner_service.status(job_id)
+        previous_state = self._states.get(job_id)
+        if state == previous_state:
+            return
+
+        log.debug("Job {} changed state from {} to {}".format(job_id, previous_state, state))
+        self._states[job_id] = state
+        for waiter in self._waiters.pop(job_id, []):
+            if not waiter.done():
+                waiter.set_result(state)
+
+        callbacks = self._callbacks.get(job_id, [])
+        if callbacks:
+            status = {"job_id": job_id, "state": state, "previous_state": previous_state}
+            status.update(self.runner_service.status_details(job_id))
+            for callback_url in callbacks:
+                IOLoop.current().spawn_callback(self._post, callback_url, status)
+        if state in FINAL_STATES:
+            self._callbacks.pop(job_id, None)
+        self._unwatch_if_idle(job_id)
+
+    @gen.coroutine
+    def _post(self, callback_url, status):
+        request = HTTPRequest(
+            callback_url,
+            method="POST",
+            headers={"Content-Type": "application/json"},
+            body=json.dumps(status))
+        try:
+            yield AsyncHTTPClient().fetch(request)
+        except Exception as e:
+            log.warning("Could not notify {} of the state of job {}: {}".format(callback_url, status["job_id"], e))
@@ -0,0 +1,95 @@
+"""
+The queue of jobs waiting to be handed to the job runner, and the order in which they are handed to it.
+"""
+
+import collections
+import time
+
+QueuedJob = collections.namedtuple("QueuedJob", ["job_id", "args", "priority", "group", "queued_at"])
+
+
+class JobQueue(object):
+
+    """
+    Jobs that wait for their resources (see `ResourcePool`) before they can be started. The jobs are ordered by
+    one of two methods:
+
+    FIFO       = in the order they were queued
+    FAIR_SHARE = by their priority, where a job gains one point of priority for every `aging_interval` seconds
+                 it has waited (so that jobs with a low priority do not starve), and loses one point for every
+                 job of its group (i.e. its archive) that is running or ahead of it in the queue. A batch of
+                 jobs for one archive is thereby interleaved with the jobs of the other archives.
+    """
+
+    FIFO = "fifo"
+    FAIR_SHARE = "fair_share"
+    METHODS = [FIFO, FAIR_SHARE]
+
+    def __init__(self, method=FIFO, aging_interval=600.0):
+        """
+        :param method: FIFO or FAIR_SHARE
+        :param aging_interval: seconds a job has to wait to gain a point of priority (FAIR_SHARE only)
+        """
+        if method not in JobQueue.METHODS:
+            raise ValueError("Unknown queueing method {}, should be one of {}".format(method, JobQueue.METHODS))
+        self.method = method
+        self.aging_interval = float(aging_interval)
+        self._jobs = {}
+
+    def __contains__(self, job_id):
+        return job_id in self._jobs
+
+    def __len__(self):
+        return len(self._jobs)
+
+    def add(self, job_id, args, priority=0, group=None):
+        """
+        :param job_id: the job to queue
+        :param args: what is needed to start the job once it has left the queue
+        :param priority: jobs with a higher priority are started first (FAIR_SHARE only)
+        :param group: the group of the job, that the jobs are shared fairly between (FAIR_SHARE only)
+        """
+        self._jobs[job_id] = QueuedJob(job_id, args, priority, group, time.time())
+
+    def get(self, job_id):
+        """
+        :return: the args of a queued job, or None if it is not queued
+        """
+        job = self._jobs.get(job_id)
+        return job.args if job else None
+
+    def pop(self, job_id):
+        """
+        Remove a job from the queue
+        :return: the args of the job
+        """
+        return self._jobs.pop(job_id).args
+
+    def effective_priority(self, job_id, now=None):
+        """
+        :return: the priority of a queued job, including what it has gained from waiting
+        """
+        job = self._jobs[job_id]
+        waited = (now or time.time()) - job.queued_at
+        return job.priority + waited / self.aging_interval
+
+    def ordered(self, running_per_group=None, now=None):
+        """
+        :param running_per_group: a dict of group -> the number of jobs of the group that are running
+        :param now: the time to age the jobs to (defaults to the current time)
+        :return: the ids of the queued jobs, in the order they should be started
+        """
+        jobs = sorted(self._jobs.values(), key=lambda job: job.job_id)
+        if self.method == JobQueue.FIFO:
+            return [job.job_id for job in jobs]
+
+        now = now or time.time()
+        load = collections.Counter(running_per_group or {})
+        ordered = []
+        while jobs:
+            next_job = max(
+                jobs, key=lambda job: (self.effective_priority(job.job_id, now) - load[job.group], -job.job_id))
+            jobs.remove(next_job)
+            ordered.append(next_job.job_id)
+            load[next_job.group] += 1
+        return ordered
@@ -0,0 +1,83 @@
+"""
+Resources that jobs share besides CPU cores, e.g. the bandwidth of the disks and the sessions to the TSM server, and
+the limits on how many jobs may use each of them at the same time.
+"""
+
+import collections
+import os
+
+
+class ResourcePool(object):
+
+    """
+    Keeps track of the resources used by the running jobs. A job declares the resources it needs as a dict of
+    resource name -> amount, and may only be started if the amounts fit within the limits. The resources are
+    named by their kind, and optionally an instance of the kind after a colon, e.g. "tsm_session" or
+    "disk:/data/mm-xart002". The limit of a kind applies to each of its instances, so that `{"disk": 1}` allows
+    one job per volume. Kinds without a limit are not limited.
+    """
+
+    # the cores of the node, only handled by the pool when LocalQAdapter queues the jobs by priority
+    CORES = "cores"
+    # a session to the TSM server, i.e. a running dsmc
+    TSM_SESSION = "tsm_session"
+    # reading or writing much of a volume, see `disk`
+    DISK = "disk"
+
+    def __init__(self, limits=None):
+        """
+        :param limits: a dict of resource kind -> the number of jobs that may use an instance of it at once
+        """
+        self.limits = dict((kind, int(limit)) for kind, limit in (limits or {}).iteritems() if limit is not None)
+        self.in_use = collections.Counter()
+
+    @staticmethod
+    def from_config(config):
+        """
+        :param config: the app config
+        :return: a ResourcePool with the limits in the `resources` section of the config (no limits if the
+                 section is missing)
+        """
+        return ResourcePool(config.get("resources") or {})
+
+    @staticmethod
+    def volume_of(path):
+        """
+        :return: the mount point of the volume that `path` is on
+        """
+        path = os.path.realpath(os.path.abspath(path))
+        while not os.path.ismount(path):
+            path = os.path.dirname(path)
+        return path
+
+    @staticmethod
+    def disk(path):
+        """
+        :return: the name of the disk resource of the volume that `path` is on
+        """
+        return "{}:{}".format(ResourcePool.DISK, ResourcePool.volume_of(path))
+
+    def _limit(self, resource):
+        return self.limits.get(resource.split(":", 1)[0])
+
+    def missing(self, resources):
+        """
+        :param resources: the resources needed by a job
+        :return: the names of the resources that are not available (empty if the job can be started)
+        """
+        missing = []
+        for resource, amount in sorted(resources.iteritems()):
+            limit = self._limit(resource)
+            if limit is not None and self.in_use[resource] + amount > limit:
+                missing.append(resource)
+        return missing
+
+    def acquire(self, resources):
+        for resource, amount in resources.iteritems():
+            self.in_use[resource] += amount
+
+    def release(self, resources):
+        for resource, amount in resources.iteritems():
+            self.in_use[resource] -= amount
+            if self.in_use[resource] <= 0:
+                del self.in_use[resource]
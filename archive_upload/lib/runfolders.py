@@ -0,0 +1,147 @@
+"""
+Validation of the runfolders (and runfolder archives) that requests refer to. A runfolder is validated with a stat
+of its own path, so that the cost of a request does not depend on how many runfolders the monitored directory
+holds, and the runfolders that have been found are remembered for a while.
+"""
+
+import errno
+import logging
+import os
+import stat
+import time
+
+try:
+    import pyinotify
+except ImportError:
+    pyinotify = None
+
+from tornado.ioloop import IOLoop
+
+log = logging.getLogger(__name__)
+
+
+class RunfolderCache(object):
+
+    """
+    Remembers the runfolders found in a monitored directory for `ttl` seconds. A runfolder that is not remembered is
+    looked up with a stat of its path, and runfolders that are not found are not remembered, so that a new runfolder
+    is found as soon as it exists. If inotify is used (and pyinotify is installed), a runfolder is forgotten as soon
+    as it is removed or renamed. Since inotify does not see changes made on other NFS clients, the ttl still applies.
+    """
+
+    # one cache per monitored directory and settings, see `for_directory`
+    _caches = {}
+
+    # the events after which a name in the monitored directory no longer refers to the same runfolder
+    INOTIFY_EVENTS = ["IN_DELETE", "IN_MOVED_FROM", "IN_DELETE_SELF", "IN_MOVE_SELF"]
+
+    def __init__(self, monitored_dir, ttl=0, use_inotify=False):
+        """
+        :param monitored_dir: the directory that holds the runfolders
+        :param ttl: the number of seconds a runfolder that has been found is remembered, 0 to not remember any
+        :param use_inotify: if True, forget runfolders when inotify reports that they have been removed or renamed
+        """
+        self.monitored_dir = monitored_dir
+        self.ttl = ttl
+        self.use_inotify = use_inotify and pyinotify is not None
+        # name -> when the runfolder was found
+        self._found_at = {}
+        self._notifier = None
+        # the IOLoop the notifier runs on
+        self._io_loop = None
+
+    @staticmethod
+    def from_config(config, monitored_dir):
+        """
+        :param config: the app config
+        :param monitored_dir: the directory that holds the runfolders
+        :return: the RunfolderCache of `monitored_dir`, created with the settings in the `runfolder_cache` section of
+                 the config (nothing is remembered if the section is missing)
+        """
+        cache_config = config.get("runfolder_cache") or {}
+        return RunfolderCache.for_directory(
+            monitored_dir, cache_config.get("ttl", 0), cache_config.get("inotify", False))
+
+    @staticmethod
+    def for_directory(monitored_dir, ttl=0, use_inotify=False):
+        """
+        :return: the RunfolderCache of the monitored directory with these settings, created if needed
+        """
+        key = (os.path.abspath(monitored_dir), ttl, use_inotify)
+        cache = RunfolderCache._caches.get(key)
+        if cache is None:
+            cache = RunfolderCache._caches[key] = RunfolderCache(monitored_dir, ttl, use_inotify)
+        return cache
+
+    def _watch(self):
+        io_loop = IOLoop.current()
+        if self._notifier is not None:
+            if self._io_loop is io_loop:
+                return
+            # the cache is used from another IOLoop, e.g. in a new app, so the runfolders are watched from it
+            # instead. The events that have not been handled by the old IOLoop are lost.
+            self._notifier.stop()
+            self._notifier = None
+            self.clear()
+        mask = 0
+        for event in RunfolderCache.INOTIFY_EVENTS:
+            mask |= getattr(pyinotify, event)
+        watch_manager = pyinotify.WatchManager()
+        watch_descriptors = watch_manager.add_watch(self.monitored_dir, mask, proc_fun=self._on_event)
+        if watch_descriptors.get(self.monitored_dir, -1) < 0:
+            log.warning("Could not watch {} with inotify, runfolders will be remembered for {} seconds".format(
+                self.monitored_dir, self.ttl))
+            self.use_inotify = False
+            return
+        self._notifier = pyinotify.TornadoAsyncNotifier(watch_manager, io_loop)
+        self._io_loop = io_loop
+
+    def _on_event(self, event):
+        if event.mask & (pyinotify.IN_DELETE_SELF | pyinotify.IN_MOVE_SELF):
+            self.clear()
+        else:
+            self.forget(event.name)
+
+    def forget(self, runfolder):
+        """
+        Forget a runfolder, so that it is looked up again the next time
+        """
+        self._found_at.pop(runfolder, None)
+
+    def clear(self):
+        """
+        Forget all runfolders
+        """
+        self._found_at.clear()
+
+    def _is_dir(self, runfolder):
+        try:
+            return stat.S_ISDIR(os.stat(os.path.join(self.monitored_dir, runfolder)).st_mode)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return False
+            raise
+
+    def exists(self, runfolder, now=None):
+        """
+        :param runfolder: the name of the runfolder
+        :param now: the current time (defaults to the time of the call)
+        :return: True if the runfolder is a directory (or a symlink to one) directly in the monitored directory
+        """
+        # only direct subdirectories are runfolders
+        if not runfolder or runfolder in (os.curdir, os.pardir) or os.sep in runfolder:
+            return False
+
+        now = now or time.time()
+        found_at = self._found_at.get(runfolder)
+        if found_at is not None and now - found_at < self.ttl:
+            return True
+
+        if not self._is_dir(runfolder):
+            self.forget(runfolder)
+            return False
+        if self.ttl > 0:
+            if self.use_inotify:
+                self._watch()
+            self._found_at[runfolder] = now
+        return True
@@ -0,0 +1,275 @@
+"""
+Build the tarball of an archive and calculate the MD5 checksums of its contents in a single pass over the data.
+
+Each file that goes into the tarball is hashed while it is read by `tarfile`, and the compressed tarball is hashed
+while it is written to disk. Files that are kept as-is in the archive are hashed as well, so that the checksum file
+can be written without reading the archive again. Meant to be run as a job, e.g.:
+
+    python -m archive_upload.lib.tarstream /path/to/archive --tarball archive.tar.gz --exclude Config ...
+
+With `--kept-only`, only the files that are kept as-is are checksummed, e.g. while `tar` builds the tarball.
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+import tarfile
+import threading
+
+from archive_upload.lib.checksums import CHECKSUM_FILENAME, CHUNK_SIZE, ChecksumUtils, HashingReader, \
+    HashingWriter
+from archive_upload.lib.compression import CompressionEngine
+from archive_upload.lib.events import JobEventLog
+from archive_upload.lib.exclusion import ExclusionMatcher
+
+log = logging.getLogger(__name__)
+
+
+class TarStreamer(object):
+
+    """
+    Creates a compressed tarball of an archive while calculating checksums of all files read and of the tarball.
+    """
+
+    def __init__(self, path_to_archive, tarball_name, exclude_from_tarball, compression_engine=None):
+        """
+        :param path_to_archive: the archive to pack, the tarball members will be rooted here
+        :param tarball_name: the name of the tarball, which will be created in the root of the archive
+        :param exclude_from_tarball: patterns, with the semantics of `tar --exclude`, for paths to keep as-is
+        :param compression_engine: the `CompressionEngine` to compress the tarball with
+        """
+        self.path_to_archive = os.path.abspath(path_to_archive)
+        self.tarball_name = tarball_name
+        self.exclude_from_tarball = list(exclude_from_tarball)
+        self.exclusion_matcher = ExclusionMatcher(self.exclude_from_tarball)
+        # paths that are neither added to the tarball nor checksummed
+        self.ignored_paths = {tarball_name, CHECKSUM_FILENAME}
+        self.compression_engine = compression_engine or CompressionEngine()
+
+        # paths relative to the archive root, prefixed with "./" like the ones listed by `tar` and `find .`
+        self.members = []
+        self.member_checksums = {}
+        self.kept_checksums = {}
+        # the bytes read from the files of the archive and written to the tarball that have been hashed, and
+        # the bytes of the files that have been packed into the tarball and compressed
+        self.bytes_hashed = 0
+        self.bytes_compressed = 0
+
+    def _is_excluded(self, relpath):
+        """
+        Mimic `tar --exclude`: patterns without a slash are matched against the name of each path component,
+        other patterns are matched against the path relative to the archive root.
+        """
+        return self.exclusion_matcher.excludes(relpath)
+
+    @staticmethod
+    def _arcname(relpath):
+        return "./{}".format(relpath) if relpath else "."
+
+    def _hash_kept_tree(self, path, relpath):
+        """
+        Hash a file or all files beneath a directory that is kept as-is in the archive. Symlinks are followed,
+        like `find -L`, except for symlinks that loop back to a parent directory.
+        """
+        if os.path.isfile(path):
+            self.kept_checksums[self._arcname(relpath)] = ChecksumUtils.md5_of_file(path)
+            self.bytes_hashed += os.path.getsize(path)
+            return
+
+        for dirpath, subdirs, dirfiles in ChecksumUtils.walk_following_links(path, root=self.path_to_archive):
+            for f in dirfiles:
+                full_path = os.path.join(dirpath, f)
+                if os.path.isfile(full_path):
+                    self.kept_checksums[self._arcname(os.path.relpath(full_path, self.path_to_archive))] = \
+                        ChecksumUtils.md5_of_file(full_path)
+                    self.bytes_hashed += os.path.getsize(full_path)
+
+    def _add_to_tarball(self, tar, path, relpath):
+        arcname = self._arcname(relpath)
+        tarinfo = tar.gettarinfo(path, arcname)
+        if tarinfo is None:
+            log.warning("Skipping {}, it can not be added to a tarball".format(path))
+            return
+
+        if tarinfo.isreg():
+            with open(path, "rb") as fh:
+                reader = HashingReader(fh)
+                tar.addfile(tarinfo, reader)
+            self.member_checksums[arcname] = reader.hexdigest()
+            self.bytes_hashed += reader.bytes_read
+            self.bytes_compressed += reader.bytes_read
+        else:
+            tar.addfile(tarinfo)
+
+        self.members.append(arcname)
+
+    def _walk_members(self):
+        """
+        Walk the archive top-down, pruning excluded directories and hashing the paths that are kept as-is.
+        Symlinks are followed, like `tar --dereference`, except that the walk does not descend into symlinks
+        that loop back to a parent directory.
+
+        :return: a generator of (path, relpath) of the paths that go into the tarball, in the same order that
+                 `tar --create` would add them
+        """
+        for dirpath, subdirs, dirfiles in ChecksumUtils.walk_following_links(
+                self.path_to_archive, root=self.path_to_archive):
+            for name in sorted(subdirs + dirfiles):
+                path = os.path.join(dirpath, name)
+                relpath = os.path.relpath(path, self.path_to_archive)
+
+                if relpath in self.ignored_paths:
+                    continue
+                elif self._is_excluded(relpath):
+                    if name in subdirs:
+                        subdirs.remove(name)
+                    self._hash_kept_tree(path, relpath)
+                else:
+                    yield path, relpath
+
+    def _write_tarball(self, tar):
+        self._add_to_tarball(tar, self.path_to_archive, "")
+        for path, relpath in self._walk_members():
+            self._add_to_tarball(tar, path, relpath)
+
+    def checksum_kept(self):
+        """
+        Collect the checksums of the files that are kept as-is, without building the tarball. The files that go
+        into the tarball are not read, so this can run while the tarball is built by someone else.
+        """
+        for _ in self._walk_members():
+            pass
+
+    def run(self):
+        """
+        Create the tarball and collect the checksums.
+
+        :return: the MD5 hex digest of the tarball
+        """
+        tarball_path = os.path.join(self.path_to_archive, self.tarball_name)
+        log.info("Streaming {} into {} using {}".format(
+            self.path_to_archive, tarball_path, self.compression_engine.compress_cmd))
+
+        with open(tarball_path, "wb") as tarball_fh:
+            writer = HashingWriter(tarball_fh)
+            compressor = subprocess.Popen(
+                self.compression_engine.compress_cmd,
+                shell=True,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE)
+
+            def _drain():
+                for chunk in iter(lambda: compressor.stdout.read(CHUNK_SIZE), b""):
+                    writer.write(chunk)
+
+            drainer = threading.Thread(target=_drain)
+            drainer.start()
+
+            try:
+                tar = tarfile.open(fileobj=compressor.stdin, mode="w|", dereference=True)
+                try:
+                    self._write_tarball(tar)
+                finally:
+                    tar.close()
+            finally:
+                compressor.stdin.close()
+                drainer.join()
+                compressor.wait()
+
+        if compressor.returncode != 0:
+            raise IOError("Compression command '{}' returned {}".format(
+                self.compression_engine.compress_cmd, compressor.returncode))
+
+        tarball_md5 = writer.hexdigest()
+        self.bytes_hashed += writer.bytes_written
+        self.kept_checksums[self._arcname(self.tarball_name)] = tarball_md5
+        return tarball_md5
+
+    def write_progress_file(self, progress_file):
+        """
+        Write the number of bytes hashed and compressed to a file as a JSON object, once the streamer is done
+        """
+        ChecksumUtils.write_progress_file(
+            {"bytes_hashed": self.bytes_hashed, "bytes_compressed": self.bytes_compressed, "done": True},
+            progress_file)
+
+    def write_list_file(self, list_file):
+        """
+        Write the tarball members to a file, in the same format as `tar --list | sed -re 's#/$##'`
+        """
+        with open(list_file, "w") as fh:
+            for member in self.members:
+                fh.write("{}\n".format(member))
+
+    def write_checksum_file(self, checksum_file):
+        """
+        Write the checksums of the files that will remain in the archive once the tarballed files have been
+        removed, i.e. the kept files and the tarball itself, in the format used by `md5sum`.
+        """
+        ChecksumUtils.write_md5sum_file(self.kept_checksums, checksum_file)
+
+    def write_member_checksum_file(self, checksum_file):
+        """
+        Write the checksums of the files that were added to the tarball, in the format used by `md5sum`.
+        """
+        ChecksumUtils.write_md5sum_file(self.member_checksums, checksum_file)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create a compressed tarball of an archive and checksum its contents in a single pass")
+    parser.add_argument("path_to_archive")
+    parser.add_argument("--tarball", required=True, help="name of the tarball to create in the archive root")
+    parser.add_argument("--exclude", action="append", default=[], help="pattern to keep as-is in the archive")
+    parser.add_argument("--engine", default=CompressionEngine.DEFAULT_ENGINE)
+    parser.add_argument("--threads", type=int, default=1)
+    parser.add_argument("--list-file", help="file to write the tarball members to")
+    parser.add_argument("--member-checksum-file", help="file to write the checksums of the tarball members to")
+    parser.add_argument("--checksum-file", help="file to write the checksums of the kept files to, default is {} "
+                                                "in the archive root".format(CHECKSUM_FILENAME))
+    parser.add_argument("--kept-only", action="store_true",
+                        help="only checksum the files kept as-is, do not build the tarball")
+    parser.add_argument("--progress-file", help="file to write the number of bytes hashed and compressed to, "
+                                                "as JSON, once done")
+    parser.add_argument("--event-log", help="file to write the start and end of the step to, see `JobEventLog`")
+    args = parser.parse_args(argv)
+    if not args.kept_only and not args.list_file:
+        parser.error("--list-file is required unless --kept-only is given")
+
+    logging.basicConfig(level=logging.INFO)
+
+    streamer = TarStreamer(
+        args.path_to_archive,
+        args.tarball,
+        args.exclude,
+        CompressionEngine(args.engine, args.threads))
+    checksum_file = args.checksum_file or os.path.join(streamer.path_to_archive, CHECKSUM_FILENAME)
+    events = JobEventLog(args.event_log)
+    if args.kept_only:
+        with events.step("md5_kept") as step:
+            streamer.checksum_kept()
+            streamer.write_checksum_file(checksum_file)
+            step.update(files=len(streamer.kept_checksums), bytes=streamer.bytes_hashed)
+        if args.progress_file:
+            streamer.write_progress_file(args.progress_file)
+        return
+
+    with events.step("tar_stream", engine=args.engine) as step:
+        streamer.run()
+        streamer.write_list_file(args.list_file)
+        streamer.write_checksum_file(checksum_file)
+        if args.member_checksum_file:
+            streamer.write_member_checksum_file(args.member_checksum_file)
+        # the bytes of the tarball, like for `tar --create`
+        step.update(files=len(streamer.members),
+                    bytes=os.path.getsize(os.path.join(streamer.path_to_archive, args.tarball)),
+                    bytes_compressed=streamer.bytes_compressed,
+                    bytes_hashed=streamer.bytes_hashed)
+    if args.progress_file:
+        streamer.write_progress_file(args.progress_file)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,65 @@
+import sys
+import threading
+
+from concurrent import futures
+from tornado.concurrent import Future
+from tornado.ioloop import IOLoop
+
+# the number of threads of the shared pool if it is not set in the config, see `configure`
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+_max_workers = DEFAULT_MAX_WORKERS
+_executor_lock = threading.Lock()
+
+
+def configure(config):
+    """
+    Set the number of threads of the pool that `run_in_thread` shares, from the `thread_pool` section of the app
+    config. Functions that are already running (or waiting) on the old pool are finished by it.
+
+    :param config: the app config
+    """
+    global _executor, _max_workers
+    pool_config = config.get("thread_pool") or {}
+    max_workers = int(pool_config.get("max_workers", DEFAULT_MAX_WORKERS))
+    if max_workers < 1:
+        raise ValueError("The number of threads in the pool must be at least 1, got {}".format(max_workers))
+    with _executor_lock:
+        old_executor, _executor = _executor, None
+        _max_workers = max_workers
+    if old_executor is not None:
+        old_executor.shutdown(wait=False)
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = futures.ThreadPoolExecutor(max_workers=_max_workers)
+        return _executor
+
+
+def run_in_thread(fn, *args, **kwargs):
+    """
+    Run a blocking function on a thread of a shared pool, so that it does not block the IOLoop. If all threads of the
+    pool are busy, the function waits for one to be free.
+
+    :param fn: the function to run
+    :param args: positional arguments to pass to `fn`
+    :param kwargs: keyword arguments to pass to `fn`
+    :return: a Future that will resolve to the return value of `fn` (or raise its exception) on the current IOLoop
+    """
+    future = Future()
+    io_loop = IOLoop.current()
+
+    def _run():
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            io_loop.add_callback(future.set_exc_info, sys.exc_info())
+        else:
+            io_loop.add_callback(future.set_result, result)
+
+    _get_executor().submit(_run)
+    return future
@@ -1,6 +1,16 @@
+import argparse
+import errno
+import heapq
+import logging
 import os
+import sys
 import tarfile
 
+from archive_upload.lib.events import JobEventLog
+from archive_upload.lib.manifest import ArchiveManifest
+
+log = logging.getLogger(__name__)
+
 
 class FileUtils(object):
 
@@ -49,11 +59,169 @@ class FileUtils(object):
         :param path_to_archive: path to search for files and folders duplicated in the tarball
         :return: a list of duplicated files and folders, sorted in reverse lexical order
         """
-        # list the paths in the tarball and store as a set
-        paths_in_tarball = set(FileUtils.source_paths_from_tarball(tarball, path_to_archive))
-        paths_in_source_archive = FileUtils.list_all_paths(path_to_archive, followlinks=False)
+        return FileUtils._paths_duplicated_in(
+            FileUtils.source_paths_from_tarball(tarball, path_to_archive),
+            path_to_archive)
+
+    @staticmethod
+    def source_paths_from_list_file(list_file, path_to_source):
+        """
+        Read a list of tarball members, as written by `tar --list` with any trailing slashes removed, and return
+        their full paths rooted at the supplied source path
+
+        :param list_file: file with one tarball member per line
+        :param path_to_source: the path to the root of the source folder
+        :return: a list of the paths in the list file, using the supplied source path as root
+        """
+        with open(list_file) as fh:
+            return [
+                os.path.normpath(os.path.join(path_to_source, line.rstrip("\n")))
+                for line in fh
+                if line.rstrip("\n")]
+
+    @staticmethod
+    def paths_duplicated_in_list_file(list_file, path_to_archive, manifest=None):
+        """
+        Same as `paths_duplicated_in_tarball`, but reads the tarball members from a list file instead of
+        reading through the tarball itself
+
+        :param list_file: file listing the members of a tarball rooted at the supplied path
+        :param path_to_archive: path to search for files and folders duplicated in the tarball
+        :param manifest: an up to date `ArchiveManifest` of the archive to take the paths on disk from,
+                         instead of listing the archive
+        :return: a list of duplicated files and folders, sorted in reverse lexical order
+        """
+        return FileUtils._paths_duplicated_in(
+            FileUtils.source_paths_from_list_file(list_file, path_to_archive),
+            path_to_archive,
+            manifest)
+
+    @staticmethod
+    def _paths_duplicated_in(paths_in_tarball, path_to_archive, manifest=None):
+        # store the paths in the tarball as a set
+        paths_in_tarball = set(paths_in_tarball)
+        if manifest is not None:
+            paths_in_source_archive = manifest.all_paths()
+        else:
+            paths_in_source_archive = FileUtils.list_all_paths(path_to_archive, followlinks=False)
 
         # duplicated paths are present in tarball and on disk, so take the intersection of the lists
         duplicated_paths = paths_in_tarball.intersection(paths_in_source_archive)
 
         return sorted(list(duplicated_paths), reverse=True)
+
+    @staticmethod
+    def remove_paths(paths, events=None):
+        """
+        Remove the supplied files and directories, deepest paths first. All non-directories are unlinked
+        before any directory is removed, and directories that are not empty afterwards are left in place
+        (like `rmdir --ignore-fail-on-non-empty`). Paths that no longer exist are ignored.
+
+        :param paths: full paths to remove
+        :param events: a `JobEventLog` to write the removal of the files and of the directories to, as
+                       separate steps
+        :return: a tuple with the number of removed files and the number of removed directories
+        """
+        events = events or JobEventLog()
+        # sorting in reverse lexical order puts paths in subdirectories before their parent directories
+        paths = sorted(paths, reverse=True)
+        dirs = []
+        removed_files = 0
+        with events.step("remove_files") as step:
+            for path in paths:
+                if os.path.isdir(path) and not os.path.islink(path):
+                    dirs.append(path)
+                    continue
+                try:
+                    os.unlink(path)
+                    removed_files += 1
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        raise
+            step["files"] = removed_files
+
+        removed_dirs = 0
+        with events.step("remove_dirs") as step:
+            for path in dirs:
+                try:
+                    os.rmdir(path)
+                    removed_dirs += 1
+                except OSError as e:
+                    if e.errno not in (errno.ENOENT, errno.ENOTEMPTY, errno.EEXIST):
+                        raise
+            step["dirs"] = removed_dirs
+
+        return removed_files, removed_dirs
+
+    @staticmethod
+    def remove_paths_duplicated_in_list_file(list_file, path_to_archive, manifest_file=None, events=None):
+        """
+        Remove the files and folders in the archive that have been added to its tarball
+
+        :param list_file: file listing the members of a tarball rooted at the supplied path
+        :param path_to_archive: path to the archive to remove duplicated files and folders from
+        :param manifest_file: if set, the archive is listed through its manifest, which is updated
+                              after the removal
+        :param events: a `JobEventLog` to write the steps of the removal to
+        :return: a tuple with the number of removed files and the number of removed directories
+        """
+        events = events or JobEventLog()
+        manifest = None
+        with events.step("list_tarballed") as step:
+            if manifest_file:
+                manifest = ArchiveManifest.load(path_to_archive, manifest_file)
+                manifest.refresh()
+            duplicated_paths = FileUtils.paths_duplicated_in_list_file(list_file, path_to_archive, manifest)
+            step["paths"] = len(duplicated_paths)
+
+        removed = FileUtils.remove_paths(duplicated_paths, events)
+
+        if manifest is not None:
+            with events.step("update_manifest"):
+                manifest.refresh()
+                manifest.save()
+        return removed
+
+    @staticmethod
+    def balanced_shards(sizes, nbr_of_shards):
+        """
+        Divide paths into shards with about the same total size. The largest paths are placed first, each in the
+        shard that is currently smallest. Between shards of the same size, the one with the fewest paths is
+        chosen, so that e.g. empty files and directories are spread over the shards as well.
+
+        :param sizes: a dict mapping paths to their sizes in bytes
+        :param nbr_of_shards: the number of shards to divide the paths into
+        :return: a list of at most `nbr_of_shards` non-empty lists of paths
+        """
+        shards = [(0, 0, i, []) for i in range(nbr_of_shards)]
+        for path in sorted(sizes, key=lambda p: (-sizes[p], p)):
+            size, nbr_of_paths, i, paths = heapq.heappop(shards)
+            paths.append(path)
+            heapq.heappush(shards, (size + sizes[path], nbr_of_paths + 1, i, paths))
+        return [paths for _, _, _, paths in sorted(shards, key=lambda s: s[2]) if paths]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="File utilities for archives")
+    subparsers = parser.add_subparsers(dest="command")
+
+    remove_parser = subparsers.add_parser(
+        "remove-tarballed",
+        help="remove the files and folders in an archive that are listed as members of its tarball")
+    remove_parser.add_argument("list_file")
+    remove_parser.add_argument("path_to_archive")
+    remove_parser.add_argument("--manifest-file", help="list the archive through this manifest, and update it")
+    remove_parser.add_argument("--event-log", help="file to write the steps of the removal to, see `JobEventLog`")
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "remove-tarballed":
+        removed_files, removed_dirs = FileUtils.remove_paths_duplicated_in_list_file(
+            args.list_file, os.path.abspath(args.path_to_archive), args.manifest_file, JobEventLog(args.event_log))
+        log.info("Removed {} files and {} directories from {} that were added to the tarball".format(
+            removed_files, removed_dirs, args.path_to_archive))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+"""
+Compare how the removal of tarballed files from an archive scales with the number of files, for the
+`find | grep -x -f | xargs -n1 rm` shell pipeline previously used by CompressArchiveHandler and the
+set-based `FileUtils.remove_paths_duplicated_in_list_file`.
+
+Usage:
+
+    python benchmarks/benchmark_tarball_removal.py [number of files ...]
+"""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from archive_upload.lib.utils import FileUtils
+
+# the removal commands previously written to the compression wrapper
+LEGACY_REMOVE_FILES_CMD = "find . -depth -not -type d |grep -x -f {list_file} |xargs -n1 -I% rm -f \"%\""
+LEGACY_REMOVE_DIRS_CMD = "find . -mindepth 1 -depth -type d |grep -x -f {list_file} |" \
+                         "xargs -n1 -I% rmdir --ignore-fail-on-non-empty \"%\""
+
+FILES_PER_DIR = 100
+
+
+def create_archive(path, nbr_of_files):
+    """
+    Create an archive with `nbr_of_files` empty files spread over directories, half of which are listed as
+    tarball members. Return the path to the list file and the number of files that should remain after removal
+    """
+    os.makedirs(path)
+    members = ["."]
+    nbr_kept = 0
+    for i in range(nbr_of_files):
+        subdir = "dir{}".format(i // FILES_PER_DIR)
+        if i % FILES_PER_DIR == 0:
+            os.mkdir(os.path.join(path, subdir))
+            if i % (2 * FILES_PER_DIR) == 0:
+                members.append("./{}".format(subdir))
+        relpath = os.path.join(subdir, "file{}.bcl".format(i))
+        open(os.path.join(path, relpath), "w").close()
+        if (i // FILES_PER_DIR) % 2 == 0:
+            members.append("./{}".format(relpath))
+        else:
+            nbr_kept += 1
+
+    list_file = "{}.list".format(path)
+    with open(list_file, "w") as fh:
+        fh.write("\n".join(members) + "\n")
+    return list_file, nbr_kept
+
+
+def time_legacy(path, list_file):
+    start = time.time()
+    for cmd in [LEGACY_REMOVE_FILES_CMD, LEGACY_REMOVE_DIRS_CMD]:
+        subprocess.check_call(cmd.format(list_file=list_file), shell=True, cwd=path)
+    return time.time() - start
+
+
+def time_set_based(path, list_file):
+    start = time.time()
+    FileUtils.remove_paths_duplicated_in_list_file(list_file, path)
+    return time.time() - start
+
+
+def main(argv):
+    file_counts = [int(n) for n in argv] or [1000, 5000, 20000]
+    tmpdir = tempfile.mkdtemp()
+    try:
+        print("{:>10} {:>12} {:>12} {:>9}".format("files", "legacy (s)", "set (s)", "speedup"))
+        for nbr_of_files in file_counts:
+            timings = []
+            for name, method in [("legacy", time_legacy), ("set", time_set_based)]:
+                path = os.path.join(tmpdir, "{}_{}".format(name, nbr_of_files))
+                list_file, nbr_kept = create_archive(path, nbr_of_files)
+                timings.append(method(path, list_file))
+                remaining = sum(len(files) for _, _, files in os.walk(path))
+                assert remaining == nbr_kept, "{} left {} files, expected {}".format(name, remaining, nbr_kept)
+            print("{:>10} {:>12.2f} {:>12.2f} {:>8.0f}x".format(
+                nbr_of_files, timings[0], timings[1], timings[0] / max(timings[1], 1e-6)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
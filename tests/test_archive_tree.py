@@ -0,0 +1,60 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from archive_upload.lib.archive_tree import ArchiveTreeBuilder, main
+
+
+class TestArchiveTreeBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.runfolder = os.path.join(self.tmpdir, "testrunfolder")
+        shutil.copytree("tests/resources/testrunfolder", self.runfolder)
+        os.symlink("directory2", os.path.join(self.runfolder, "linked_dir"))
+        self.archive = os.path.join(self.tmpdir, "testrunfolder_archive")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _tree(self, path):
+        tree = {}
+        for dirpath, subdirs, dirfiles in os.walk(path):
+            for name in subdirs + dirfiles:
+                full_path = os.path.join(dirpath, name)
+                tree[os.path.relpath(full_path, path)] = \
+                    os.readlink(full_path) if os.path.islink(full_path) else None
+        return tree
+
+    def test_build(self):
+        counts = ArchiveTreeBuilder(
+            self.runfolder, self.archive, exclude_dirs=["directory3"], exclude_extensions=[".bin", ".bcl"]).build()
+
+        runfolder = os.path.abspath(self.runfolder)
+        self.assertDictEqual(
+            self._tree(self.archive),
+            {"directory1": None,
+             "directory2": None,
+             "directory2/file.bar": os.path.join(runfolder, "directory2", "file.bar"),
+             "directory2/file.txt": os.path.join(runfolder, "directory2", "file.txt"),
+             "file.csv": os.path.join(runfolder, "file.csv"),
+             "file.txt": os.path.join(runfolder, "file.txt"),
+             # symlinks are copied, like `cp -as` does
+             "linked_dir": "directory2"})
+        self.assertDictEqual(counts, {"dirs": 3, "links": 5, "excluded_dirs": 1, "excluded_files": 3})
+        self.assertEqual(int(os.stat(self.archive).st_mtime), int(os.stat(self.runfolder).st_mtime))
+
+    def test_main(self):
+        progress_file = os.path.join(self.tmpdir, "progress.json")
+        main([self.runfolder, self.archive, "--exclude-dir", "directory1", "--progress-file", progress_file])
+
+        self.assertFalse(os.path.exists(os.path.join(self.archive, "directory1")))
+        with open(progress_file) as fh:
+            self.assertDictEqual(
+                json.load(fh), {"dirs": 3, "links": 8, "excluded_dirs": 1, "excluded_files": 0, "done": True})
+
+        # the archive is never built on top of an existing one
+        with self.assertRaises(OSError):
+            main([self.runfolder, self.archive])
@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from archive_upload.lib.checksums import CHECKSUM_FILENAME, ChecksumUtils, main
+
+
+class TestChecksumUtils(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, name, content):
+        with open(os.path.join(self.tmpdir, name), "w") as fh:
+            fh.write(content)
+
+    def test_md5sum_line_matches_md5sum(self):
+        for name in ["plain.txt", "with space.txt", "back\\slash.txt", "new\nline.txt"]:
+            self._write(name, name * 100)
+            expected = subprocess.check_output(["md5sum", "./{}".format(name)], cwd=self.tmpdir)
+            observed = ChecksumUtils.md5sum_line(
+                ChecksumUtils.md5_of_file(os.path.join(self.tmpdir, name)), "./{}".format(name))
+            self.assertEqual(expected, "{}\n".format(observed))
+
+    def test_write_md5sum_file_is_sorted(self):
+        checksum_file = os.path.join(self.tmpdir, "checksums.md5")
+        ChecksumUtils.write_md5sum_file({"./b": "2" * 32, "./a": "1" * 32}, checksum_file)
+        with open(checksum_file) as fh:
+            self.assertListEqual(
+                ["{}  ./a".format("1" * 32), "{}  ./b".format("2" * 32)],
+                fh.read().splitlines())
+
+    def test_files_to_checksum_largest_first(self):
+        self._write("small", "a")
+        self._write("large", "a" * 1000)
+        self._write(CHECKSUM_FILENAME, "ignored")
+        os.mkdir(os.path.join(self.tmpdir, "subdir"))
+        self._write(os.path.join("subdir", "medium"), "a" * 100)
+        # a symlink back to the archive root should not make the listing loop forever
+        os.symlink(self.tmpdir, os.path.join(self.tmpdir, "subdir", "loop"))
+
+        files = ChecksumUtils.files_to_checksum(self.tmpdir, exclude=[CHECKSUM_FILENAME])
+
+        self.assertListEqual(
+            [os.path.join(self.tmpdir, p) for p in ["large", os.path.join("subdir", "medium"), "small"]],
+            [f[0] for f in files])
+
+    def test_checksum_archive_matches_md5sum(self):
+        for i in range(20):
+            self._write("file{}".format(i), str(i) * (i * 1000))
+        self._write(CHECKSUM_FILENAME, "ignored")
+
+        checksum_file = os.path.join(self.tmpdir, CHECKSUM_FILENAME)
+        ChecksumUtils.write_md5sum_file(ChecksumUtils.checksum_archive(self.tmpdir, processes=3), checksum_file)
+
+        expected = subprocess.check_output(
+            "find -L . -type f ! -path './{}' -exec md5sum {{}} + | sort -k2".format(CHECKSUM_FILENAME),
+            shell=True,
+            cwd=self.tmpdir)
+        with open(checksum_file) as fh:
+            self.assertEqual(expected, fh.read())
+
+    def test_read_md5sum_file(self):
+        checksums = {"./plain": "1" * 32, "./back\\slash": "2" * 32, "./new\nline": "3" * 32}
+        checksum_file = os.path.join(self.tmpdir, "checksums.md5")
+        ChecksumUtils.write_md5sum_file(checksums, checksum_file)
+        self.assertDictEqual(checksums, ChecksumUtils.read_md5sum_file(checksum_file))
+
+    def test_main_only_and_merge(self):
+        self._write("tarball", "a" * 1000)
+        self._write("kept", "b")
+        kept_checksum_file = os.path.join(self.tmpdir, "kept.md5")
+        ChecksumUtils.write_md5sum_file(
+            {"./kept": ChecksumUtils.md5_of_file(os.path.join(self.tmpdir, "kept"))}, kept_checksum_file)
+
+        progress_file = os.path.join(self.tmpdir, "progress.json")
+        main([self.tmpdir, "--only", "tarball", "--merge", kept_checksum_file, "--progress-file", progress_file])
+
+        expected = subprocess.check_output(["md5sum", "./kept", "./tarball"], cwd=self.tmpdir)
+        with open(os.path.join(self.tmpdir, CHECKSUM_FILENAME)) as fh:
+            self.assertEqual(expected, fh.read())
+        # only the bytes of the checksummed file are counted, not those of the merged checksums
+        with open(progress_file) as fh:
+            self.assertDictEqual(json.load(fh), {"files": 1, "bytes_hashed": 1000, "done": True})
@@ -0,0 +1,39 @@
+import unittest
+
+from archive_upload.lib.compression import CompressionEngine
+
+
+class TestCompressionEngine(unittest.TestCase):
+
+    def test_default_engine(self):
+        engine = CompressionEngine.from_config({})
+        self.assertEqual(engine.name, "gzip")
+        self.assertEqual(engine.tarball_suffix, ".tar.gz")
+        self.assertEqual(engine.tar_option, "--gzip")
+        self.assertEqual(engine.nbr_of_cores, 1)
+
+    def test_gzip_ignores_threads(self):
+        engine = CompressionEngine.from_config({"compression": {"engine": "gzip", "threads": 8}})
+        self.assertEqual(engine.nbr_of_cores, 1)
+
+    def test_pigz_engine(self):
+        engine = CompressionEngine.from_config({"compression": {"engine": "pigz", "threads": 4}})
+        self.assertEqual(engine.tarball_suffix, ".tar.gz")
+        self.assertEqual(engine.tar_option, "--use-compress-program='pigz -p 4'")
+        self.assertEqual(engine.nbr_of_cores, 4)
+
+    def test_zstd_engine_capped_to_max_cores(self):
+        engine = CompressionEngine.from_config({"compression": {"engine": "zstd", "threads": 16}}, max_cores=6)
+        self.assertEqual(engine.tarball_suffix, ".tar.zst")
+        self.assertEqual(engine.tar_option, "--use-compress-program='zstd -T6'")
+        self.assertEqual(engine.nbr_of_cores, 6)
+
+    def test_invalid_engine(self):
+        with self.assertRaises(ValueError):
+            CompressionEngine("bzip2")
+
+    def test_invalid_threads(self):
+        with self.assertRaises(ValueError):
+            CompressionEngine("pigz", threads=0)
+        with self.assertRaises(ValueError):
+            CompressionEngine("pigz", threads="many")
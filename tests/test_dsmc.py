@@ -0,0 +1,189 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from archive_upload.lib.dsmc import DsmcArchiveEntry, DsmcLogScanner, DsmcProgressParser, DsmcQueryParser
+
+
+class TestDsmcQueryParser(unittest.TestCase):
+
+    archive = "/data/mm-xart002/runfolders/run+folder(1)_archive"
+
+    def _line(self, size, path, descr="e374bd6b-ab36-4f41-94d3-f4eaea9f30d4"):
+        return "{:>14}  B  2017-07-27 17.48.34    {} Never {}".format(size, path, descr)
+
+    def test_parse_sizes(self):
+        parser = DsmcQueryParser(self.archive)
+        for size, expected in [("4,096", 4096), ("4 096", 4096), ("4.096", 4096), ("0", 0), ("123", 123)]:
+            entry = parser.parse_line(self._line(size, "{}/Config".format(self.archive)))
+            self.assertEqual(entry.size, expected)
+
+    def test_only_entries_beneath_archive(self):
+        parser = DsmcQueryParser(self.archive + "/")
+        lines = [
+            "Accessing as node: SLLUPNGI_TEST",
+            self._line("4 096", self.archive),
+            self._line("4 096", "{}/Config".format(self.archive)),
+            self._line("4 096", "{}2/Config".format(self.archive)),
+            self._line("4 096", "/data/mm-xart002/runfolders/runXfolder(1)_archive/Config"),
+        ]
+
+        entries = list(parser.parse(lines))
+
+        self.assertListEqual(
+            [entry.path for entry in entries], [self.archive, "{}/Config".format(self.archive)])
+        self.assertEqual(parser.unparsed_lines[0], "Accessing as node: SLLUPNGI_TEST")
+
+    def test_entries_beneath_several_archives(self):
+        other_archive = "/data/mm-xart002/runfolders/other_archive"
+        parser = DsmcQueryParser([self.archive, other_archive])
+        lines = [
+            self._line("4 096", "{}/Config".format(self.archive)),
+            self._line("4 096", other_archive, descr="0f6b5ad4"),
+            self._line("12", "{}/a/b.txt".format(other_archive), descr="0f6b5ad4"),
+            self._line("4 096", "{}2/Config".format(other_archive)),
+        ]
+
+        entries = list(parser.parse(lines))
+
+        self.assertListEqual(
+            [(entry.path, parser.archive_of(entry.path)) for entry in entries],
+            [("{}/Config".format(self.archive), self.archive),
+             (other_archive, other_archive),
+             ("{}/a/b.txt".format(other_archive), other_archive)])
+        self.assertIsNone(parser.archive_of("/data/mm-xart002/runfolders"))
+
+    def test_feed_across_chunk_boundaries(self):
+        output = "\n".join([
+            "Session established with server BLACKHOLE: Linux/x86_64",
+            self._line("4,096", "{}/Config".format(self.archive)),
+            self._line("0", "{}/with space.txt".format(self.archive), descr="test descr")])
+
+        for chunk_size in [1, 7, len(output)]:
+            parser = DsmcQueryParser(self.archive)
+            entries = []
+            for i in range(0, len(output), chunk_size):
+                entries.extend(parser.feed(output[i:i + chunk_size]))
+            entries.extend(parser.close())
+
+            self.assertListEqual(entries, [
+                DsmcArchiveEntry("{}/Config".format(self.archive), 4096, "e374bd6b-ab36-4f41-94d3-f4eaea9f30d4"),
+                DsmcArchiveEntry("{}/with space.txt".format(self.archive), 0, "test descr")])
+
+
+class TestDsmcLogScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log_file = os.path.join(self.tmpdir, "dsmc_output")
+        open(self.log_file, "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, content):
+        with open(self.log_file, "a") as fh:
+            fh.write(content)
+
+    def test_scan_incrementally(self):
+        scanner = DsmcLogScanner(self.log_file, ["ANS1809W", "ANS2042W"])
+        self._append("ANS1809W Session lost\nNormal File-->  4,096 /data/a [Sent]\nANS20")
+        self.assertTrue(scanner.scan())
+        self.assertSetEqual(scanner.warnings, {"ANS1809W"})
+
+        # the incomplete line is scanned once it has been completed
+        offset = scanner.offset
+        self._append("42W Symbolic link processed\n")
+        self.assertTrue(scanner.scan())
+        self.assertSetEqual(scanner.warnings, {"ANS1809W", "ANS2042W"})
+        self.assertGreater(scanner.offset, offset)
+
+        self._append("ANS1228E Sending of object failed\nANS4037W Object changed during processing")
+        self.assertTrue(scanner.scan())
+        self.assertFalse(scanner.scan(complete=True))
+        self.assertEqual(scanner.non_whitelisted_warning, "ANS4037W")
+
+        # once a non-whitelisted warning has been found, the log is not read again
+        os.unlink(self.log_file)
+        self.assertFalse(scanner.scan())
+
+
+
+class TestDsmcProgressParser(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.output_file = os.path.join(self.tmpdir, "dsmc_output")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _append(self, content):
+        with open(self.output_file, "a") as fh:
+            fh.write(content)
+
+    def test_progress_while_running(self):
+        parser = DsmcProgressParser(self.output_file, started_at=1000)
+        self.assertIsNone(parser.scan(now=1001))
+
+        self._append("Archive function invoked.\n\n"
+                     "Directory-->                   4,096 /data/run_archive [Sent]\n"
+                     "Normal File-->             1,048,576 /data/run_archive/a [b].txt [Sent]\n"
+                     "Normal File-->                 2 048 /data/run_ar")
+        progress = parser.scan(now=1010)
+        self.assertEqual(progress["objects_inspected"], 2)
+        self.assertEqual(progress["bytes_transferred"], 4096 + 1048576)
+        self.assertEqual(progress["elapsed_seconds"], 10)
+        self.assertEqual(progress["average_rate"], (4096 + 1048576) / 10)
+        self.assertIsNone(progress["transfer_rate"])
+        self.assertFalse(progress["finished"])
+
+        # the incomplete line is parsed once it has been completed
+        self._append("chive/b [Sent]\nANS1228E Sending of object '/data/run_archive/c' failed\n"
+                     "ANS1898I ***** Processed     1,000 files *****\n"
+                     "ANS1809W Session lost\nANS1809W Session lost\nANS2042W Symbolic link processed\n")
+        progress = parser.scan(now=1012)
+        self.assertEqual(progress["objects_inspected"], 1000)
+        self.assertEqual(progress["objects_archived"], 3)
+        self.assertEqual(progress["objects_failed"], 1)
+        self.assertEqual(progress["transfer_rate"], 1024)
+        self.assertDictEqual(dict(parser.warnings), {"ANS1809W": 2, "ANS2042W": 1})
+
+    def test_progress_when_finished(self):
+        parser = DsmcProgressParser(self.output_file)
+        self._append("Normal File-->             1,048,576 /data/run_archive/a [Sent]\n"
+                     "Archive processing of '/data/run_archive/*' finished without failure.\n\n"
+                     "Total number of objects inspected:        1,204\n"
+                     "Total number of objects archived:         1,203\n"
+                     "Total number of objects failed:               1\n"
+                     "Total number of bytes inspected:          49.01 GB\n"
+                     "Total number of bytes transferred:        49.00 GB\n"
+                     "Network data transfer rate:          123,456.78 KB/sec\n"
+                     "Elapsed processing time:               00:13:32")
+        # the elapsed time is not known until the last line of the summary has been parsed
+        self.assertIsNone(parser.scan(now=1000)["elapsed_seconds"])
+
+        progress = parser.scan(complete=True, now=1001)
+        self.assertDictEqual(progress, {
+            "objects_inspected": 1204,
+            "objects_archived": 1203,
+            "objects_failed": 1,
+            "bytes_transferred": 49 * 1024 ** 3,
+            "elapsed_seconds": 812,
+            "average_rate": 49 * 1024 ** 3 / 812,
+            "transfer_rate": None,
+            "finished": True})
+
+    def test_parse_amount(self):
+        for amount, expected in [("12 B", 12), ("1,234.50 KB", 1264128), ("1.234,50 KB", 1264128),
+                                 ("2.00 MB", 2097152), ("1,024 B", 1024), ("n/a", None)]:
+            self.assertEqual(DsmcProgressParser.parse_amount(amount), expected, amount)
+
+    def test_combine(self):
+        progress = {"objects_inspected": 2, "objects_archived": 2, "objects_failed": 0, "bytes_transferred": 10,
+                    "elapsed_seconds": 5, "average_rate": 2, "transfer_rate": None, "finished": True}
+        combined = DsmcProgressParser.combine([progress, dict(progress, elapsed_seconds=10, finished=False)])
+        self.assertDictEqual(combined, {
+            "objects_inspected": 4, "objects_archived": 4, "objects_failed": 0, "bytes_transferred": 20,
+            "elapsed_seconds": 10, "average_rate": 4, "transfer_rate": None, "finished": False})
@@ -5,6 +5,7 @@ import re
 import shutil
 import subprocess
 import tarfile
+import tempfile
 import time
 import uuid
 import urlparse
@@ -12,6 +13,8 @@ import urlparse
 from nose.tools import *
 from mockproc import mockprocess
 
+from tornado import gen
+from tornado.ioloop import PeriodicCallback
 from tornado.testing import *
 from tornado.web import Application
 from tornado.escape import json_encode
@@ -20,8 +23,12 @@ from arteria.web.state import State
 
 from archive_upload.app import routes
 from archive_upload import __version__ as archive_upload_version
-from archive_upload.handlers.dsmc_handlers import VersionHandler, UploadHandler, StatusHandler, ReuploadHandler, CreateDirHandler, GenChecksumsHandler, ReuploadHelper, BaseDsmcHandler, ArchiveException, CompressArchiveHandler
+from archive_upload.handlers.dsmc_handlers import VersionHandler, UploadHandler, StatusHandler, ReuploadHandler, CreateDirHandler, GenChecksumsHandler, ReuploadHelper, BulkReuploadHelper, BaseDsmcHandler, ArchiveException, CompressArchiveHandler, ArchivePipelineHandler, PipelineHelper, PipelineStage
+from archive_upload.lib.checksums import CHECKSUM_FILENAME, ChecksumUtils
+from archive_upload.lib.inventory import ArchiveInventory
 from archive_upload.lib.jobrunner import LocalQAdapter
+from archive_upload.lib.manifest import ArchiveManifest
+from archive_upload.lib.resources import ResourcePool
 from archive_upload.lib.utils import FileUtils
 from tests.test_utils import TestUtils, DummyConfig
 
@@ -65,6 +72,19 @@ class TestDsmcHandlers(AsyncHTTPTestCase):
 
         return json_resp
 
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.slots", autospec=True)
+    def test_metrics(self, mock_slots):
+        mock_slots.return_value = {"total": 2, "used": 1}
+        self.fetch(self.API_BASE + "/version")
+
+        resp = self.fetch(self.API_BASE + "/metrics")
+        self.assertEqual(resp.code, 200)
+        self.assertEqual(resp.headers["Content-Type"], "text/plain; version=0.0.4; charset=utf-8")
+        self.assertIn("archive_upload_localq_slots{state=\"used\"} 1", resp.body)
+        self.assertRegexpMatches(
+            resp.body, r'archive_upload_request_duration_seconds_count{code="200",handler="VersionHandler",'
+                       r'method="GET"} [1-9]')
+
     def test_version(self):
         """
         Test version.
@@ -129,6 +149,44 @@ class TestDsmcHandlers(AsyncHTTPTestCase):
         self.assertTrue(os.path.exists(created_dir))
         os.rmdir(created_dir)
 
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.start", autospec=True)
+    def test_start_sharded_upload(self, mock_start):
+        mock_start.side_effect = iter([31, 32, 33])
+        archive_path = os.path.abspath(os.path.join(self.dummy_config["path_to_archive_root"], "test_archive"))
+
+        with mock.patch.dict(TestUtils.DUMMY_CONFIG, {"upload": {"shards": 3}}):
+            response = self.fetch(
+                self.API_BASE + "/upload/test_archive", method="POST", allow_nonstandard_methods=True)
+        json_resp = json.loads(response.body)
+
+        self.assertEqual(response.code, 202)
+        self.assertEqual(json_resp["state"], State.STARTED)
+        description = json_resp["archive_description"]
+
+        json_resp = self._poll_phase(json_resp["job_id"], ReuploadHelper.PLANNING_PHASE)
+        self.assertEqual(json_resp["phase"], ReuploadHelper.UPLOADING_PHASE)
+        self.assertListEqual(json_resp["child_job_ids"], [31, 32, 33])
+        self.assertEqual(json_resp["shards"], 3)
+
+        # every path in the archive is uploaded by exactly one shard
+        created_dir = "{}/dsmc_{}".format(self.dummy_config["log_directory"], "test_archive")
+        try:
+            uploaded = []
+            for i in range(1, 4):
+                cmd = mock_start.call_args_list[i - 1][0][1]
+                filelist = os.path.join(created_dir, "{}.shard{}.filelist".format(description, i))
+                self.assertIn("-filelist='{}'".format(filelist), cmd)
+                self.assertIn("-description='{}'".format(description), cmd)
+                # the shards do not wait for each other's disk
+                self.assertDictEqual(mock_start.call_args_list[i - 1][1]["resources"], {ResourcePool.TSM_SESSION: 1})
+                with open(filelist) as fh:
+                    uploaded.extend(line.strip().strip('"') for line in fh)
+            self.assertListEqual(
+                sorted(uploaded),
+                sorted([archive_path] + FileUtils.list_all_paths(archive_path)))
+        finally:
+            shutil.rmtree(created_dir)
+
     @mock.patch("archive_upload.handlers.dsmc_handlers.BaseDsmcHandler._is_valid_log_dir", autospec=True)
     def test_raise_exception_on_log_dir_problem(self, mock__is_valid_log_dir):
         mock__is_valid_log_dir.return_value = False
@@ -145,6 +203,29 @@ class TestDsmcHandlers(AsyncHTTPTestCase):
         self.assertEqual(json_resp["state"], State.DONE)
         mock_status.assert_called_with(self.runner_service, "1")
 
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.status", autospec=True)
+    def test_check_status_wait(self, mock_status):
+        mock_status.side_effect = iter([State.STARTED, State.STARTED, State.STARTED, State.DONE])
+        response = self.fetch(self.API_BASE + "/status/1?wait=soon")
+        self.assertEqual(response.code, 400)
+
+        # the answer comes once the job has changed state
+        response = self.fetch(self.API_BASE + "/status/1?wait=10")
+        json_resp = json.loads(response.body)
+        self.assertEqual(json_resp["state"], State.DONE)
+
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.status_all", autospec=True)
+    def test_check_status_all(self, mock_status_all):
+        mock_status_all.return_value = {3: State.DONE}
+        response = self.fetch(self.API_BASE + "/status/?state=done&type=upload&archive=test_archive&offset=2&limit=1")
+        json_resp = json.loads(response.body)
+        self.assertEqual(json_resp["3"]["state"], State.DONE)
+        mock_status_all.assert_called_with(
+            self.runner_service, state="done", job_type="upload", archive="test_archive", offset=2, limit=1)
+
+        response = self.fetch(self.API_BASE + "/status/?limit=many")
+        self.assertEqual(response.code, 400)
+
     def test_create_dir(self):
         archive_path = "./tests/resources/archives/testrunfolder_archive"
 
@@ -244,6 +325,37 @@ class TestDsmcHandlers(AsyncHTTPTestCase):
         json_resp = json.loads(resp.body)
         self.assertEqual(json_resp["state"], State.ERROR)
 
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.status", autospec=True)
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.start", autospec=True)
+    def test_create_dir_native(self, mock_start, mock_status):
+        mock_start.return_value = 42
+        mock_status.return_value = State.PENDING
+        wrapper = os.path.abspath(
+            os.path.join(self.dummy_config["path_to_archive_root"], "testrunfolder.wrapper.create.sh"))
+        progress_file = os.path.join(
+            os.path.abspath(self.dummy_config["log_directory"]), "testrunfolder_archive.create_dir.progress.json")
+
+        with mock.patch.dict(TestUtils.DUMMY_CONFIG, {"create_dir": {"mode": "native"}}):
+            resp = self.fetch(
+                self.API_BASE + "/create_dir/testrunfolder",
+                method="POST",
+                body=json_encode({"exclude_dirs": "directory3", "exclude_extensions": ".bin"}))
+
+        self.assertEqual(resp.code, 202)
+        _, kwargs = mock_start.call_args
+        self.assertEqual(kwargs["progress_file"], progress_file)
+        with open(wrapper) as fh:
+            cmd = fh.read()
+        self.assertIn("-m archive_upload.lib.archive_tree", cmd)
+        self.assertIn("--exclude-dir directory3 --exclude-extension .bin --progress-file {}".format(progress_file), cmd)
+        self.assertNotIn("rm -", cmd)
+
+    def test_create_dir_unknown_mode(self):
+        with mock.patch.dict(TestUtils.DUMMY_CONFIG, {"create_dir": {"mode": "rsync"}}):
+            resp = self.fetch(
+                self.API_BASE + "/create_dir/testrunfolder", method="POST", body=json_encode({}))
+        self.assertEqual(resp.code, 500)
+
     @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.status", autospec=True)
     @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.start", autospec=True)
     def test_generate_checksum(self, mock_start, mock_status):
@@ -286,40 +398,298 @@ class TestDsmcHandlers(AsyncHTTPTestCase):
             nbr_of_cores=1,
             run_dir=log_dir,
             stdout=checksum_log,
-            stderr=checksum_log
+            stderr=checksum_log,
+            job_type="checksum",
+            archive=archive_name,
+            resources={ResourcePool.disk(path_to_archive): 1},
+            priority=0,
+            progress_file=None,
+            event_log=None
         )
 
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.start", autospec=True)
+    def test_generate_checksum_native(self, mock_start):
+        mock_start.return_value = 42
+        archive_name = "test_archive"
+        wrapper = os.path.abspath(
+            os.path.join(
+                self.dummy_config["path_to_archive_root"],
+                "{}.wrapper.checksum.sh".format(archive_name)))
+
+        config_update = {
+            "checksums": {"mode": "native", "processes": 8},
+            "number_of_cores": 2}
+        with mock.patch.dict(TestUtils.DUMMY_CONFIG, config_update):
+            resp = self.fetch(
+                self.API_BASE + "/gen_checksums/{}".format(archive_name),
+                method="POST",
+                allow_nonstandard_methods=True)
+
+        self.assertEqual(resp.code, 202)
+        _, kwargs = mock_start.call_args
+        self.assertEqual(kwargs["nbr_of_cores"], 2)
+        progress_file = os.path.join(
+            os.path.abspath(self.dummy_config["log_directory"]), "{}.checksum.progress.json".format(archive_name))
+        self.assertEqual(kwargs["progress_file"], progress_file)
+        with open(wrapper) as fh:
+            cmd = fh.read()
+        self.assertIn("-m archive_upload.lib.checksums", cmd)
+        self.assertIn("--progress-file {}".format(progress_file), cmd)
+
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.start", autospec=True)
+    def test_generate_checksum_events(self, mock_start):
+        mock_start.return_value = 42
+        archive_name = "test_archive"
+        path_to_archive = os.path.abspath(os.path.join(self.dummy_config["path_to_archive_root"], archive_name))
+        event_log = os.path.join(
+            os.path.abspath(self.dummy_config["log_directory"]), "{}.checksum.events.jsonl".format(archive_name))
+
+        with mock.patch.dict(TestUtils.DUMMY_CONFIG, {"events": {"enabled": True}}):
+            resp = self.fetch(
+                self.API_BASE + "/gen_checksums/{}".format(archive_name),
+                method="POST",
+                allow_nonstandard_methods=True)
+
+        self.assertEqual(resp.code, 202)
+        _, kwargs = mock_start.call_args
+        self.assertEqual(kwargs["event_log"], event_log)
+        with open(os.path.join(os.path.dirname(path_to_archive), "{}.wrapper.checksum.sh".format(archive_name))) as fh:
+            cmd = fh.read()
+        # the md5sum is run as a step, which counts the lines of the checksum file
+        self.assertIn("-m archive_upload.lib.events {} md5 ".format(event_log), cmd)
+        self.assertIn("--count-lines {}/{}".format(path_to_archive, CHECKSUM_FILENAME), cmd)
+
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.start", autospec=True)
+    def test_generate_checksum_priority(self, mock_start):
+        mock_start.return_value = 42
+        resp = self.fetch(
+            self.API_BASE + "/gen_checksums/test_archive", method="POST", body=json_encode({"priority": 5}))
+        self.assertEqual(resp.code, 202)
+        _, kwargs = mock_start.call_args
+        self.assertEqual(kwargs["priority"], 5)
+
+        resp = self.fetch(
+            self.API_BASE + "/gen_checksums/test_archive", method="POST", body=json_encode({"priority": "high"}))
+        self.assertEqual(resp.code, 400)
+        self.assertEqual(mock_start.call_count, 1)
+
+    def test_generate_checksum_unknown_mode(self):
+        with mock.patch.dict(TestUtils.DUMMY_CONFIG, {"checksums": {"mode": "sha1"}}):
+            resp = self.fetch(
+                self.API_BASE + "/gen_checksums/test_archive",
+                method="POST",
+                allow_nonstandard_methods=True)
+
+        self.assertEqual(resp.code, 500)
+
+    def _poll_phase(self, job_id, phase, max_polls=10):
+        """
+        Poll the status of a phased job as long as it stays in `phase`
+        """
+        for _ in range(max_polls):
+            json_resp = json.loads(self.fetch(self.API_BASE + "/status/{}".format(job_id)).body)
+            if json_resp.get("phase") != phase or json_resp["state"] == State.ERROR:
+                break
+            time.sleep(0.1)
+        return json_resp
+
+    def _mock_reupload_helper(self, files_to_reupload, reupload_job_id):
+        patches = [
+            mock.patch("archive_upload.handlers.dsmc_handlers.ReuploadHelper.{}".format(method), autospec=True)
+            for method in ["get_pdc_descr", "get_pdc_filelist", "get_local_filelist", "get_files_to_reupload",
+                           "reupload"]]
+        mocks = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        mock_get_pdc_descr, mock_get_pdc_filelist, mock_get_local_filelist, mock_get_files_to_reupload, \
+            mock_reupload = mocks
+
+        mock_get_pdc_descr.return_value = gen.maybe_future("abc123")
+        mock_get_pdc_filelist.return_value = gen.maybe_future("{'foo': 123}")
+        mock_get_local_filelist.return_value = "{'foo': 123, 'bar': 456}"
+        mock_get_files_to_reupload.return_value = files_to_reupload
+        mock_reupload.return_value = reupload_job_id
+        return mock_reupload
+
     def test_reupload_handler(self):
-        job_id = 27
-
-        with \
-            mock.patch \
-                ("archive_upload.handlers.dsmc_handlers.ReuploadHelper.get_pdc_descr",\
-                autospec=True) as mock_get_pdc_descr, \
-            mock.patch \
-                ("archive_upload.handlers.dsmc_handlers.ReuploadHelper.get_pdc_filelist",\
-                autospec=True) as mock_get_pdc_filelist, \
-            mock.patch \
-                ("archive_upload.handlers.dsmc_handlers.ReuploadHelper.get_local_filelist",\
-                autospec=True) as mock_get_local_filelist, \
-            mock.patch \
-                ("archive_upload.handlers.dsmc_handlers.ReuploadHelper.get_files_to_reupload",\
-                autospec=True) as mock_get_files_to_reupload, \
-            mock.patch("archive_upload.handlers.dsmc_handlers.ReuploadHelper.reupload",\
-                autospec=True) as mock_reupload:
-
-            mock_get_pdc_descr.return_value = "abc123"
-            mock_get_pdc_filelist.return_value = "{'foo': 123}"
-            mock_get_local_filelist.return_value = "{'foo': 123, 'bar': 456}"
-            mock_get_files_to_reupload.return_value = "{'bar': 456}"
-            mock_reupload.return_value = job_id
-
-            resp = self.fetch(self.API_BASE + "/reupload/test_archive", method="POST",
-            allow_nonstandard_methods=True)
+        reupload_job_id = 27
+        mock_reupload = self._mock_reupload_helper("{'bar': 456}", reupload_job_id)
+
+        resp = self.fetch(self.API_BASE + "/reupload/test_archive", method="POST",
+        allow_nonstandard_methods=True)
 
         json_resp = json.loads(resp.body)
+        self.assertEqual(resp.code, 202)
         self.assertEqual(json_resp["state"], State.STARTED)
-        self.assertEqual(json_resp["job_id"], job_id)
+        self.assertEqual(json_resp["phase"], ReuploadHelper.PLANNING_PHASE)
+
+        # the planning runs in the background and then chains into the reupload job
+        json_resp = self._poll_phase(json_resp["job_id"], ReuploadHelper.PLANNING_PHASE)
+        self.assertEqual(json_resp["phase"], ReuploadHelper.UPLOADING_PHASE)
+        self.assertEqual(json_resp["archive_description"], "abc123")
+        self.assertListEqual(json_resp["child_job_ids"], [reupload_job_id])
+        self.assertEqual(mock_reupload.call_count, 1)
+
+    def test_reupload_handler_nothing_to_reupload(self):
+        mock_reupload = self._mock_reupload_helper([], 27)
+
+        resp = self.fetch(self.API_BASE + "/reupload/test_archive", method="POST",
+        allow_nonstandard_methods=True)
+        self.assertEqual(resp.code, 202)
+
+        json_resp = self._poll_phase(json.loads(resp.body)["job_id"], ReuploadHelper.PLANNING_PHASE)
+        self.assertEqual(json_resp["state"], State.ERROR)
+        self.assertEqual(json_resp["message"], "nothing to reupload")
+        self.assertFalse(mock_reupload.called)
+
+    def test_reupload_handler_with_features_enabled(self):
+        tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmpdir)
+        root = os.path.join(tmpdir, "archives")
+        path_to_archive = os.path.join(root, "test_archive")
+        os.makedirs(path_to_archive)
+        for name, content in [("foo", "foo"), ("bar", "bar")]:
+            with open(os.path.join(path_to_archive, name), "w") as fh:
+                fh.write(content)
+        ChecksumUtils.write_md5sum_file(
+            ChecksumUtils.checksum_archive(path_to_archive), os.path.join(path_to_archive, CHECKSUM_FILENAME))
+
+        config_update = TestUtils.enabled_features_config(tmpdir)
+        config_update["path_to_archive_root"] = root
+        patches = [mock.patch.dict(TestUtils.DUMMY_CONFIG, config_update)] + [
+            mock.patch.object(ReuploadHelper, method, autospec=True)
+            for method in ["get_pdc_descr", "get_pdc_filelist", "reupload"]]
+        _, mock_get_pdc_descr, mock_get_pdc_filelist, mock_reupload = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        mock_get_pdc_descr.return_value = gen.maybe_future("abc123")
+        mock_get_pdc_filelist.return_value = gen.maybe_future({path_to_archive + "/foo": 3})
+        mock_reupload.return_value = 27
+        self.addCleanup(shutil.rmtree, os.path.join(self.dummy_config["log_directory"], "dsmc_test_archive"), True)
+
+        resp = self.fetch(self.API_BASE + "/reupload/test_archive", method="POST", body=json_encode({}))
+        self.assertEqual(resp.code, 202)
+
+        # the local files are listed through the manifest, and the answer from PDC is kept in the inventory
+        json_resp = self._poll_phase(json.loads(resp.body)["job_id"], ReuploadHelper.PLANNING_PHASE)
+        self.assertEqual(json_resp["phase"], ReuploadHelper.UPLOADING_PHASE)
+        self.assertEqual(json_resp["filelist_source"], "pdc")
+        self.assertEqual(json_resp["compared_by"], ReuploadHelper.COMPARE_CHECKSUM)
+        self.assertListEqual(
+            mock_reupload.call_args[0][1],
+            [path_to_archive + "/bar", os.path.join(path_to_archive, CHECKSUM_FILENAME)])
+        self.assertTrue(os.path.isfile(
+            ArchiveManifest.manifest_file_from_config(TestUtils.DUMMY_CONFIG, path_to_archive)))
+        inventory = ArchiveInventory.from_config(TestUtils.DUMMY_CONFIG)
+        self.assertEqual(inventory.latest_description(path_to_archive), "abc123")
+
+    def test_bulk_reupload_handler(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        test_archive = os.path.join(root, "test_archive")
+        other_archive = os.path.join(root, "other_archive")
+        for path_to_archive in [test_archive, other_archive]:
+            os.mkdir(path_to_archive)
+        patch_root = mock.patch.dict(TestUtils.DUMMY_CONFIG, {"path_to_archive_root": root})
+        patch_root.start()
+        self.addCleanup(patch_root.stop)
+        patches = [
+            mock.patch.object(BulkReuploadHelper, method, autospec=True)
+            for method in ["get_pdc_descrs", "get_pdc_filelists", "get_local_filelist", "reupload_all"]]
+        mock_get_pdc_descrs, mock_get_pdc_filelists, mock_get_local_filelist, mock_reupload_all = \
+            [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+        mock_get_pdc_descrs.return_value = gen.maybe_future({test_archive: "abc123"})
+        mock_get_pdc_filelists.return_value = gen.maybe_future({test_archive: {test_archive + "/foo": 123}})
+        mock_get_local_filelist.side_effect = lambda self, path, manifest_file: {path + "/foo": 123, path + "/bar": 456}
+        mock_reupload_all.return_value = 27
+        self.addCleanup(
+            shutil.rmtree, os.path.join(self.dummy_config["log_directory"], "dsmc_bulk_reupload"), True)
+
+        body = {"archives": ["test_archive", "other_archive", "non_existant"]}
+        resp = self.fetch(self.API_BASE + "/bulk_reupload", method="POST", body=json_encode(body))
+
+        json_resp = json.loads(resp.body)
+        self.assertEqual(resp.code, 202)
+        self.assertEqual(json_resp["phase"], ReuploadHelper.PLANNING_PHASE)
+        self.assertEqual(json_resp["archives"]["non_existant"]["state"], State.ERROR)
+
+        # the descriptions of both archives are queried together, and only the archives found are reuploaded
+        json_resp = self._poll_phase(json_resp["job_id"], ReuploadHelper.PLANNING_PHASE)
+        self.assertEqual(json_resp["phase"], ReuploadHelper.UPLOADING_PHASE)
+        self.assertListEqual(json_resp["child_job_ids"], [27])
+        self.assertListEqual(mock_get_pdc_descrs.call_args[0][1], [other_archive, test_archive])
+        self.assertEqual(mock_reupload_all.call_args[0][1], {"abc123": [test_archive + "/bar"]})
+
+        archives = json_resp["archives"]
+        self.assertEqual(archives["test_archive"]["phase"], ReuploadHelper.UPLOADING_PHASE)
+        self.assertEqual(archives["test_archive"]["archive_description"], "abc123")
+        self.assertEqual(archives["test_archive"]["files_to_reupload"], 1)
+        # the archive follows the reupload job
+        self.assertEqual(archives["test_archive"]["job_id"], 27)
+        self.assertEqual(archives["test_archive"]["state"], json_resp["state"])
+        self.assertEqual(archives["other_archive"]["state"], State.ERROR)
+        self.assertEqual(archives["other_archive"]["message"], "no upload found in PDC")
+
+    def test_bulk_reupload_handler_invalid(self):
+        for body in [{}, {"archives": "test_archive"}, {"archives": ["non_existant"]}]:
+            resp = self.fetch(self.API_BASE + "/bulk_reupload", method="POST", body=json_encode(body))
+            self.assertEqual(resp.code, 400, body)
+
+    def test_get_pdc_filelists(self):
+        self.scripts = mockprocess.MockProc()
+        helper = BulkReuploadHelper()
+
+        self.scripts.append("dsmc", returncode=0,
+                            script="""#!/bin/bash
+cat tests/resources/dsmc_output/dsmc_pdc_filelist.txt
+""")
+
+        archive_path = "/data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive"
+        other_archive_path = "/data/mm-xart002/runfolders/other_archive"
+        with self.scripts:
+            filelists = self.io_loop.run_sync(lambda: helper.get_pdc_filelists(
+                {archive_path: "e374bd6b-ab36-4f41-94d3-f4eaea9f30d4",
+                 other_archive_path: "e374bd6b-ab36-4f41-94d3-f4eaea9f30d4"},
+                dsmc_log_dir="",
+                dsmc_extra_args={}))
+
+        with open("tests/resources/dsmc_output/dsmc_pdc_converted_filelist.txt") as f:
+            expected = {name: int(size) for size, name in (line.split() for line in f)}
+        self.assertDictEqual(filelists, {archive_path: expected, other_archive_path: {}})
+
+    def test_reupload_all(self):
+        runner_service = mock.MagicMock()
+        runner_service.start.return_value = 72
+        helper = BulkReuploadHelper()
+        dsmc_log_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, dsmc_log_dir)
+
+        job_id = helper.reupload_all(
+            {"descr1": ["/data/a_archive/foo"], "descr2": ["/data/b_archive/bar", "/data/b_archive/baz"]},
+            dsmc_log_dir, {"virtualnode": "node"}, runner_service)
+
+        self.assertEqual(job_id, 72)
+        self.assertEqual(runner_service.start.call_count, 1)
+        cmd = runner_service.start.call_args[0][0]
+        self.assertRegexpMatches(cmd, r"dsmc macro /tmp/archive-upload-bulk-reupload-\S+$")
+        macro_file = cmd.split()[-1]
+        with open(macro_file) as macro:
+            lines = macro.readlines()
+        os.remove(macro_file)
+
+        self.assertEqual(len(lines), 2)
+        for line, descr, files in zip(lines, ["descr1", "descr2"],
+                                      [["/data/a_archive/foo"], ["/data/b_archive/bar", "/data/b_archive/baz"]]):
+            options = dict(re.findall(r"-([^=]+)='([^']*)'", line))
+            self.assertTrue(line.startswith("archive "))
+            self.assertEqual(options["description"], descr)
+            self.assertEqual(options["virtualnode"], "node")
+            with open(options["filelist"]) as filelist:
+                self.assertListEqual(filelist.read().splitlines(), ['"{}"'.format(f) for f in files])
+            os.remove(options["filelist"])
+        self.assertEqual(runner_service.start.call_args[1]["resources"][ResourcePool.TSM_SESSION], 1)
 
     # Successful test
     def test_get_pdc_descr(self):
@@ -334,15 +704,41 @@ cat tests/resources/dsmc_output/dsmc_descr.txt
 
         with self.scripts:
             archive_path = "/data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive"
-            descr = helper.get_pdc_descr(
+            descr = self.io_loop.run_sync(lambda: helper.get_pdc_descr(
                 archive_path,
                 dsmc_log_dir="",
                 dsmc_extra_args={}
-            )
+            ))
 
         self.assertEqual(descr, "e374bd6b-ab36-4f41-94d3-f4eaea9f30d4")
 
 
+    def test_get_pdc_descr_does_not_block(self):
+        self.scripts = mockprocess.MockProc()
+        helper = ReuploadHelper()
+
+        self.scripts.append("dsmc", returncode=0,
+                            script="""#!/bin/bash
+sleep 1
+cat tests/resources/dsmc_output/dsmc_descr.txt
+""")
+
+        # the IOLoop should keep running other callbacks while dsmc is busy
+        ticks = []
+        callback = PeriodicCallback(lambda: ticks.append(1), 50, io_loop=self.io_loop)
+        callback.start()
+        with self.scripts:
+            archive_path = "/data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive"
+            descr = self.io_loop.run_sync(lambda: helper.get_pdc_descr(
+                archive_path,
+                dsmc_log_dir="",
+                dsmc_extra_args={}
+            ))
+        callback.stop()
+
+        self.assertEqual(descr, "e374bd6b-ab36-4f41-94d3-f4eaea9f30d4")
+        self.assertGreater(len(ticks), 5)
+
     @raises(ArchiveException)
     def test_get_pdc_descr_failing_proc(self):
         self.scripts = mockprocess.MockProc()
@@ -352,11 +748,11 @@ cat tests/resources/dsmc_output/dsmc_descr.txt
 
         with self.scripts:
             archive_path = "/foo"
-            descr = helper.get_pdc_descr(
+            descr = self.io_loop.run_sync(lambda: helper.get_pdc_descr(
                 archive_path,
                 dsmc_log_dir="",
                 dsmc_extra_args={}
-            )
+            ))
 
     @raises(ArchiveException)
     def test_get_pdc_descr_no_results(self):
@@ -369,11 +765,11 @@ echo apa
 
         with self.scripts:
             archive_path = "foobar"
-            descr = helper.get_pdc_descr(
+            descr = self.io_loop.run_sync(lambda: helper.get_pdc_descr(
                 archive_path,
                 dsmc_log_dir="",
                 dsmc_extra_args={}
-            )
+            ))
 
     def test_get_pdc_filelist(self):
         self.scripts = mockprocess.MockProc()
@@ -386,12 +782,12 @@ cat tests/resources/dsmc_output/dsmc_pdc_filelist.txt
 
         with self.scripts:
             archive_path = "/data/mm-xart002/runfolders/johanhe_test_0809_001-AG2UJ_archive"
-            filelist = helper.get_pdc_filelist(
+            filelist = self.io_loop.run_sync(lambda: helper.get_pdc_filelist(
                 archive_path,
                 "e374bd6b-ab36-4f41-94d3-f4eaea9f30d4",
                 dsmc_log_dir="",
                 dsmc_extra_args={}
-            )
+            ))
 
         with open("tests/resources/dsmc_output/dsmc_pdc_converted_filelist.txt") as f:
             nr_of_files = 0
@@ -411,12 +807,12 @@ cat tests/resources/dsmc_output/dsmc_pdc_filelist.txt
 
         with self.scripts:
             archive_path = "foo"
-            filelist = helper.get_pdc_filelist(
+            filelist = self.io_loop.run_sync(lambda: helper.get_pdc_filelist(
                 archive_path,
                 "foo-bar",
                 dsmc_log_dir="",
                 dsmc_extra_args={}
-            )
+            ))
 
     @raises(ArchiveException)
     def test_get_pdc_filelist_no_result(self):
@@ -428,12 +824,12 @@ echo uggla
 """)
         with self.scripts:
             archive_path = "foo"
-            filelist = helper.get_pdc_filelist(
+            filelist = self.io_loop.run_sync(lambda: helper.get_pdc_filelist(
                 archive_path,
                 "foo-bar",
                 dsmc_log_dir="",
                 dsmc_extra_args={}
-            )
+            ))
 
     def test_get_local_filelist(self):
         helper = ReuploadHelper()
@@ -464,6 +860,52 @@ echo uggla
         files = helper.get_local_filelist(tmpdir)
         os.rmdir(tmpdir)
 
+    def test_get_uploaded_filelist_from_inventory(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inventory = ArchiveInventory(os.path.join(tmpdir, "inventory.sqlite"))
+            inventory.record_files("/archive", "abc123", {"/archive/foo": 123})
+            helper = ReuploadHelper()
+
+            with mock.patch.object(ReuploadHelper, "get_pdc_descr", autospec=True) as mock_get_pdc_descr, \
+                    mock.patch.object(ReuploadHelper, "get_pdc_filelist", autospec=True) as mock_get_pdc_filelist:
+                mock_get_pdc_descr.return_value = gen.maybe_future("def456")
+                mock_get_pdc_filelist.return_value = gen.maybe_future({"/archive/foo": 123, "/archive/bar": 456})
+
+                result = self.io_loop.run_sync(
+                    lambda: helper.get_uploaded_filelist("/archive", "", {}, inventory))
+                self.assertEqual(result, ("abc123", {"/archive/foo": 123}, "inventory"))
+                self.assertFalse(mock_get_pdc_descr.called)
+
+                # reconciling queries PDC, and updates the inventory with the answer
+                result = self.io_loop.run_sync(
+                    lambda: helper.get_uploaded_filelist("/archive", "", {}, inventory, reconcile=True))
+                self.assertEqual(result, ("def456", {"/archive/foo": 123, "/archive/bar": 456}, "pdc"))
+                self.assertEqual(inventory.latest_description("/archive"), "def456")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    @mock.patch.object(ReuploadHelper, "JOB_POLL_INTERVAL", 0)
+    def test_record_upload_when_done(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            inventory = ArchiveInventory(os.path.join(tmpdir, "inventory.sqlite"))
+            inventory.record_upload("/archive", "abc123")
+            runner_service = mock.MagicMock()
+            runner_service.status.side_effect = [State.PENDING, State.STARTED, State.DONE]
+            helper = ReuploadHelper()
+
+            with mock.patch.object(ReuploadHelper, "get_local_filelist", autospec=True) as mock_get_local_filelist:
+                mock_get_local_filelist.return_value = {"/archive/foo": 123}
+                self.io_loop.run_sync(
+                    lambda: helper.record_upload_when_done(27, "/archive", "abc123", runner_service, inventory))
+
+            self.assertEqual(runner_service.status.call_count, 3)
+            self.assertEqual(inventory.latest_description("/archive"), "abc123")
+            self.assertDictEqual(inventory.uploaded_files("abc123"), {"/archive/foo": 123})
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_get_files_to_reupload(self):
         helper = ReuploadHelper()
 
@@ -484,6 +926,39 @@ echo uggla
         result = helper.get_files_to_reupload(local_files, uploaded_files)
         self.assertItemsEqual(expected, result)
 
+    def test_get_files_to_reupload_by_checksum(self):
+        helper = ReuploadHelper()
+
+        local_files = {"foo": 23, "bar": 46, "baz": 1, "qux": 2}
+        uploaded_files = {"foo": 23, "bar": 46, "baz": 1, "qux": 3}
+        local_checksums = {"foo": "a", "bar": "b", "qux": "d"}
+        uploaded_checksums = {"foo": "a", "bar": "c", "baz": "e", "qux": "d"}
+
+        # baz has no local checksum, so it is only compared by size
+        result = helper.get_files_to_reupload(local_files, uploaded_files, local_checksums, uploaded_checksums)
+        self.assertListEqual(result, ["bar", "qux"])
+
+        result = helper.get_files_to_reupload(local_files, uploaded_files, local_checksums)
+        self.assertListEqual(result, ["qux"])
+
+    def test_get_local_checksums(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            checksum_file = os.path.join(tmpdir, CHECKSUM_FILENAME)
+            ChecksumUtils.write_md5sum_file({"./sub/foo": "a", "./bar": "b"}, checksum_file)
+            helper = ReuploadHelper()
+
+            self.assertDictEqual(
+                helper.get_local_checksums(tmpdir),
+                {os.path.join(tmpdir, "sub/foo"): "a",
+                 os.path.join(tmpdir, "bar"): "b",
+                 checksum_file: ChecksumUtils.md5_of_file(checksum_file)})
+
+            os.remove(checksum_file)
+            self.assertDictEqual(helper.get_local_checksums(tmpdir), {})
+        finally:
+            shutil.rmtree(tmpdir)
+
     def test_reupload(self):
         helper = ReuploadHelper()
         uniq_id = "test"
@@ -502,7 +977,7 @@ echo uggla
                 self.components = {}
                 self.cmd = ""
 
-            def start(self, cmd, nbr_of_cores, run_dir, stdout=dsmc_log_file, stderr=dsmc_log_file):
+            def start(self, cmd, nbr_of_cores, run_dir, stdout=dsmc_log_file, stderr=dsmc_log_file, **kwargs):
                 m = re.findall(r'\s\-([^=]+)=(\S+)', cmd)
                 self.components = {k: v.replace("'", "") for k, v in m}
                 self.cmd = cmd
@@ -573,6 +1048,59 @@ echo uggla
 
         shutil.rmtree(archive_path)
 
+    def test_compress_archive_stream_checksums(self):
+        root = self.dummy_config["path_to_archive_root"]
+        archive_path = os.path.join(root, "testrunfolder_archive_tmp")
+        original = os.path.join(root, "testrunfolder_archive_input")
+
+        shutil.rmtree(archive_path, ignore_errors=True)
+        shutil.copytree(original, archive_path)
+
+        try:
+            with mock.patch.dict(TestUtils.DUMMY_CONFIG, {"compression": {"stream_checksums": True}}):
+                json_resp = self.poll_status(self.API_BASE + "/compress_archive/testrunfolder_archive_tmp")
+
+            self.assertEqual(json_resp["state"], State.DONE)
+            self.assertTrue(os.path.exists(os.path.join(archive_path, "file.csv")))
+            self.assertFalse(os.path.exists(os.path.join(archive_path, "file.bin")))
+            self.assertFalse(os.path.exists(os.path.join(archive_path, "directory2")))
+
+            with open(os.path.join(archive_path, "checksums_prior_to_pdc.md5")) as fh:
+                checksummed = sorted(line.split()[1] for line in fh)
+            self.assertListEqual(
+                ["./directory3/file.zip", "./file.csv", "./testrunfolder_archive_tmp.tar.gz"],
+                checksummed)
+            self.assertFalse(os.path.exists("{}.list.md5".format(archive_path)))
+        finally:
+            shutil.rmtree(archive_path)
+            progress_file = os.path.join(
+                TestUtils.DUMMY_CONFIG["log_directory"], "testrunfolder_archive_tmp.compress.progress.json")
+            if os.path.exists(progress_file):
+                os.remove(progress_file)
+
+    def test_compress_archive_updates_manifest(self):
+        root = self.dummy_config["path_to_archive_root"]
+        archive_path = os.path.join(root, "testrunfolder_archive_tmp")
+        original = os.path.join(root, "testrunfolder_archive_input")
+        manifest_dir = tempfile.mkdtemp()
+
+        shutil.rmtree(archive_path, ignore_errors=True)
+        shutil.copytree(original, archive_path)
+
+        try:
+            manifest_config = {"manifest": {"enabled": True, "directory": manifest_dir}}
+            with mock.patch.dict(TestUtils.DUMMY_CONFIG, manifest_config):
+                json_resp = self.poll_status(self.API_BASE + "/compress_archive/testrunfolder_archive_tmp")
+                manifest_file = ArchiveManifest.manifest_file_from_config(TestUtils.DUMMY_CONFIG, archive_path)
+
+            self.assertEqual(json_resp["state"], State.DONE)
+            manifest = ArchiveManifest.load(archive_path, manifest_file)
+            self.assertListEqual(manifest.all_paths(), FileUtils.list_all_paths(os.path.abspath(archive_path)))
+            self.assertNotIn("file.bin", manifest.files)
+        finally:
+            shutil.rmtree(archive_path)
+            shutil.rmtree(manifest_dir)
+
     def test_compress_archive_exclude(self):
         """
         Don't exclude anything
@@ -616,6 +1144,106 @@ echo uggla
             shutil.rmtree(archive_path)
             TestUtils.DUMMY_CONFIG = local_config
 
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.status", autospec=True)
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.start", autospec=True)
+    def test_compress_archive_parallel_engine(self, mock_start, mock_status):
+        mock_start.return_value = 42
+        mock_status.return_value = State.STARTED
+        root = self.dummy_config["path_to_archive_root"]
+        wrapper = os.path.abspath(os.path.join(root, "test_archive.wrapper.compress.sh"))
+
+        config_update = {
+            "compression": {"engine": "zstd", "threads": 8},
+            "number_of_cores": 4}
+        try:
+            with mock.patch.dict(TestUtils.DUMMY_CONFIG, config_update):
+                resp = self.fetch(
+                    self.API_BASE + "/compress_archive/test_archive",
+                    method="POST",
+                    allow_nonstandard_methods=True)
+
+            self.assertEqual(resp.code, 202)
+            _, kwargs = mock_start.call_args
+            self.assertEqual(kwargs["nbr_of_cores"], 4)
+            with open(wrapper) as fh:
+                cmd = fh.read()
+            self.assertIn("--use-compress-program='zstd -T4'", cmd)
+            self.assertIn("--file=test_archive.tar.zst", cmd)
+        finally:
+            if os.path.exists(wrapper):
+                os.remove(wrapper)
+
+    @mock.patch("archive_upload.handlers.dsmc_handlers.PipelineHelper.JOB_POLL_INTERVAL", 0.01)
+    @mock.patch("archive_upload.lib.jobrunner.LocalQAdapter.status", autospec=True)
+    def test_archive_pipeline(self, mock_status):
+        mock_status.return_value = State.DONE
+        starts = []
+
+        def _start(name, job_id):
+            def _record(*args, **kwargs):
+                starts.append(name)
+                return job_id
+            return _record
+
+        with mock.patch.object(CreateDirHandler, "start_job", side_effect=_start("create_dir", 51)) as mock_create, \
+                mock.patch.object(CompressArchiveHandler, "start_job", side_effect=_start("compress", 52)), \
+                mock.patch.object(ArchivePipelineHandler, "_start_kept_checksums",
+                                  side_effect=_start("checksum_kept", 53)), \
+                mock.patch.object(ArchivePipelineHandler, "_start_tarball_checksum",
+                                  side_effect=_start("checksum", 54)), \
+                mock.patch.object(UploadHandler, "start_job", return_value={"job_id": 55}) as mock_upload:
+            resp = self.fetch(
+                self.API_BASE + "/archive_pipeline/testrunfolder",
+                method="POST",
+                body=json_encode({"exclude_dirs": "Thumbnail_Images", "priority": 3}))
+            self.assertEqual(resp.code, 202)
+            json_resp = json.loads(resp.body)
+            self.assertListEqual(json_resp["stages"], ["create_dir", "compress", "checksum_kept", "checksum", "upload"])
+            json_resp = self._poll_phase(json_resp["job_id"], "create_dir")
+            for _ in range(20):
+                if json_resp["phase"] == State.DONE:
+                    break
+                json_resp = self._poll_phase(json_resp["job_id"], json_resp["phase"])
+
+        _, kwargs = mock_create.call_args
+        self.assertEqual(kwargs["exclude_dirs"], ["Thumbnail_Images"])
+        self.assertEqual(kwargs["priority"], 3)
+        mock_upload.assert_called_once_with(self.dummy_config, self.runner_service, "testrunfolder_archive", 3)
+        # checksumming the kept files does not wait for the compression
+        self.assertListEqual(starts, ["create_dir", "compress", "checksum_kept", "checksum"])
+        self.assertEqual(json_resp["phase"], State.DONE)
+        self.assertListEqual(json_resp["child_job_ids"], [51, 52, 53, 54, 55])
+        self.assertDictEqual(
+            json_resp["stages"],
+            {"create_dir": {"state": State.DONE, "job_id": 51},
+             "compress": {"state": State.DONE, "job_id": 52},
+             "checksum_kept": {"state": State.DONE, "job_id": 53},
+             "checksum": {"state": State.DONE, "job_id": 54},
+             "upload": {"state": State.DONE, "job_id": 55}})
+
+    def test_archive_pipeline_invalid_runfolder(self):
+        resp = self.fetch(
+            self.API_BASE + "/archive_pipeline/non-existant", method="POST", body=json_encode({}))
+        self.assertEqual(resp.code, 400)
+
+    @gen_test
+    def test_run_stages_stops_on_failure(self):
+        runner_service = mock.MagicMock()
+        runner_service.status.side_effect = lambda job_id: {1: State.DONE, 2: State.ERROR, 3: State.STARTED}[job_id]
+        upload = mock.MagicMock()
+        stages = [PipelineStage("create_dir", [], None),
+                  PipelineStage("compress", ["create_dir"], lambda: 2),
+                  PipelineStage("checksum_kept", ["create_dir"], lambda: 3),
+                  PipelineStage("upload", ["compress", "checksum_kept"], upload)]
+
+        with mock.patch.object(PipelineHelper, "JOB_POLL_INTERVAL", 0.01):
+            yield PipelineHelper().run_stages(7, stages, runner_service, {"create_dir": 1})
+
+        self.assertFalse(upload.called)
+        runner_service.stop.assert_called_once_with(3)
+        runner_service.fail_phased.assert_called_once_with(7, "the compress stage ended in state error")
+        self.assertFalse(runner_service.finish_phased.called)
+
     @mock.patch("archive_upload.handlers.dsmc_handlers.os.path.isfile", autospec=True)
     def test_rename_log_file_no_file(self, mock_isfile):
         log_directory = "/log/directory/name_archive"
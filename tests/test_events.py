@@ -0,0 +1,72 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from archive_upload.lib.events import JobEventLog, main
+
+
+class TestJobEventLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.event_log = os.path.join(self.tmpdir, "archive.compress.events.jsonl")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_step(self):
+        events = JobEventLog(self.event_log)
+        with events.step("tar_create", engine="gzip") as step:
+            step["bytes"] = 1024
+
+        def _fail():
+            with events.step("remove_files"):
+                raise OSError("Permission denied")
+        self.assertRaises(OSError, _fail)
+
+        start, end, _, failed = JobEventLog.read(self.event_log)
+        self.assertEqual((start["step"], start["event"], start["engine"]), ("tar_create", "start", "gzip"))
+        self.assertEqual((end["step"], end["event"], end["bytes"]), ("tar_create", "end", 1024))
+        self.assertGreaterEqual(end["seconds"], 0)
+        self.assertEqual(failed["error"], "Permission denied")
+
+    def test_without_event_log(self):
+        with JobEventLog().step("md5") as step:
+            step["files"] = 1
+        self.assertListEqual(os.listdir(self.tmpdir), [])
+
+    def test_summarize(self):
+        events = [
+            {"time": 100, "step": "tar_create", "event": "start"},
+            {"time": 160, "step": "tar_create", "event": "end", "seconds": 60, "bytes": 2048},
+            {"time": 160, "step": "tar_list", "event": "start"},
+            {"time": 170, "step": "tar_list", "event": "end", "seconds": 10, "files": 3},
+            {"time": 170, "step": "remove_files", "event": "start"},
+        ]
+        summary = JobEventLog.summarize(events, now=250)
+        self.assertEqual(summary["seconds"], 150)
+        self.assertEqual(summary["slowest_step"], "remove_files")
+        self.assertDictEqual(summary["steps"][0], {
+            "step": "tar_create", "started_at": 100, "ended_at": 160, "seconds": 60, "bytes": 2048})
+        self.assertDictEqual(summary["steps"][2], {
+            "step": "remove_files", "started_at": 170, "seconds": 80, "running": True})
+        self.assertIsNone(JobEventLog.summarize([]))
+
+    def test_read_skips_incomplete_line(self):
+        JobEventLog(self.event_log).emit("md5", JobEventLog.START)
+        with open(self.event_log, "a") as fh:
+            fh.write('{"time": 1')
+        self.assertEqual(len(JobEventLog.read(self.event_log)), 1)
+        self.assertListEqual(JobEventLog.read(os.path.join(self.tmpdir, "missing")), [])
+
+    def test_main(self):
+        list_file = os.path.join(self.tmpdir, "archive.list")
+        returncode = main([self.event_log, "tar_list", "printf 'a\\nb\\n' > {}".format(list_file),
+                           "--count-lines", list_file, "--size-of", list_file])
+        self.assertEqual(returncode, 0)
+        self.assertEqual(main([self.event_log, "remove_files", "exit 3"]), 3)
+
+        steps = JobEventLog.summarize(JobEventLog.read(self.event_log))["steps"]
+        self.assertEqual((steps[0]["files"], steps[0]["bytes"], steps[0]["returncode"]), (2, 4, 0))
+        self.assertEqual(steps[1]["returncode"], 3)
@@ -0,0 +1,41 @@
+import fnmatch
+import os
+import unittest
+
+from archive_upload.lib.exclusion import ExclusionMatcher
+
+
+class TestExclusionMatcher(unittest.TestCase):
+
+    def test_patterns_like_tar_exclude(self):
+        matcher = ExclusionMatcher(["Config", "*.log", "Thumbnail_Images*", "./Data/Intensities/L00?", "a/b"])
+
+        for relpath in ["Config", "Data/Config", "run.log", "Logs/run.log", "Thumbnail_Images_L001",
+                        "Data/Intensities/L001", "Run/Data/Intensities/L001", "a/b", "x/a/b"]:
+            self.assertTrue(matcher.excludes(relpath), relpath)
+        for relpath in ["Configs", "run.log.txt", "Data/Intensities/L0011", "xData/Intensities/L001", "xa/b",
+                        "a/bc", "a/b/c"]:
+            self.assertFalse(matcher.excludes(relpath), relpath)
+
+    def test_same_as_fnmatch(self):
+        patterns = ["*.bcl", "Config", "L00[1-4]", "Data/*/BaseCalls"]
+        matcher = ExclusionMatcher(patterns)
+        for relpath in ["s_1.bcl", "Data/Config", "L003", "L005", "Data/Intensities/BaseCalls",
+                        "Data/BaseCalls", "InterOp"]:
+            expected = any(fnmatch.fnmatch(relpath if "/" in p else os.path.basename(relpath), p) for p in patterns)
+            self.assertEqual(matcher.excludes(relpath), expected, relpath)
+
+    def test_extensions(self):
+        matcher = ExclusionMatcher(extensions=[".bcl", ".fastq.gz", ".cbcl"])
+
+        for name in ["s_1.bcl", "a.fastq.gz", "a.b.fastq.gz", "L001.cbcl"]:
+            self.assertTrue(matcher.has_excluded_extension(name), name)
+            self.assertTrue(matcher.excludes("dir/{}".format(name)), name)
+        # like os.path.splitext, a leading dot is not an extension
+        for name in ["a.gz", "fastq.gz", ".bcl", "bcl", "a.bcl.gz"]:
+            self.assertFalse(matcher.has_excluded_extension(name), name)
+
+    def test_nothing_excluded(self):
+        matcher = ExclusionMatcher()
+        self.assertFalse(matcher.excludes("Config"))
+        self.assertFalse(matcher.has_excluded_extension("a.bcl"))
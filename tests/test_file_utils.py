@@ -1,7 +1,10 @@
 import mock
 import os
+import shutil
+import tempfile
 import unittest
 
+from archive_upload.lib.events import JobEventLog
 from archive_upload.lib.utils import FileUtils
 from tests.test_utils import DummyConfig
 
@@ -25,3 +28,65 @@ class TestFileUtils(unittest.TestCase):
         handler_mock.return_value = tarball_paths
         duplicated_paths = FileUtils.paths_duplicated_in_tarball(None, original)
         self.assertListEqual(tarball_paths, duplicated_paths)
+
+    def test_paths_duplicated_in_list_file(self):
+        root = self.dummy_config["path_to_archive_root"]
+        original = os.path.abspath(os.path.join(root, "testrunfolder_archive_input"))
+        tmpdir = tempfile.mkdtemp()
+        try:
+            list_file = os.path.join(tmpdir, "archive.list")
+            with open(list_file, "w") as fh:
+                fh.write(".\n./file.csv\n./directory2\n./directory2/file.txt\n./not_on_disk\n")
+
+            self.assertListEqual(
+                [os.path.join(original, "file.csv"),
+                 os.path.join(original, "directory2", "file.txt"),
+                 os.path.join(original, "directory2")],
+                FileUtils.paths_duplicated_in_list_file(list_file, original))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_remove_paths_duplicated_in_list_file(self):
+        root = self.dummy_config["path_to_archive_root"]
+        tmpdir = tempfile.mkdtemp()
+        try:
+            archive = os.path.join(tmpdir, "archive")
+            shutil.copytree(os.path.join(root, "testrunfolder_archive_input"), archive)
+            os.symlink(os.path.join(archive, "directory3"), os.path.join(archive, "link_to_directory3"))
+            list_file = os.path.join(tmpdir, "archive.list")
+            with open(list_file, "w") as fh:
+                # directory2 is only partially in the tarball, so it should be kept
+                fh.write(".\n./file.bin\n./directory2\n./directory2/file.txt\n./link_to_directory3\n")
+
+            removed = FileUtils.remove_paths_duplicated_in_list_file(list_file, archive)
+
+            self.assertEqual((3, 0), removed)
+            self.assertListEqual(
+                sorted(["directory2", "directory3", "file.csv", "file.txt"]),
+                sorted(os.listdir(archive)))
+            self.assertListEqual(["file.bin"], os.listdir(os.path.join(archive, "directory2")))
+            self.assertListEqual(["file.zip"], os.listdir(os.path.join(archive, "directory3")))
+
+            # once the remaining file is gone, the empty directory is removed as well
+            with open(list_file, "a") as fh:
+                fh.write("./directory2/file.bin\n")
+            event_log = os.path.join(tmpdir, "events.jsonl")
+            self.assertEqual((1, 1), FileUtils.remove_paths_duplicated_in_list_file(
+                list_file, archive, events=JobEventLog(event_log)))
+            self.assertFalse(os.path.exists(os.path.join(archive, "directory2")))
+
+            # the listing and the removal of files and of directories are separate steps
+            steps = JobEventLog.summarize(JobEventLog.read(event_log))["steps"]
+            self.assertListEqual(["list_tarballed", "remove_files", "remove_dirs"], [s["step"] for s in steps])
+            self.assertEqual(steps[1]["files"], 1)
+            self.assertEqual(steps[2]["dirs"], 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_balanced_shards(self):
+        sizes = {"a": 10, "b": 7, "c": 5, "d": 4, "e": 3, "f": 0}
+        shards = FileUtils.balanced_shards(sizes, 3)
+
+        self.assertListEqual(sorted(sum(shards, [])), sorted(sizes.keys()))
+        self.assertListEqual(sorted(sum(sizes[p] for p in shard) for shard in shards), [9, 10, 10])
+        self.assertListEqual(FileUtils.balanced_shards({"a": 1}, 3), [["a"]])
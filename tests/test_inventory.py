@@ -0,0 +1,78 @@
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from archive_upload.lib.inventory import ArchiveInventory
+
+
+class TestArchiveInventory(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.inventory = ArchiveInventory(os.path.join(self.tmpdir, "inventory.sqlite"))
+        self.archive = "/data/runfolders/run_archive"
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_latest_completed_upload(self):
+        self.assertIsNone(self.inventory.latest_description(self.archive))
+
+        self.inventory.record_files(self.archive, "first", {self.archive + "/a": 1, self.archive + "/b": 2})
+        self.inventory.record_upload(self.archive, "failed")
+        self.inventory.set_state("failed", ArchiveInventory.FAILED)
+        self.inventory.record_upload(self.archive, "in progress")
+        self.inventory.record_files("/data/runfolders/other_archive", "other", {"/data/runfolders/other_archive/a": 1})
+
+        self.assertEqual(self.inventory.latest_description(self.archive + "/"), "first")
+        self.assertDictEqual(self.inventory.uploaded_files("first"), {self.archive + "/a": 1, self.archive + "/b": 2})
+
+    def test_record_files(self):
+        self.inventory.record_upload(self.archive, "descr")
+        self.inventory.record_files(self.archive, "descr", {self.archive + "/a": 1, self.archive + "/b": 2})
+
+        # a reupload adds to the files of the upload
+        self.inventory.record_files(self.archive, "descr", {self.archive + "/b": 3, self.archive + "/c": 4})
+        self.assertDictEqual(
+            self.inventory.uploaded_files("descr"),
+            {self.archive + "/a": 1, self.archive + "/b": 3, self.archive + "/c": 4})
+
+        # the filelist from PDC replaces them
+        self.inventory.record_files(self.archive, "descr", {self.archive + "/a": 1}, replace=True, source="pdc")
+        self.assertDictEqual(self.inventory.uploaded_files("descr"), {self.archive + "/a": 1})
+        self.assertEqual(self.inventory.latest_description(self.archive), "descr")
+
+    def test_record_checksums(self):
+        self.inventory.record_files(
+            self.archive, "descr", {self.archive + "/a": 1, self.archive + "/b": 2},
+            checksums={self.archive + "/a": "0cc175b9c0f1b6a831c399e269772661"})
+        self.assertDictEqual(
+            self.inventory.uploaded_checksums("descr"), {self.archive + "/a": "0cc175b9c0f1b6a831c399e269772661"})
+
+        # a reupload without checksums forgets the checksum of the reuploaded file
+        self.inventory.record_files(self.archive, "descr", {self.archive + "/a": 1})
+        self.assertDictEqual(self.inventory.uploaded_checksums("descr"), {})
+
+    def test_add_checksums_to_old_inventory(self):
+        db_file = os.path.join(self.tmpdir, "old.sqlite")
+        conn = sqlite3.connect(db_file)
+        with conn:
+            conn.execute("CREATE TABLE files (description TEXT NOT NULL, path TEXT NOT NULL, "
+                         "size INTEGER NOT NULL, PRIMARY KEY (description, path))")
+            conn.execute("INSERT INTO files VALUES ('descr', '/a', 1)")
+        conn.close()
+
+        inventory = ArchiveInventory(db_file)
+        self.assertDictEqual(inventory.uploaded_files("descr"), {"/a": 1})
+        inventory.record_files("/", "descr", {"/b": 2}, checksums={"/b": "92eb5ffee6ae2fec3ad71c777531578f"})
+        self.assertDictEqual(inventory.uploaded_checksums("descr"), {"/b": "92eb5ffee6ae2fec3ad71c777531578f"})
+
+    def test_from_config(self):
+        config = {"log_directory": self.tmpdir}
+        self.assertIsNone(ArchiveInventory.from_config(config))
+        config["inventory"] = {"enabled": True}
+        self.assertEqual(
+            ArchiveInventory.from_config(config).db_file,
+            os.path.join(self.tmpdir, "inventory.sqlite"))
@@ -0,0 +1,395 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from arteria.web.state import State
+
+from archive_upload.lib import metrics
+from archive_upload.lib.events import JobEventLog
+from archive_upload.lib.jobrunner import LocalQAdapter, PhasedJob, Status
+from archive_upload.lib.jobstore import JobStore
+from archive_upload.lib.resources import ResourcePool
+from tests.test_utils import TestUtils
+
+
+class TestPhasedJob(unittest.TestCase):
+
+    def test_state(self):
+        job = PhasedJob(1, "planning")
+        self.assertEqual(job.state([]), State.STARTED)
+        self.assertEqual(job.state([State.DONE, State.PENDING]), State.PENDING)
+        self.assertEqual(job.state([State.STARTED, State.PENDING]), State.STARTED)
+        self.assertEqual(job.state([State.DONE, State.DONE]), State.DONE)
+        self.assertEqual(job.state([State.STARTED, State.ERROR]), State.ERROR)
+
+        job.failed = True
+        self.assertEqual(job.state([State.DONE]), State.ERROR)
+
+    def test_state_of_open_ended_job(self):
+        job = PhasedJob(1, "create_dir")
+        job.finished = False
+        self.assertEqual(job.state([State.DONE, State.DONE]), State.STARTED)
+        self.assertEqual(job.state([State.DONE, State.ERROR]), State.ERROR)
+
+        job.finished = True
+        self.assertEqual(job.state([State.DONE, State.DONE]), State.DONE)
+
+
+class TestLocalQAdapter(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch("archive_upload.lib.jobrunner.LocalQServer", autospec=True)
+        self.mock_server_class = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.runner = LocalQAdapter(nbr_of_cores=2, whitelisted_warnings=[], interval=2)
+        self.server = self.mock_server_class.return_value
+
+    def test_job_ids_are_mapped_to_localq_ids(self):
+        self.server.add.return_value = 17
+        job_id = self.runner.start("true", 1, "/tmp")
+        phased_job_id = self.runner.start_phased("planning")
+
+        self.assertNotEqual(job_id, phased_job_id)
+        self.runner.stop(job_id)
+        self.server.stop_job_with_id.assert_called_once_with(17)
+        self.assertEqual(self.runner.status(1000), State.NONE)
+
+    def test_progress(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            progress_file = os.path.join(tmpdir, "progress.json")
+            self.server.add.return_value = 17
+            self.server.get_status.return_value = Status.RUNNING
+            job_id = self.runner.start("true", 1, tmpdir, job_type="create_dir", progress_file=progress_file)
+            self.assertNotIn("progress", self.runner.status_details(job_id))
+
+            with open(progress_file, "w") as fh:
+                fh.write('{"dirs": 3, "links": 10}')
+            self.assertDictEqual(self.runner.status_details(job_id)["progress"], {"dirs": 3, "links": 10})
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_dsmc_progress(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.server.add.side_effect = iter([17, 18])
+            self.server.get_status.return_value = Status.RUNNING
+            outputs = [os.path.join(tmpdir, "dsmc_output.shard{}".format(i)) for i in [1, 2]]
+            job_id = self.runner.start_phased("planning", job_type="upload")
+            for output in outputs:
+                child_job_id = self.runner.start("dsmc archive", 1, tmpdir, stdout=output, dsmc_output=output)
+                self.runner.set_phase(job_id, "uploading", child_job_id=child_job_id)
+            self.assertNotIn("progress", self.runner.status_details(child_job_id))
+            self.assertNotIn("progress", self.runner.status_details(job_id))
+
+            for output in outputs:
+                with open(output, "w") as fh:
+                    fh.write("Normal File-->      1,024 /data/run_archive/a [Sent]\n")
+            progress = self.runner.status_details(child_job_id)["progress"]
+            self.assertEqual(progress["objects_archived"], 1)
+            self.assertEqual(progress["bytes_transferred"], 1024)
+            self.assertIsNotNone(progress["elapsed_seconds"])
+
+            # the sessions of the phased job are summed
+            self.assertEqual(self.runner.status_details(job_id)["progress"]["bytes_transferred"], 2048)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_events(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.server.add.side_effect = iter([17, 18])
+            event_logs = [os.path.join(tmpdir, "archive.{}.events.jsonl".format(job)) for job in ["compress", "checksum"]]
+            job_id = self.runner.start_phased("create_dir", job_type="pipeline", open_ended=True)
+            for event_log in event_logs:
+                child_job_id = self.runner.start("true", 1, tmpdir, event_log=event_log)
+                self.runner.set_phase(job_id, "compress", child_job_id=child_job_id)
+            self.assertNotIn("events", self.runner.status_details(child_job_id))
+
+            JobEventLog(event_logs[0]).emit("tar_create", JobEventLog.START)
+            JobEventLog(event_logs[0]).emit("tar_create", JobEventLog.END, seconds=60, bytes=1024)
+            JobEventLog(event_logs[1]).emit("md5", JobEventLog.START)
+            JobEventLog(event_logs[1]).emit("md5", JobEventLog.END, seconds=5, files=2)
+
+            events = self.runner.status_details(child_job_id)["events"]
+            self.assertListEqual([step["step"] for step in events["steps"]], ["md5"])
+            self.assertEqual(events["steps"][0]["files"], 2)
+
+            # the steps of the jobs of a phased job are summarised together
+            events = self.runner.status_details(job_id)["events"]
+            self.assertListEqual([step["step"] for step in events["steps"]], ["tar_create", "md5"])
+            self.assertEqual(events["slowest_step"], "tar_create")
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_metrics(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            hashed_before = metrics.BYTES_PROCESSED.value(operation="hashed")
+            uploaded_before = metrics.BYTES_PROCESSED.value(operation="uploaded")
+            warnings_before = metrics.DSMC_WARNINGS.value(code="ANS1809W")
+            run_before = metrics.JOB_RUN_TIME.count(job_type="checksum", state=State.DONE)
+
+            progress_file = os.path.join(tmpdir, "progress.json")
+            dsmc_output = os.path.join(tmpdir, "dsmc_output")
+            with open(progress_file, "w") as fh:
+                fh.write('{"files": 2, "bytes_hashed": 2048, "done": true}')
+            with open(dsmc_output, "w") as fh:
+                fh.write("Normal File-->      1,024 /data/run_archive/a [Sent]\nANS1809W Session lost\n")
+            self.server.add.side_effect = iter([17, 18])
+            checksum_job_id = self.runner.start(
+                "checksum", 2, tmpdir, job_type="checksum", progress_file=progress_file)
+            upload_job_id = self.runner.start("dsmc archive", 1, tmpdir, job_type="upload", dsmc_output=dsmc_output)
+
+            self.server.get_status_all.return_value = {17: Status.RUNNING, 18: Status.PENDING}
+            self.assertDictEqual(self.runner.slots(), {"total": 2, "used": 2})
+
+            self.server.get_status.return_value = Status.RUNNING
+            self.assertEqual(self.runner.status(checksum_job_id), State.STARTED)
+            self.server.get_status.return_value = Status.COMPLETED
+            self.assertEqual(self.runner.status(checksum_job_id), State.DONE)
+            self.assertEqual(self.runner.status(upload_job_id), State.DONE)
+            # the bytes and warnings of a job are only counted once
+            self.assertEqual(self.runner.status(upload_job_id), State.DONE)
+
+            self.assertEqual(metrics.BYTES_PROCESSED.value(operation="hashed") - hashed_before, 2048)
+            self.assertEqual(metrics.BYTES_PROCESSED.value(operation="uploaded") - uploaded_before, 1024)
+            self.assertEqual(metrics.DSMC_WARNINGS.value(code="ANS1809W") - warnings_before, 1)
+            self.assertEqual(metrics.JOB_RUN_TIME.count(job_type="checksum", state=State.DONE) - run_before, 1)
+            self.assertDictEqual(self.runner.slots(), {"total": 2, "used": 0})
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_final_state_is_set_once(self):
+        run_before = metrics.JOB_RUN_TIME.count(job_type="checksum", state=State.DONE)
+        self.server.add.return_value = 17
+        job_id = self.runner.start("checksum", 1, "/tmp", job_type="checksum")
+
+        # e.g. the scheduler thread and a status request both seeing that the job has terminated
+        self.assertEqual(self.runner._set_final_state(job_id, State.DONE), State.DONE)
+        self.assertEqual(self.runner._set_final_state(job_id, State.ERROR), State.DONE)
+        self.assertEqual(self.runner.status(job_id), State.DONE)
+        self.assertEqual(metrics.JOB_RUN_TIME.count(job_type="checksum", state=State.DONE) - run_before, 1)
+
+    def test_phased_job(self):
+        job_id = self.runner.start_phased("planning", archive="foo")
+        self.assertEqual(self.runner.status(job_id), State.STARTED)
+        self.assertDictEqual(
+            {"phase": "planning", "archive": "foo", "child_job_ids": []},
+            self.runner.status_details(str(job_id)))
+
+        self.server.add.return_value = 17
+        child_job_id = self.runner.start("dsmc archive", 1, "/tmp")
+        self.runner.set_phase(job_id, "uploading", child_job_id=child_job_id)
+
+        # the state of the phased job now follows the child job
+        self.server.get_status.return_value = Status.RUNNING
+        self.assertEqual(self.runner.status(job_id), State.STARTED)
+        self.server.get_status.assert_called_with(17)
+        self.assertEqual(self.runner.status_details(job_id)["phase"], "uploading")
+        self.assertListEqual(self.runner.status_details(job_id)["child_job_ids"], [child_job_id])
+
+        self.runner.fail_phased(job_id, "nothing to reupload")
+        self.assertEqual(self.runner.status(job_id), State.ERROR)
+        self.assertEqual(self.runner.status_details(job_id)["message"], "nothing to reupload")
+        self.server.get_status_all.return_value = {17: Status.RUNNING}
+        self.assertDictEqual({child_job_id: State.STARTED, job_id: State.ERROR}, self.runner.status_all())
+
+    def test_dsmc_warnings(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            log_file = os.path.join(tmpdir, "dsmc_output")
+            with open(log_file, "w") as fh:
+                fh.write("ANS1809W Session lost\nANS2250W TSM core file found\n")
+            self.runner.whitelisted_warnings = ["ANS1809W", "ANS2250W"]
+            self.server.add.return_value = 17
+            self.server.get_status.return_value = Status.FAILED
+            job = self.server.get_job_with_id.return_value
+            job.cmd = "dsmc archive /data/archive/"
+            job.stdout = log_file
+            job.proc.returncode = 8
+
+            job_id = self.runner.start(job.cmd, 1, tmpdir)
+            self.assertEqual(self.runner.status(job_id), State.DONE)
+
+            # the job has terminated, so its log is not read again
+            os.unlink(log_file)
+            self.assertEqual(self.runner.status(job_id), State.DONE)
+            self.assertDictEqual({job_id: State.DONE}, self.runner.status_all())
+            self.assertEqual(self.server.get_job_with_id.call_count, 1)
+
+            with open(log_file, "w") as fh:
+                fh.write("ANS1809W Session lost\nANS4037W Object changed during processing\n")
+            job_id = self.runner.start(job.cmd, 1, tmpdir)
+            self.server.get_status_all.return_value = {17: Status.FAILED}
+            self.assertDictEqual({job_id - 1: State.DONE, job_id: State.ERROR}, self.runner.status_all())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_status_all_filters(self):
+        self.server.add.side_effect = iter([11, 12, 13])
+        upload_job_id = self.runner.start("dsmc archive a/", 1, "/tmp", job_type="upload", archive="a")
+        checksum_job_id = self.runner.start("md5sum", 1, "/tmp", job_type="checksum", archive="a")
+        reupload_job_id = self.runner.start_phased("planning", job_type="reupload", archive="b")
+        child_job_id = self.runner.start("dsmc archive", 1, "/tmp")
+        self.runner.set_phase(reupload_job_id, "uploading", child_job_id=child_job_id)
+        self.server.get_status_all.return_value = {11: Status.COMPLETED, 12: Status.RUNNING, 13: Status.RUNNING}
+
+        self.assertDictEqual(
+            {upload_job_id: State.DONE, checksum_job_id: State.STARTED}, self.runner.status_all(archive="a"))
+        self.assertDictEqual({reupload_job_id: State.STARTED, child_job_id: State.STARTED},
+                             self.runner.status_all(job_type="reupload"))
+        self.assertDictEqual({checksum_job_id: State.STARTED, reupload_job_id: State.STARTED},
+                             self.runner.status_all(state=State.STARTED, limit=2))
+        self.assertDictEqual({reupload_job_id: State.STARTED, child_job_id: State.STARTED},
+                             self.runner.status_all(offset=2))
+
+        # the states of all LocalQ jobs are fetched at most once per call
+        self.assertEqual(self.server.get_status_all.call_count, 4)
+        self.assertFalse(self.server.get_status.called)
+
+        self.server.get_status.return_value = Status.RUNNING
+        self.assertEqual(self.runner.status_details(child_job_id), {"job_type": "reupload", "archive": "b"})
+
+
+    def test_restore_jobs_from_job_store(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            store = JobStore(os.path.join(tmpdir, "jobs.sqlite"), os.path.join(tmpdir, "jobs"))
+            runner = LocalQAdapter(nbr_of_cores=2, whitelisted_warnings=["ANS1809W"], job_store=store)
+            self.server.add.side_effect = iter([11, 12, 13])
+            log_file = os.path.join(tmpdir, "dsmc_output")
+            done_job_id = runner.start("true", 1, tmpdir, job_type="checksum", archive="a")
+            running_job_id = runner.start("dsmc archive a/", 1, tmpdir, stdout=log_file, archive="a")
+            pending_job_id = runner.start("true", 1, tmpdir)
+            planning_job_id = runner.start_phased("planning", job_type="reupload", archive="a")
+            pipeline_job_id = runner.start_phased("create_dir", job_type="pipeline", archive="b", open_ended=True)
+            runner.set_phase(pipeline_job_id, "compress", child_job_id=done_job_id, stages={})
+
+            self.assertIn("dsmc archive a/", self.server.add.call_args_list[1][0][0])
+            self.server.get_status.return_value = Status.COMPLETED
+            self.assertEqual(runner.status(done_job_id), State.DONE)
+            with open(os.path.join(store.directory, "{}.pid".format(running_job_id)), "w") as fh:
+                fh.write("{}\n".format(os.getpid()))
+
+            # the service is restarted
+            runner = LocalQAdapter(nbr_of_cores=2, whitelisted_warnings=["ANS1809W"], job_store=store)
+            self.assertEqual(runner.status(done_job_id), State.DONE)
+            self.assertEqual(runner.status(running_job_id), State.STARTED)
+            self.assertEqual(store.job(running_job_id)["pid"], os.getpid())
+            self.assertEqual(runner.status(pending_job_id), State.ERROR)
+            self.assertEqual(runner.status_details(pending_job_id)["message"], LocalQAdapter.INTERRUPTED_MESSAGE)
+            self.assertEqual(runner.status(planning_job_id), State.ERROR)
+            # the service was still adding jobs to the pipeline
+            self.assertEqual(runner.status(pipeline_job_id), State.ERROR)
+            self.assertDictEqual(runner.status_details(pipeline_job_id)["stages"], {})
+            self.assertDictEqual({done_job_id: State.DONE, running_job_id: State.STARTED, planning_job_id: State.ERROR},
+                                 runner.status_all(archive="a"))
+
+            # the reattached job finishes with a whitelisted dsmc warning
+            with open(log_file, "w") as fh:
+                fh.write("ANS1809W Session lost\n")
+            with open(os.path.join(store.directory, "{}.exit".format(running_job_id)), "w") as fh:
+                fh.write("8\n")
+            self.assertEqual(runner.status(running_job_id), State.DONE)
+            self.assertEqual(store.job(running_job_id)["state"], State.DONE)
+
+            # new jobs do not reuse the ids of the restored jobs
+            self.server.add.side_effect = iter([1])
+            self.assertEqual(runner.start("true", 1, tmpdir), pipeline_job_id + 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_jobs_wait_for_resources(self):
+        self.runner.resource_pool = ResourcePool({"tsm_session": 1, "disk": 1})
+        self.server.add.side_effect = iter([11, 12, 13, 14])
+        upload_resources = {"tsm_session": 1, "disk:/data": 1}
+        upload_job_id = self.runner.start("dsmc archive a/", 1, "/tmp", resources=upload_resources)
+        second_upload_job_id = self.runner.start("dsmc archive b/", 1, "/tmp", resources=upload_resources)
+        other_volume_job_id = self.runner.start("md5sum", 1, "/tmp", resources={"disk:/other": 1})
+        unlimited_job_id = self.runner.start("true", 1, "/tmp")
+
+        # only the second upload has to wait
+        self.assertEqual(self.server.add.call_count, 3)
+        self.assertEqual(self.runner.status(second_upload_job_id), State.PENDING)
+        self.assertListEqual(
+            self.runner.status_details(second_upload_job_id)["waiting_for"], ["disk:/data", "tsm_session"])
+        self.server.get_status_all.return_value = {11: Status.RUNNING, 12: Status.RUNNING, 13: Status.RUNNING}
+        self.runner.schedule()
+        self.assertEqual(self.server.add.call_count, 3)
+
+        # it is started once the first upload has finished
+        self.server.get_status_all.return_value = {11: Status.COMPLETED, 12: Status.RUNNING, 13: Status.RUNNING}
+        self.runner.schedule()
+        self.assertEqual(self.server.add.call_count, 4)
+        self.assertEqual(self.server.add.call_args[0][0], "dsmc archive b/")
+        self.server.get_status.return_value = Status.RUNNING
+        self.assertEqual(self.runner.status(second_upload_job_id), State.STARTED)
+        self.assertDictEqual(dict(self.runner.resource_pool.in_use),
+                             {"tsm_session": 1, "disk:/data": 1, "disk:/other": 1})
+        self.assertNotEqual(other_volume_job_id, unlimited_job_id)
+
+    def test_cancel_job_waiting_for_resources(self):
+        self.runner.resource_pool = ResourcePool({"tsm_session": 1})
+        self.server.add.return_value = 11
+        self.runner.start("dsmc archive a/", 1, "/tmp", resources={"tsm_session": 1})
+        job_id = self.runner.start("dsmc archive b/", 1, "/tmp", resources={"tsm_session": 1})
+
+        self.runner.stop(job_id)
+        self.assertEqual(self.runner.status(job_id), State.CANCELLED)
+        self.assertEqual(self.server.add.call_count, 1)
+
+    def test_runner_with_features_enabled(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            config = dict(TestUtils.DUMMY_CONFIG, **TestUtils.enabled_features_config(tmpdir))
+            # as the runner is created by the app
+            runner = LocalQAdapter(
+                nbr_of_cores=2, whitelisted_warnings=[], priority_method=config["scheduling"]["method"],
+                job_store=JobStore.from_config(config), resource_pool=ResourcePool.from_config(config))
+            self.assertEqual(runner.resource_pool.limits, {"cores": 2, "tsm_session": 2, "disk": 1})
+            self.server.add.side_effect = iter([11, 12])
+            self.server.get_status_all.return_value = {11: Status.RUNNING}
+
+            disk = ResourcePool.disk(tmpdir)
+            running_job_id = runner.start("dsmc archive a/", 1, tmpdir, resources={"tsm_session": 1, disk: 1})
+            job_id = runner.start("md5sum", 1, tmpdir, resources={disk: 1})
+            self.assertEqual(self.server.add.call_count, 1)
+            self.assertDictEqual(runner.status_details(job_id), {"waiting_for": [disk], "queue_position": 1})
+            self.assertEqual(runner.job_store.job(job_id)["state"], State.PENDING)
+
+            self.server.get_status.return_value = Status.COMPLETED
+            self.assertEqual(runner.status(running_job_id), State.DONE)
+            runner.schedule()
+            self.assertEqual(self.server.add.call_count, 2)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_fair_share_queueing(self):
+        runner = LocalQAdapter(nbr_of_cores=1, whitelisted_warnings=[], priority_method="fair_share")
+        self.assertEqual(runner.resource_pool.limits, {"cores": 1})
+        self.server.add.side_effect = iter([11, 12, 13, 14])
+        self.server.get_status.return_value = Status.RUNNING
+        self.server.get_status_all.return_value = {11: Status.RUNNING}
+
+        running_job_id = runner.start("tar", 2, "/tmp", archive="run1")
+        batch_job_ids = [runner.start("md5sum", 1, "/tmp", archive="run1") for _ in range(2)]
+        other_job_id = runner.start("md5sum", 1, "/tmp", archive="run2")
+        urgent_job_id = runner.start("dsmc archive", 1, "/tmp", archive="run1", priority=10)
+
+        self.assertEqual(self.server.add.call_count, 1)
+        self.assertEqual(runner.status(urgent_job_id), State.PENDING)
+        self.assertEqual(
+            [runner.status_details(job_id)["queue_position"] for job_id in batch_job_ids + [other_job_id]],
+            [3, 4, 2])
+        self.assertDictEqual(
+            runner.status_details(urgent_job_id),
+            {"archive": "run1", "waiting_for": ["cores"], "queue_position": 1})
+        self.assertNotIn("queue_position", runner.status_details(running_job_id))
+
+        self.server.get_status_all.return_value = {11: Status.COMPLETED}
+        runner.schedule()
+        self.assertEqual(self.server.add.call_args[0][0], "dsmc archive")
+        self.assertEqual(runner.status_details(other_job_id)["queue_position"], 1)
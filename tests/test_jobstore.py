@@ -0,0 +1,53 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import unittest
+
+from arteria.web.state import State
+
+from archive_upload.lib.jobstore import JobStore
+
+
+class TestJobStore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.store = JobStore(os.path.join(self.tmpdir, "jobs.sqlite"), os.path.join(self.tmpdir, "jobs"))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_record_and_update_jobs(self):
+        self.assertEqual(self.store.next_job_id(), 1)
+        self.store.record_job(1, State.PENDING, cmd="dsmc archive a/", archive="a", job_type="upload")
+        self.store.record_job(2, State.STARTED, details={"shards": 2}, phase="planning", archive="b")
+        self.store.update_job(1, state=State.STARTED, pid=1234, parent_job_id=2)
+        self.store.update_job(2, details={"shards": 3}, phase="uploading")
+
+        self.assertEqual(self.store.next_job_id(), 3)
+        job = self.store.job(1)
+        self.assertEqual((job["state"], job["pid"], job["parent_job_id"], job["cmd"]),
+                         (State.STARTED, 1234, 2, "dsmc archive a/"))
+        self.assertEqual(self.store.job(2)["details"], {"shards": 3})
+        self.assertEqual([job["job_id"] for job in self.store.jobs(archive="b")], [2])
+        self.assertIsNone(self.store.job(3))
+
+        with self.assertRaises(ValueError):
+            self.store.update_job(1, no_such_column=1)
+
+        # the store is opened again after a restart
+        store = JobStore(self.store.db_file, self.store.directory)
+        self.assertEqual([job["job_id"] for job in store.jobs()], [1, 2])
+
+    def test_wrap_cmd(self):
+        cmd = self.store.wrap_cmd(7, "echo 'hello world' && exit 8")
+        proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE)
+        output = proc.communicate()[0]
+
+        self.assertEqual(output, "hello world\n")
+        self.assertEqual(proc.returncode, 8)
+        self.assertEqual(self.store.pid(7), proc.pid)
+        self.assertEqual(self.store.exit_code(7), 8)
+        self.assertIsNone(self.store.exit_code(8))
+        self.assertTrue(JobStore.is_running(os.getpid()))
@@ -0,0 +1,95 @@
+import mock
+import os
+import shutil
+import tempfile
+import unittest
+
+from archive_upload.lib.checksums import ChecksumUtils
+from archive_upload.lib.manifest import ArchiveManifest
+from archive_upload.lib.utils import FileUtils
+
+
+class TestArchiveManifest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmpdir, "run_archive")
+        self.manifest_file = os.path.join(self.tmpdir, "manifests", "run_archive.manifest.json")
+        for d in ["Config", "Data/Intensities", "InterOp"]:
+            os.makedirs(os.path.join(self.archive, d))
+        for f, content in [("RunInfo.xml", "runinfo"), ("Config/a.cfg", "config"),
+                           ("Data/Intensities/s_1.bcl", "bcl" * 100), ("InterOp/x.bin", "")]:
+            with open(os.path.join(self.archive, f), "w") as fh:
+                fh.write(content)
+        os.symlink(os.path.join(self.archive, "Data"), os.path.join(self.archive, "Data_link"))
+        os.symlink(self.archive, os.path.join(self.archive, "InterOp", "loop"))
+        # the tree is modified within the mtime resolution of the test, don't treat directories as racy
+        patcher = mock.patch("archive_upload.lib.manifest.RACY_MTIME_WINDOW", -60)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _refreshed_manifest(self):
+        manifest = ArchiveManifest.load(self.archive, self.manifest_file)
+        listed = manifest.refresh()
+        manifest.save()
+        return manifest, listed
+
+    def test_matches_listing_of_archive(self):
+        manifest, listed = self._refreshed_manifest()
+
+        self.assertEqual(listed, 7)
+        self.assertListEqual(
+            manifest.all_paths(),
+            FileUtils.list_all_paths(self.archive))
+        self.assertDictEqual(
+            manifest.local_files(),
+            {os.path.join(self.archive, f): s for f, s in [
+                ("RunInfo.xml", 7), ("Config/a.cfg", 6), ("Data/Intensities/s_1.bcl", 300), ("InterOp/x.bin", 0)]})
+        self.assertListEqual(
+            sorted(os.path.join(self.archive, f) for f, _ in manifest.regular_files()),
+            sorted(f for f, _ in ChecksumUtils.files_to_checksum(self.archive)))
+
+    def test_only_modified_directories_are_listed(self):
+        self._refreshed_manifest()
+        manifest, listed = self._refreshed_manifest()
+        self.assertEqual(listed, 0)
+
+        os.unlink(os.path.join(self.archive, "Config", "a.cfg"))
+        manifest, listed = self._refreshed_manifest()
+
+        self.assertEqual(listed, 1)
+        self.assertNotIn(os.path.join(self.archive, "Config", "a.cfg"), manifest.local_files())
+
+    def test_checksums_are_reused_for_unchanged_files(self):
+        with mock.patch.object(
+                ChecksumUtils, "_checksum_files", side_effect=ChecksumUtils._checksum_files) as mock_checksum_files:
+            first = ChecksumUtils.checksum_archive(self.archive, manifest_file=self.manifest_file)
+            with open(os.path.join(self.archive, "Data", "Intensities", "s_1.bcl"), "w") as fh:
+                fh.write("changed")
+            second = ChecksumUtils.checksum_archive(self.archive, manifest_file=self.manifest_file)
+
+        checksummed = [call[0][0] for call in mock_checksum_files.call_args_list]
+        self.assertEqual(len(checksummed[0]), 5)
+        # the modified file is reached both directly and through the symlinked directory
+        self.assertListEqual(sorted(checksummed[1]), [
+            os.path.join(self.archive, "Data", "Intensities", "s_1.bcl"),
+            os.path.join(self.archive, "Data_link", "Intensities", "s_1.bcl")])
+        self.assertDictEqual(
+            second,
+            ChecksumUtils.checksum_archive(self.archive))
+        self.assertNotEqual(first["./Data/Intensities/s_1.bcl"], second["./Data/Intensities/s_1.bcl"])
+
+    def test_load_ignores_other_archives(self):
+        self._refreshed_manifest()
+        manifest = ArchiveManifest.load(os.path.join(self.tmpdir, "other_archive"), self.manifest_file)
+        self.assertDictEqual(manifest.files, {})
+
+    def test_manifest_file_from_config(self):
+        config = {"log_directory": "/tmp/logs"}
+        self.assertIsNone(ArchiveManifest.manifest_file_from_config(config, self.archive))
+        config["manifest"] = {"enabled": True}
+        manifest_file = ArchiveManifest.manifest_file_from_config(config, self.archive)
+        self.assertTrue(manifest_file.startswith("/tmp/logs/manifests/run_archive."))
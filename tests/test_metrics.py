@@ -0,0 +1,53 @@
+import unittest
+
+from archive_upload.lib.metrics import MetricsRegistry
+
+
+class TestMetricsRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counter(self):
+        counter = self.registry.counter("bytes_total", "Bytes processed")
+        counter.inc(10, operation="hashed")
+        counter.inc(5, operation="hashed")
+        counter.inc(operation="uploaded")
+        self.assertEqual(counter.value(operation="hashed"), 15)
+        self.assertRaises(ValueError, counter.inc, -1, operation="hashed")
+
+        self.assertEqual(self.registry.render(), "\n".join([
+            "# HELP bytes_total Bytes processed",
+            "# TYPE bytes_total counter",
+            "bytes_total{operation=\"hashed\"} 15",
+            "bytes_total{operation=\"uploaded\"} 1",
+        ]) + "\n")
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("duration_seconds", "Durations", [1, 0.5])
+        for value in [0.1, 0.5, 0.7, 3]:
+            histogram.observe(value, job_type="upload")
+        self.assertEqual(histogram.count(job_type="upload"), 4)
+        self.assertEqual(histogram.count(job_type="compress"), 0)
+
+        self.assertEqual(self.registry.render().splitlines()[2:], [
+            "duration_seconds_bucket{job_type=\"upload\",le=\"0.5\"} 2",
+            "duration_seconds_bucket{job_type=\"upload\",le=\"1\"} 3",
+            "duration_seconds_bucket{job_type=\"upload\",le=\"+Inf\"} 4",
+            "duration_seconds_sum{job_type=\"upload\"} 4.3",
+            "duration_seconds_count{job_type=\"upload\"} 4",
+        ])
+
+    def test_gauge_and_escaping(self):
+        gauge = self.registry.gauge("slots", "Cores\nin use")
+        gauge.set(2, state="used")
+        gauge.set(1, state="used")
+        gauge.set(0, state="a \"quoted\\\" value")
+        self.assertEqual(gauge.value(state="used"), 1)
+
+        self.assertEqual(self.registry.render().splitlines(), [
+            "# HELP slots Cores\\nin use",
+            "# TYPE slots gauge",
+            "slots{state=\"a \\\"quoted\\\\\\\" value\"} 0",
+            "slots{state=\"used\"} 1",
+        ])
@@ -0,0 +1,56 @@
+import mock
+
+from arteria.web.state import State
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from archive_upload.lib.notifications import JobWatcher
+
+
+class TestJobWatcher(AsyncTestCase):
+
+    def setUp(self):
+        super(TestJobWatcher, self).setUp()
+        self.runner_service = mock.MagicMock()
+        self.runner_service.status_details.return_value = {}
+        self.watcher = JobWatcher(self.runner_service, poll_interval=0.01)
+
+    @gen_test
+    def test_wait_for_change(self):
+        self.runner_service.status.side_effect = iter([State.PENDING, State.STARTED])
+        state = yield self.watcher.wait_for_change(1, State.PENDING, timeout=5)
+        self.assertEqual(state, State.STARTED)
+
+    @gen_test
+    def test_wait_for_change_times_out(self):
+        self.runner_service.status.return_value = State.STARTED
+        state = yield self.watcher.wait_for_change(1, State.STARTED, timeout=0.05)
+        self.assertEqual(state, State.STARTED)
+
+        # nothing is watched once no one is waiting
+        yield gen.sleep(0.05)
+        self.assertDictEqual(self.watcher._states, {})
+
+    @gen_test
+    def test_wait_for_finished_job(self):
+        state = yield self.watcher.wait_for_change(1, State.DONE, timeout=5)
+        self.assertEqual(state, State.DONE)
+        self.assertFalse(self.runner_service.status.called)
+
+    @gen_test
+    def test_callbacks(self):
+        self.runner_service.status.side_effect = iter(
+            [State.PENDING, State.PENDING, State.STARTED, State.STARTED, State.DONE])
+        self.runner_service.status_details.return_value = {"phase": "uploading"}
+
+        with mock.patch.object(JobWatcher, "_post", autospec=True) as mock_post:
+            self.watcher.add_callback(1, "http://localhost/hook")
+            while self.watcher._states:
+                yield gen.sleep(0.01)
+
+        self.assertListEqual(
+            [call[0][1:] for call in mock_post.call_args_list],
+            [("http://localhost/hook", {"job_id": "1", "state": State.STARTED, "previous_state": State.PENDING,
+                                        "phase": "uploading"}),
+             ("http://localhost/hook", {"job_id": "1", "state": State.DONE, "previous_state": State.STARTED,
+                                        "phase": "uploading"})])
@@ -0,0 +1,41 @@
+import unittest
+
+from archive_upload.lib.queueing import JobQueue
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def test_fifo(self):
+        queue = JobQueue(JobQueue.FIFO)
+        queue.add(2, "b", priority=10, group="a")
+        queue.add(1, "a", group="a")
+        self.assertListEqual(queue.ordered({"a": 5}), [1, 2])
+        self.assertEqual(queue.pop(1), "a")
+        self.assertNotIn(1, queue)
+        self.assertEqual(len(queue), 1)
+
+    def test_fair_share(self):
+        queue = JobQueue(JobQueue.FAIR_SHARE, aging_interval=60)
+        for job_id in [1, 2, 3]:
+            queue.add(job_id, None, group="run1")
+        queue.add(4, None, group="run2")
+        queue.add(5, None, priority=5, group="run1")
+        now = queue._jobs[5].queued_at
+
+        # the urgent job goes first, and run2 does not have to wait for all of run1
+        self.assertListEqual(queue.ordered(now=now), [5, 4, 1, 2, 3])
+        self.assertListEqual(queue.ordered({"run2": 3}, now=now), [5, 1, 2, 3, 4])
+
+    def test_aging(self):
+        queue = JobQueue(JobQueue.FAIR_SHARE, aging_interval=60)
+        queue.add(1, None, priority=0)
+        queue.add(2, None, priority=2)
+        queued_at = queue._jobs[1].queued_at
+        queue._jobs[1] = queue._jobs[1]._replace(queued_at=queued_at - 180)
+
+        self.assertAlmostEqual(queue.effective_priority(1, now=queued_at), 3)
+        self.assertListEqual(queue.ordered(now=queued_at), [1, 2])
+
+    def test_unknown_method(self):
+        with self.assertRaises(ValueError):
+            JobQueue("random")
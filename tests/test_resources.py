@@ -0,0 +1,27 @@
+import os
+import unittest
+
+from archive_upload.lib.resources import ResourcePool
+
+
+class TestResourcePool(unittest.TestCase):
+
+    def test_limits(self):
+        pool = ResourcePool({"tsm_session": 2, "disk": 1, "cpu": None})
+        upload = {ResourcePool.TSM_SESSION: 1, "disk:/data": 1}
+
+        self.assertListEqual(pool.missing(upload), [])
+        pool.acquire(upload)
+        self.assertListEqual(pool.missing(upload), ["disk:/data"])
+        # the disk limit applies to each volume
+        self.assertListEqual(pool.missing({ResourcePool.TSM_SESSION: 1, "disk:/other": 1}), [])
+        self.assertListEqual(pool.missing({"network": 10}), [])
+
+        pool.release(upload)
+        self.assertDictEqual(dict(pool.in_use), {})
+
+    def test_disk(self):
+        self.assertEqual(ResourcePool.volume_of("/"), "/")
+        volume = ResourcePool.volume_of(os.path.join(os.path.dirname(__file__), "no_such_file"))
+        self.assertTrue(os.path.ismount(volume))
+        self.assertEqual(ResourcePool.disk(__file__), "disk:{}".format(volume))
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from archive_upload.lib.runfolders import RunfolderCache
+
+
+class TestRunfolderCache(unittest.TestCase):
+
+    def setUp(self):
+        self.monitored_dir = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.monitored_dir, "runfolder"))
+        os.mkdir(os.path.join(self.monitored_dir, "runfolder", "subdir"))
+        os.symlink("runfolder", os.path.join(self.monitored_dir, "linked_runfolder"))
+        open(os.path.join(self.monitored_dir, "file"), "w").close()
+
+    def tearDown(self):
+        shutil.rmtree(self.monitored_dir)
+
+    def test_exists(self):
+        cache = RunfolderCache(self.monitored_dir)
+        self.assertTrue(cache.exists("runfolder"))
+        self.assertTrue(cache.exists("linked_runfolder"))
+        for name in ["file", "non-existant", "runfolder/subdir", "..", ".", ""]:
+            self.assertFalse(cache.exists(name), name)
+
+    def test_remembered_for_ttl(self):
+        cache = RunfolderCache(self.monitored_dir, ttl=10)
+        self.assertTrue(cache.exists("runfolder", now=100))
+        shutil.rmtree(os.path.join(self.monitored_dir, "runfolder"))
+        self.assertTrue(cache.exists("runfolder", now=109))
+        self.assertFalse(cache.exists("runfolder", now=110))
+
+        # new runfolders are found at once, missing ones are not remembered
+        self.assertFalse(cache.exists("new_runfolder", now=111))
+        os.mkdir(os.path.join(self.monitored_dir, "new_runfolder"))
+        self.assertTrue(cache.exists("new_runfolder", now=112))
+
+    def test_forget(self):
+        cache = RunfolderCache(self.monitored_dir, ttl=10)
+        self.assertTrue(cache.exists("runfolder", now=100))
+        shutil.rmtree(os.path.join(self.monitored_dir, "runfolder"))
+        cache.forget("runfolder")
+        self.assertFalse(cache.exists("runfolder", now=101))
+
+    def test_from_config(self):
+        cache = RunfolderCache.from_config({"runfolder_cache": {"ttl": 5}}, self.monitored_dir)
+        self.assertEqual(cache.ttl, 5)
+        self.assertIs(RunfolderCache.from_config({"runfolder_cache": {"ttl": 5}}, self.monitored_dir + "/"), cache)
+        # the settings of the first caller do not apply to the others
+        self.assertEqual(RunfolderCache.from_config({}, self.monitored_dir).ttl, 0)
@@ -0,0 +1,119 @@
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import unittest
+
+from archive_upload.lib.checksums import CHECKSUM_FILENAME
+from archive_upload.lib.tarstream import TarStreamer, main
+from tests.test_utils import DummyConfig
+
+
+class TestTarStreamer(unittest.TestCase):
+
+    def setUp(self):
+        self.dummy_config = DummyConfig()
+        self.tmpdir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.tmpdir, "testrunfolder_archive_tmp")
+        shutil.copytree(
+            os.path.join(self.dummy_config["path_to_archive_root"], "testrunfolder_archive_input"),
+            self.archive)
+        self.tarball_name = "testrunfolder_archive_tmp.tar.gz"
+        self.list_file = "{}.list".format(self.archive)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    @staticmethod
+    def _md5sum(path, files):
+        return subprocess.check_output(["md5sum"] + files, cwd=path).splitlines()
+
+    def test_tarball_members_and_checksums(self):
+        streamer = TarStreamer(self.archive, self.tarball_name, self.dummy_config["exclude_from_tarball"])
+        tarball_md5 = streamer.run()
+        streamer.write_list_file(self.list_file)
+        streamer.write_checksum_file(os.path.join(self.archive, CHECKSUM_FILENAME))
+
+        tarball = os.path.join(self.archive, self.tarball_name)
+        expected_members = [".", "./directory2", "./directory2/file.bin", "./directory2/file.txt",
+                            "./file.bin", "./file.txt"]
+        with tarfile.open(tarball) as tar:
+            self.assertListEqual(
+                expected_members,
+                sorted([m.name.rstrip("/") if m.name != "./" else "." for m in tar.getmembers()]))
+        with open(self.list_file) as fh:
+            self.assertListEqual(expected_members, sorted(fh.read().splitlines()))
+
+        # the checksum file covers the files kept as-is and the tarball, exactly as md5sum would write them
+        expected_checksums = self._md5sum(
+            self.archive, ["./directory3/file.zip", "./file.csv", "./{}".format(self.tarball_name)])
+        with open(os.path.join(self.archive, CHECKSUM_FILENAME)) as fh:
+            self.assertListEqual(expected_checksums, fh.read().splitlines())
+        self.assertEqual(tarball_md5, expected_checksums[-1].split()[0])
+
+        # the checksums of the tarball members are collected in the same pass
+        self.assertListEqual(
+            self._md5sum(self.archive, ["./directory2/file.bin", "./directory2/file.txt", "./file.bin", "./file.txt"]),
+            ["{}  {}".format(v, k) for k, v in sorted(streamer.member_checksums.items())])
+
+    def test_kept_tree_with_symlink_loop(self):
+        # a symlink back to a parent of a kept directory should not make the hashing loop forever
+        os.mkdir(os.path.join(self.archive, "directory3", "subdir"))
+        os.symlink(self.archive, os.path.join(self.archive, "directory3", "subdir", "loop"))
+        streamer = TarStreamer(self.archive, self.tarball_name, self.dummy_config["exclude_from_tarball"])
+        streamer.checksum_kept()
+
+        self.assertListEqual(sorted(streamer.kept_checksums.keys()), ["./directory3/file.zip", "./file.csv"])
+
+    def test_tarball_with_symlink_loop(self):
+        # like `tar --dereference`, a symlink back to a parent is not followed into the same files again
+        os.symlink("..", os.path.join(self.archive, "directory2", "up"))
+        streamer = TarStreamer(self.archive, self.tarball_name, self.dummy_config["exclude_from_tarball"])
+        streamer.run()
+
+        self.assertListEqual(
+            [".", "./directory2", "./directory2/file.bin", "./directory2/file.txt", "./directory2/up",
+             "./file.bin", "./file.txt"],
+            sorted(streamer.members))
+        self.assertListEqual(sorted(streamer.kept_checksums.keys()),
+                             ["./directory3/file.zip", "./file.csv", "./{}".format(self.tarball_name)])
+
+    def test_main(self):
+        member_checksum_file = "{}.md5".format(self.list_file)
+        progress_file = os.path.join(self.tmpdir, "progress.json")
+        with open(os.path.join(self.archive, "data.txt"), "w") as fh:
+            fh.write("a" * 1000)
+        main([self.archive,
+              "--tarball", self.tarball_name,
+              "--exclude", "directory3",
+              "--list-file", self.list_file,
+              "--member-checksum-file", member_checksum_file,
+              "--progress-file", progress_file])
+
+        self.assertTrue(os.path.exists(os.path.join(self.archive, self.tarball_name)))
+        self.assertTrue(os.path.exists(os.path.join(self.archive, CHECKSUM_FILENAME)))
+        with open(member_checksum_file) as fh:
+            self.assertIn("./file.csv", fh.read())
+        with open(progress_file) as fh:
+            progress = json.load(fh)
+        self.assertTrue(progress["done"])
+        # the kept files and the tarball are hashed as well as the members
+        self.assertGreaterEqual(progress["bytes_compressed"], 1000)
+        self.assertGreater(progress["bytes_hashed"], progress["bytes_compressed"])
+
+    def test_main_kept_only(self):
+        kept_checksum_file = os.path.join(self.tmpdir, "kept.md5")
+        main([self.archive,
+              "--tarball", self.tarball_name,
+              "--exclude", "directory3",
+              "--exclude", "file.csv",
+              "--kept-only",
+              "--checksum-file", kept_checksum_file])
+
+        self.assertFalse(os.path.exists(os.path.join(self.archive, self.tarball_name)))
+        with open(kept_checksum_file) as fh:
+            self.assertListEqual(
+                self._md5sum(self.archive, ["./directory3/file.zip", "./file.csv"]),
+                fh.read().splitlines())
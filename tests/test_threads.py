@@ -0,0 +1,52 @@
+import threading
+
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
+
+from archive_upload.lib import threads
+from archive_upload.lib.threads import run_in_thread
+
+
+class TestRunInThread(AsyncTestCase):
+
+    def tearDown(self):
+        threads.configure({})
+        super(TestRunInThread, self).tearDown()
+
+    @gen_test
+    def test_result_and_exception(self):
+        result = yield run_in_thread(lambda a, b=0: a + b, 1, b=2)
+        self.assertEqual(result, 3)
+
+        def fail():
+            raise ValueError("failed")
+
+        with self.assertRaises(ValueError):
+            yield run_in_thread(fail)
+
+    @gen_test
+    def test_bounded_pool(self):
+        threads.configure({"thread_pool": {"max_workers": 2}})
+        lock = threading.Lock()
+        running = [0]
+        most_running = [0]
+        release = threading.Event()
+
+        def work():
+            with lock:
+                running[0] += 1
+                most_running[0] = max(most_running[0], running[0])
+            release.wait(5)
+            with lock:
+                running[0] -= 1
+
+        pending = [run_in_thread(work) for _ in range(5)]
+        yield gen.sleep(0.05)
+        self.assertEqual(running[0], 2)
+        release.set()
+        yield pending
+        self.assertEqual(most_running[0], 2)
+
+    def test_invalid_max_workers(self):
+        with self.assertRaises(ValueError):
+            threads.configure({"thread_pool": {"max_workers": 0}})
@@ -1,3 +1,5 @@
+import os
+
 
 class TestUtils:
 
@@ -10,6 +12,29 @@ class TestUtils:
         "tsm_mock_enabled": False
     }
 
+    @staticmethod
+    def enabled_features_config(directory):
+        """
+        The sections of the config for the features that are off by default, with the features enabled
+
+        :param directory: where the manifests, the inventory and the job store are kept
+        :return: a dict to update the DUMMY_CONFIG with
+        """
+        return {
+            "runfolder_cache": {"ttl": 10, "inotify": True},
+            "resources": {"tsm_session": 2, "disk": 1},
+            "scheduling": {"method": "fair_share", "aging_interval": 600},
+            "create_dir": {"mode": "native"},
+            "manifest": {"enabled": True, "directory": os.path.join(directory, "manifests")},
+            "inventory": {"enabled": True, "database": os.path.join(directory, "inventory.sqlite")},
+            "reupload": {"compare": "checksum"},
+            "events": {"enabled": True},
+            "job_store": {
+                "enabled": True,
+                "database": os.path.join(directory, "jobs.sqlite"),
+                "directory": os.path.join(directory, "jobs")}
+        }
+
 class DummyConfig(dict):
 
     def __init__(self):